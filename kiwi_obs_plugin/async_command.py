@@ -0,0 +1,119 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import asyncio
+import logging
+from typing import (
+    Any, IO, List, Union
+)
+
+# project
+from kiwi.exceptions import KiwiCommandError
+
+log: Any = logging.getLogger('kiwi')
+
+
+class AsyncCommand:
+    """
+    **Implements running commands as subprocess of the asyncio
+    event loop**
+
+    The asyncio counterpart of kiwi's Command.run, the event
+    loop keeps running while the command runs
+    """
+    @staticmethod
+    async def run(command: List[str]) -> bytes:
+        """
+        Run the given command and wait for it to exit. If the
+        waiting coroutine gets cancelled the command is killed
+
+        :param list command: command and arguments
+
+        :raises KiwiCommandError: if the command could not be
+            started or exited with an error code not equal to zero
+
+        :return: output of the command on stdout
+
+        :rtype: bytes
+        """
+        return await AsyncCommand.wait(
+            await AsyncCommand.start(command), command
+        )
+
+    @staticmethod
+    async def start(
+        command: List[str], stdout: Union[int, IO] = asyncio.subprocess.PIPE
+    ) -> asyncio.subprocess.Process:
+        """
+        Start the given command, see wait to wait for it to exit
+
+        :param list command: command and arguments
+        :param object stdout:
+            file descriptor or file object the command writes its
+            output to, by default the output is collected by wait
+
+        :raises KiwiCommandError: if the command could not be started
+
+        :return: process of the command
+
+        :rtype: asyncio.subprocess.Process
+        """
+        log.debug(f'EXEC: [{" ".join(command)}]')
+        try:
+            return await asyncio.create_subprocess_exec(
+                *command, stdout=stdout, stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as issue:
+            raise KiwiCommandError(
+                f'{command[0]}: {type(issue).__name__}: {issue}'
+            )
+
+    @staticmethod
+    async def wait(
+        process: asyncio.subprocess.Process, command: List[str]
+    ) -> bytes:
+        """
+        Wait for the process of the given command started by start
+        to exit. If the waiting coroutine gets cancelled the
+        process is killed
+
+        :param asyncio.subprocess.Process process: process to wait for
+        :param list command: command and arguments of the process
+
+        :raises KiwiCommandError:
+            if the command exited with an error code not equal to zero
+
+        :return:
+            output of the command on stdout, empty if the output
+            was not collected
+
+        :rtype: bytes
+        """
+        try:
+            (output, error) = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        output = output or b''
+        if process.returncode != 0:
+            error_text = error.decode() or '(no output on stderr)'
+            output_text = output.decode() or '(no output on stdout)'
+            raise KiwiCommandError(
+                f'{command[0]}: stderr: {error_text}, stdout: {output_text}'
+            )
+        return output
@@ -0,0 +1,288 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import copy
+import shutil
+import asyncio
+import logging
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any, Callable, Dict, IO, List, Optional
+)
+
+# project
+from kiwi.xml_state import XMLState
+
+from kiwi.exceptions import KiwiCommandError
+
+from kiwi_obs_plugin.async_command import AsyncCommand
+from kiwi_obs_plugin.obs import (
+    OBS, obs_checkout_type, obs_repo_status_type, git_clone_type,
+    git_clone_request_type, git_source_type
+)
+
+from kiwi_obs_plugin.exceptions import KiwiOBSPluginSourceError
+
+log: Any = logging.getLogger('kiwi')
+
+
+class AsyncOBS:
+    """
+    **Implements an asyncio interface to the Open Build Service API**
+
+    The git sources referenced by a _service file are fetched
+    on the event loop, git runs as subprocess of the loop and a
+    cancelled fetch kills its git processes.
+
+    The requests to OBS and the repository servers are sent by
+    the blocking HTTP session of the wrapped OBS instance in a
+    thread pool of at most jobs threads. Further calls wait in
+    the queue of the pool, thus thousands of concurrent checkouts
+    do not need thousands of threads. A cancelled call which did
+    not get a thread yet is never started. A running call stops
+    at its next request and is waited for, such that it does not
+    outlive the cancelled coroutine
+
+    :param OBS obs: OBS instance to wrap
+    :param int jobs:
+        max number of concurrent blocking calls and of concurrent
+        git clones per checkout
+    """
+    def __init__(self, obs: OBS, jobs: int = 4):
+        self.obs = obs
+        self.jobs = jobs
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+
+    def for_image(self, image_path: str) -> 'AsyncOBS':
+        """
+        Create an asyncio OBS API access for another project and
+        package which shares the thread pool as well as everything
+        OBS.for_image shares
+
+        :param str image_path: OBS project/package path
+
+        :return: AsyncOBS instance
+
+        :rtype: AsyncOBS
+        """
+        async_obs = copy.copy(self)
+        async_obs.obs = self.obs.for_image(image_path)
+        return async_obs
+
+    async def fetch_obs_image(
+        self, checkout_dir: str, force: bool = False,
+        profile: Optional[list] = None, sync: bool = False,
+        bulk: bool = False, pipeline: bool = False,
+        arch: str = 'x86_64', repo: str = 'images'
+    ) -> obs_checkout_type:
+        """
+        Fetch image description from the obs project,
+        see OBS.fetch_obs_image. The git sources are fetched
+        by resolve_git_source_service
+        """
+        obs_checkout = await self._run(
+            'fetch_obs_image', checkout_dir, force, profile,
+            sync, bulk, pipeline, arch, repo, False
+        )
+        if os.path.exists(os.sep.join([checkout_dir, '_service'])):
+            await self.resolve_git_source_service(checkout_dir)
+        return obs_checkout
+
+    async def add_obs_repositories(
+        self, xml_state: XMLState, profile: Optional[str] = None,
+        arch: str = 'x86_64', repo: str = 'images'
+    ) -> Dict[str, obs_repo_status_type]:
+        """
+        Add repositories from the obs project to the provided
+        XMLState, see OBS.add_obs_repositories
+        """
+        return await self._run(
+            'add_obs_repositories', xml_state, profile, arch, repo
+        )
+
+    async def resolve_git_source_service(self, checkout_dir: str) -> None:
+        """
+        Fetch the sources referenced by the obs_scm services of
+        the _service file in checkout_dir. Up to jobs repositories
+        are cloned at the same time. Extracted files are exported
+        by git archive, while files and directories from a working
+        tree are copied in the thread pool
+
+        :param str checkout_dir: checkout directory
+        """
+        log.info('Looking up git source service...')
+        git_sources = OBS.get_git_sources(checkout_dir)
+        mirror_locks: List[IO[str]] = []
+        try:
+            if self.obs.git_cache:
+                # The mirrors must not be evicted while they are read
+                for url in set(git_source.clone for git_source in git_sources):
+                    mirror_locks.append(
+                        await self.obs.git_cache.lock_async(url)
+                    )
+            await self._fetch_git_sources(checkout_dir, git_sources)
+        finally:
+            for mirror_lock in mirror_locks:
+                mirror_lock.close()
+        if self.obs.git_cache:
+            await self._call(self.obs.git_cache.evict)
+
+    def close(self) -> None:
+        """
+        Shutdown the thread pool once the running calls completed
+        """
+        self.pool.shutdown(wait=True)
+
+    @staticmethod
+    async def gather(*coroutines: Any) -> List[Any]:
+        """
+        Run the given coroutines concurrently as one unit. If one
+        of them fails or the caller gets cancelled, all others are
+        cancelled and waited for before the exception is raised,
+        such that no coroutine outlives the call
+
+        :return: results in the order of the given coroutines
+
+        :rtype: list
+        """
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _fetch_git_sources(
+        self, checkout_dir: str, git_sources: List[git_source_type]
+    ) -> None:
+        clone_requests = OBS.get_git_clone_requests(checkout_dir, git_sources)
+        clone_slots = asyncio.BoundedSemaphore(self.jobs)
+        git_dirs = await AsyncOBS.gather(
+            *[
+                self._clone_git_source(clone_request, clone_slots)
+                for clone_request in clone_requests
+            ]
+        )
+        git_clones = {
+            (clone_request.url, clone_request.revision): git_clone_type(
+                git_dir=git_dir, checkout=clone_request.checkout
+            ) for (clone_request, git_dir) in zip(clone_requests, git_dirs)
+        }
+        for git_source in git_sources:
+            git_clone = git_clones[(git_source.clone, git_source.revision)]
+            if git_clone.checkout:
+                await self._call(
+                    OBS.copy_git_source, git_clone.git_dir, git_source,
+                    checkout_dir, self.jobs
+                )
+            elif git_source.files:
+                await self._export_git_files(
+                    git_clone.git_dir, git_source, checkout_dir
+                )
+
+    async def _clone_git_source(
+        self, clone_request: git_clone_request_type,
+        clone_slots: asyncio.BoundedSemaphore
+    ) -> str:
+        async with clone_slots:
+            (url, revision, target_dir) = (
+                clone_request.url, clone_request.revision,
+                clone_request.target_dir
+            )
+            log.info(f'Cloning git: {url!r} at {revision!r}')
+            if os.path.exists(target_dir):
+                await self._call(shutil.rmtree, target_dir)
+            promisor_url = None
+            if self.obs.git_cache:
+                mirror_dir = await self.obs.git_cache.update_async(url)
+                if not clone_request.checkout:
+                    # git archive reads from the mirror directly
+                    return mirror_dir
+                (url, promisor_url) = (f'file://{mirror_dir}', url)
+            (clone_command, checkout_command) = OBS.get_git_clone_commands(
+                url, revision, target_dir, clone_request.sparse_paths,
+                promisor_url
+            )
+            await AsyncCommand.run(clone_command)
+            if clone_request.checkout:
+                OBS.write_git_sparse_checkout(
+                    target_dir, clone_request.sparse_paths
+                )
+                await AsyncCommand.run(checkout_command)
+            return target_dir
+
+    async def _export_git_files(
+        self, git_dir: str, git_source: git_source_type, checkout_dir: str
+    ) -> None:
+        log.info(f'Fetching from {git_source.source_dir!r}')
+        for source_file in git_source.files:
+            log.info(f'--> {source_file!r}')
+        source_files = OBS.get_git_source_files(git_source)
+        git_archive = OBS.get_git_archive_command(
+            git_dir, git_source.revision, source_files
+        )
+        (archive_fd, output_fd) = os.pipe()
+        with open(archive_fd, 'rb') as archive:
+            try:
+                try:
+                    process = await AsyncCommand.start(
+                        git_archive, stdout=output_fd
+                    )
+                finally:
+                    # The archive ends once git exits
+                    os.close(output_fd)
+                # The archive is extracted in the thread pool while
+                # git produces it. If one of them fails the other
+                # one is stopped
+                await AsyncOBS.gather(
+                    AsyncCommand.wait(process, git_archive),
+                    self._call(
+                        OBS.extract_git_archive, archive, checkout_dir
+                    )
+                )
+            except (KiwiCommandError, tarfile.TarError) as issue:
+                raise KiwiOBSPluginSourceError(
+                    f'git archive of {source_files} failed: {issue}'
+                )
+
+    async def _run(self, method: str, *args: Any) -> Any:
+        cancel_event = threading.Event()
+        return await self._call(
+            getattr(self.obs.with_cancel_event(cancel_event), method),
+            *args, cancel_event=cancel_event
+        )
+
+    async def _call(
+        self, function: Callable, *args: Any,
+        cancel_event: Optional[threading.Event] = None
+    ) -> Any:
+        call = self.pool.submit(function, *args)
+        result = asyncio.wrap_future(call)
+        try:
+            return await asyncio.shield(result)
+        except asyncio.CancelledError:
+            if cancel_event:
+                cancel_event.set()
+            if not call.cancel():
+                # The running call stops at its next request
+                await asyncio.gather(result, return_exceptions=True)
+            raise
@@ -0,0 +1,83 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import time
+import threading
+from typing import Dict
+
+
+class CircuitBreaker:
+    """
+    **Implements a per host circuit breaker**
+
+    After threshold consecutive failed requests to a host the
+    circuit for that host opens and further requests are refused
+    without contacting the host. Once reset_timeout seconds
+    passed, one request is let through to check if the host is
+    back. A successful request closes the circuit again
+
+    :param int threshold: number of consecutive failures
+    :param float reset_timeout: time in seconds the circuit stays open
+    """
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures: Dict[str, int] = {}
+        self.opened: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def allow(self, host: str) -> bool:
+        """
+        Check if a request to host is allowed
+
+        :param str host: host name
+
+        :return: False if the circuit for host is open
+
+        :rtype: bool
+        """
+        with self.lock:
+            opened = self.opened.get(host)
+            if opened is None:
+                return True
+            if time.monotonic() - opened >= self.reset_timeout:
+                # Let one trial request pass per reset_timeout
+                self.opened[host] = time.monotonic()
+                return True
+            return False
+
+    def record_success(self, host: str) -> None:
+        """
+        Close the circuit for host
+
+        :param str host: host name
+        """
+        with self.lock:
+            self.failures.pop(host, None)
+            self.opened.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        """
+        Count a failed request to host and open the circuit
+        if the threshold is reached
+
+        :param str host: host name
+        """
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.threshold:
+                self.opened[host] = time.monotonic()
@@ -0,0 +1,133 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import stat
+import logging
+from typing import (
+    Any, IO, List, Optional
+)
+
+# project
+from kiwi_obs_plugin.file_copy import FileCopy
+from kiwi_obs_plugin.exceptions import KiwiOBSPluginCpioError
+
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = 'TRAILER!!!'
+
+# Name of the archive member OBS appends if an error
+# happened while the archive was sent
+CPIO_ERRORS = '.errors'
+
+CPIO_CHUNK_SIZE = 1 << 16
+
+log: Any = logging.getLogger('kiwi')
+
+
+class Cpio:
+    """
+    **Implements streaming extraction of cpio archives in the
+    SVR4 (newc) format as served by the OBS backend**
+
+    The archive is read from the stream member by member and
+    each member is written to disk as it arrives. Neither the
+    archive nor a complete member is kept in memory
+
+    :param IO stream: binary file like object to read from
+    """
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+
+    def extract(
+        self, target_dir: str, names: Optional[List[str]] = None
+    ) -> List[str]:
+        """
+        Extract regular file members into target_dir
+
+        :param str target_dir: existing directory to extract to
+        :param list names:
+            extract only the members with the given names,
+            all other members are skipped
+
+        :return: list of extracted member names
+
+        :rtype: list
+        """
+        extracted = []
+        while True:
+            (name, mode, size) = self._read_header()
+            if name == CPIO_TRAILER:
+                break
+            if name == CPIO_ERRORS:
+                raise KiwiOBSPluginCpioError(
+                    self._read_exact(size).decode(errors='replace').strip()
+                )
+            if not name or os.sep in name or name in ('.', '..'):
+                raise KiwiOBSPluginCpioError(
+                    f'Invalid cpio member name: {name!r}'
+                )
+            if stat.S_ISREG(mode) and (names is None or name in names):
+                log.info(f'--> {name}')
+                FileCopy.remove(os.sep.join([target_dir, name]))
+                with open(os.sep.join([target_dir, name]), 'wb') as target:
+                    self._copy_data(size, target)
+                extracted.append(name)
+            else:
+                self._copy_data(size, None)
+            self._skip_padding(size)
+        return extracted
+
+    def _read_header(self):
+        header = self._read_exact(CPIO_HEADER_SIZE)
+        if header[0:6] not in (b'070701', b'070702'):
+            raise KiwiOBSPluginCpioError(
+                'Not a cpio archive in newc format'
+            )
+        try:
+            fields = [
+                int(header[offset:offset + 8], 16)
+                for offset in range(6, CPIO_HEADER_SIZE, 8)
+            ]
+        except ValueError as issue:
+            raise KiwiOBSPluginCpioError(
+                f'Invalid cpio header: {issue}'
+            )
+        (mode, size, name_size) = (fields[1], fields[6], fields[11])
+        name = self._read_exact(name_size).rstrip(b'\0').decode()
+        self._skip_padding(CPIO_HEADER_SIZE + name_size)
+        return (name, mode, size)
+
+    def _copy_data(self, size: int, target: Optional[IO[bytes]]) -> None:
+        while size:
+            chunk = self._read_exact(min(size, CPIO_CHUNK_SIZE))
+            if target:
+                target.write(chunk)
+            size -= len(chunk)
+
+    def _skip_padding(self, size: int) -> None:
+        self._read_exact((4 - size % 4) % 4)
+
+    def _read_exact(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.stream.read(size - len(data))
+            if not chunk:
+                raise KiwiOBSPluginCpioError(
+                    'Unexpected end of cpio archive'
+                )
+            data += chunk
+        return data
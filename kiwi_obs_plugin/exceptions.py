@@ -40,7 +40,34 @@ class KiwiOBSPluginSourceError(KiwiError):
     """
 
 
+class KiwiOBSPluginCpioError(KiwiError):
+    """
+    Exception raised if a cpio archive stream could not be
+    extracted
+    """
+
+
 class KiwiOBSPluginCredentialsError(KiwiError):
     """
     Exception raised if the the OBS credentials setup failed
     """
+
+
+class KiwiOBSPluginManifestError(KiwiError):
+    """
+    Exception raised if a manifest of OBS images is invalid
+    """
+
+
+class KiwiOBSPluginJobsError(KiwiError):
+    """
+    Exception raised if the number of concurrent jobs is not
+    a positive integer
+    """
+
+
+class KiwiOBSPluginCancelledError(KiwiError):
+    """
+    Exception raised if a request is not sent because the call
+    it belongs to got cancelled
+    """
@@ -0,0 +1,199 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import fcntl
+import shutil
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    List, Optional, Tuple
+)
+
+# ioctl request to share the data blocks of a file, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+class FileCopy:
+    """
+    **Implements copying of files using the cheapest method
+    supported by the underlying filesystem**
+    """
+    @staticmethod
+    def link_or_copy(source: str, target: str) -> None:
+        """
+        Materialize source file as target file. A reflink is tried
+        first, then a hardlink and if both are not supported the
+        data is copied. An existing target file is replaced and
+        never written to, as it might share its data with other
+        files
+
+        :param str source: source file path
+        :param str target: target file path
+        """
+        FileCopy.remove(target)
+        if FileCopy._reflink(source, target):
+            return
+        try:
+            os.link(source, target)
+            return
+        except OSError:
+            pass
+        FileCopy._copy_data(source, target)
+
+    @staticmethod
+    def copy(source: str, target: str) -> None:
+        """
+        Copy source file or symlink to target like cp -a does.
+        The data is materialized using link_or_copy, mode and
+        timestamps are preserved and symlinks are recreated
+
+        :param str source: source file path
+        :param str target: target file path
+        """
+        if os.path.islink(source):
+            FileCopy.remove(target)
+            os.symlink(os.readlink(source), target)
+            return
+        FileCopy.link_or_copy(source, target)
+        shutil.copystat(source, target)
+
+    @staticmethod
+    def copy_tree(
+        source_dir: str, target_dir: str, jobs: int = 4,
+        excludes: Optional[List[str]] = None
+    ) -> None:
+        """
+        Copy the directory tree source_dir to target_dir like
+        cp -a does. The directories are created first, then the
+        files are copied by a pool of at most jobs concurrent
+        copies. The directory timestamps are preserved at the
+        end once their content is complete
+
+        :param str source_dir: source directory path
+        :param str target_dir: target directory path
+        :param int jobs: max number of concurrent copies
+        :param list excludes:
+            shell patterns of files and directories not to copy.
+            A pattern without a slash matches the name at any
+            depth, otherwise the path relative to source_dir
+        """
+        directories: List[Tuple[str, str]] = []
+        files: List[Tuple[str, str]] = []
+        for (root, dirs, names) in os.walk(source_dir):
+            if excludes:
+                dirs[:] = FileCopy._filter_excludes(
+                    source_dir, root, dirs, excludes
+                )
+                names = FileCopy._filter_excludes(
+                    source_dir, root, names, excludes
+                )
+            target_root = os.path.normpath(
+                os.sep.join([target_dir, os.path.relpath(root, source_dir)])
+            )
+            os.makedirs(target_root, exist_ok=True)
+            directories.append((root, target_root))
+            for name in names + [
+                name for name in dirs
+                if os.path.islink(os.sep.join([root, name]))
+            ]:
+                files.append(
+                    (os.sep.join([root, name]), os.sep.join([target_root, name]))
+                )
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            copies = [
+                pool.submit(FileCopy.copy, source, target)
+                for (source, target) in files
+            ]
+        for copy in copies:
+            copy.result()
+        for (source, target) in reversed(directories):
+            shutil.copystat(source, target)
+
+    @staticmethod
+    def remove(target: str) -> None:
+        """
+        Delete target file if it exists
+
+        :param str target: file path
+        """
+        if os.path.lexists(target):
+            os.remove(target)
+
+    @staticmethod
+    def _filter_excludes(
+        source_dir: str, root: str, names: List[str], excludes: List[str]
+    ) -> List[str]:
+        result = []
+        for name in names:
+            path = os.path.relpath(os.sep.join([root, name]), source_dir)
+            for exclude in excludes:
+                exclude = exclude.strip('/')
+                if fnmatch.fnmatchcase(
+                    path if '/' in exclude else name, exclude
+                ):
+                    break
+            else:
+                result.append(name)
+        return result
+
+    @staticmethod
+    def _copy_data(source: str, target: str) -> None:
+        """
+        Copy the data of source to target inside of the kernel
+        using copy_file_range, or sendfile on Python versions
+        without copy_file_range. If the kernel refuses, the data
+        is copied in user space
+        """
+        copy_file_range = getattr(os, 'copy_file_range', None)
+        with open(source, 'rb') as source_fd:
+            with open(target, 'wb') as target_fd:
+                size = os.fstat(source_fd.fileno()).st_size
+                try:
+                    copied = 0
+                    while copied < size:
+                        if copy_file_range:
+                            count = copy_file_range(
+                                source_fd.fileno(), target_fd.fileno(),
+                                size - copied
+                            )
+                        else:
+                            count = os.sendfile(
+                                target_fd.fileno(), source_fd.fileno(),
+                                None, size - copied
+                            )
+                        if not count:
+                            break
+                        copied += count
+                except OSError:
+                    source_fd.seek(0)
+                    target_fd.seek(0)
+                    target_fd.truncate()
+                    shutil.copyfileobj(source_fd, target_fd)
+
+    @staticmethod
+    def _reflink(source: str, target: str) -> bool:
+        try:
+            with open(source, 'rb') as source_fd:
+                with open(target, 'wb') as target_fd:
+                    fcntl.ioctl(
+                        target_fd.fileno(), FICLONE, source_fd.fileno()
+                    )
+            return True
+        except OSError:
+            FileCopy.remove(target)
+            return False
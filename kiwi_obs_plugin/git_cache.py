@@ -0,0 +1,267 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import fcntl
+import shutil
+import asyncio
+import hashlib
+import logging
+from tempfile import mkdtemp
+from typing import (
+    Any, IO, List, Set, Tuple
+)
+
+# project
+from kiwi.command import Command
+
+from kiwi.exceptions import KiwiCommandError
+
+from kiwi_obs_plugin.async_command import AsyncCommand
+
+log: Any = logging.getLogger('kiwi')
+
+# Seconds between two attempts to lock a mirror from a coroutine
+LOCK_POLL_INTERVAL = 0.1
+
+
+class GitCache:
+    """
+    **Implements a cache of bare git mirrors**
+
+    Each git repository is mirrored once per clone url. Further
+    use of the same url only fetches the changes into the mirror.
+    Checkouts are then cloned from the local mirror instead of
+    the network. The mirrors are blobless, file content is only
+    fetched from the server once it is used. If a mirror can not
+    be updated, e.g because the server is not reachable, the
+    outdated mirror is used. If the size of all mirrors exceeds
+    max_size the least recently used mirrors are evicted. A
+    mirror is only evicted if nobody holds a lock from lock
+    or lock_async for it
+
+    :param str cache_dir: cache directory
+    :param int max_size: size budget in bytes
+    """
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.updated: Set[str] = set()
+
+    def lock(self, url: str) -> IO[str]:
+        """
+        Lock the mirror of the git repository at url against its
+        eviction. The lock must be taken before the mirror gets
+        updated and held as long as the mirror is read, e.g by a
+        clone or git archive. The lock is shared with all other
+        users of the mirror
+
+        :param str url: git repository url
+
+        :return: lock file, closing it releases the lock
+
+        :rtype: file object
+        """
+        lock = self._open_lock(url, 'use')
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        return lock
+
+    async def lock_async(self, url: str) -> IO[str]:
+        """
+        Lock the mirror of the git repository at url against its
+        eviction like lock does, as a coroutine
+
+        :param str url: git repository url
+
+        :return: lock file, closing it releases the lock
+
+        :rtype: file object
+        """
+        lock = self._open_lock(url, 'use')
+        try:
+            await GitCache._flock_async(lock, fcntl.LOCK_SH)
+        except BaseException:
+            lock.close()
+            raise
+        return lock
+
+    def update(self, url: str) -> str:
+        """
+        Create or update the mirror of the git repository at url.
+        A mirror is updated only once per GitCache instance. The
+        mirror must be locked by lock
+
+        :param str url: git repository url
+
+        :return: mirror directory path
+
+        :rtype: str
+        """
+        mirror_dir = self._get_mirror_path(url)
+        with self._open_lock(url, 'lock') as lock:
+            # Serializes mirror updates of threads and processes
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if url not in self.updated or not os.path.isdir(mirror_dir):
+                if os.path.isdir(mirror_dir):
+                    log.info(f'Updating git mirror of {url!r}')
+                    try:
+                        Command.run(GitCache._get_fetch_command(mirror_dir))
+                    except KiwiCommandError as issue:
+                        log.warning(
+                            f'Using outdated git mirror of {url!r}: {issue}'
+                        )
+                else:
+                    log.info(f'Creating git mirror of {url!r}')
+                    self._create_mirror(url, mirror_dir)
+                self.updated.add(url)
+            os.utime(mirror_dir)
+        return mirror_dir
+
+    async def update_async(self, url: str) -> str:
+        """
+        Create or update the mirror of the git repository at url
+        like update does, as a coroutine. git runs as subprocess
+        of the event loop, and waiting for a mirror locked by
+        another thread or process does not block the event loop.
+        The mirror must be locked by lock_async
+
+        :param str url: git repository url
+
+        :return: mirror directory path
+
+        :rtype: str
+        """
+        mirror_dir = self._get_mirror_path(url)
+        with self._open_lock(url, 'lock') as lock:
+            await GitCache._flock_async(lock, fcntl.LOCK_EX)
+            if url not in self.updated or not os.path.isdir(mirror_dir):
+                if os.path.isdir(mirror_dir):
+                    log.info(f'Updating git mirror of {url!r}')
+                    try:
+                        await AsyncCommand.run(
+                            GitCache._get_fetch_command(mirror_dir)
+                        )
+                    except KiwiCommandError as issue:
+                        log.warning(
+                            f'Using outdated git mirror of {url!r}: {issue}'
+                        )
+                else:
+                    log.info(f'Creating git mirror of {url!r}')
+                    mirror_tmp = mkdtemp(dir=self.cache_dir)
+                    try:
+                        for command in GitCache._get_mirror_commands(
+                            url, mirror_tmp
+                        ):
+                            await AsyncCommand.run(command)
+                    except BaseException:
+                        # Also a cancelled update leaves no trace
+                        shutil.rmtree(mirror_tmp, ignore_errors=True)
+                        raise
+                    os.rename(mirror_tmp, mirror_dir)
+                self.updated.add(url)
+            os.utime(mirror_dir)
+        return mirror_dir
+
+    def evict(self) -> None:
+        """
+        Delete least recently used mirrors until the size of all
+        mirrors fits into max_size. Mirrors which are locked by
+        another user, in this or another process, are kept
+        """
+        entries: List[Tuple[float, int, str]] = []
+        cache_size = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.git'):
+                continue
+            mirror_dir = os.sep.join([self.cache_dir, name])
+            mirror_size = GitCache._get_size(mirror_dir)
+            entries.append(
+                (os.stat(mirror_dir).st_mtime, mirror_size, mirror_dir)
+            )
+            cache_size += mirror_size
+        for (mtime, size, mirror_dir) in sorted(entries):
+            if cache_size <= self.max_size:
+                break
+            with open(f'{mirror_dir}.use', 'a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                log.debug(f'Evicting git mirror {mirror_dir!r}')
+                shutil.rmtree(mirror_dir, ignore_errors=True)
+            cache_size -= size
+
+    def _create_mirror(self, url: str, mirror_dir: str) -> None:
+        mirror_tmp = mkdtemp(dir=self.cache_dir)
+        try:
+            for command in GitCache._get_mirror_commands(url, mirror_tmp):
+                Command.run(command)
+        except Exception:
+            shutil.rmtree(mirror_tmp, ignore_errors=True)
+            raise
+        os.rename(mirror_tmp, mirror_dir)
+
+    def _open_lock(self, url: str, name: str) -> IO[str]:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return open(f'{self._get_mirror_path(url)}.{name}', 'a')
+
+    @staticmethod
+    async def _flock_async(lock: IO[str], operation: int) -> None:
+        while True:
+            try:
+                fcntl.flock(lock, operation | fcntl.LOCK_NB)
+                return
+            except OSError:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+    @staticmethod
+    def _get_mirror_commands(url: str, mirror_dir: str) -> List[List[str]]:
+        return [
+            # The mirror stays a partial clone of url, missing blobs
+            # are fetched from there once a clone or archive needs
+            # them
+            [
+                'git', 'clone', '--mirror', '--filter=blob:none',
+                url, mirror_dir
+            ],
+            # Allow blobless clones from the mirror
+            [
+                'git', '-C', mirror_dir,
+                'config', 'uploadpack.allowFilter', 'true'
+            ]
+        ]
+
+    @staticmethod
+    def _get_fetch_command(mirror_dir: str) -> List[str]:
+        return ['git', '-C', mirror_dir, 'fetch', '--prune']
+
+    def _get_mirror_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode()).hexdigest()[0:16]
+        return os.sep.join([self.cache_dir, f'{key}.git'])
+
+    @staticmethod
+    def _get_size(path: str) -> int:
+        size = 0
+        for (root, dirs, files) in os.walk(path):
+            for name in files:
+                try:
+                    size += os.lstat(os.sep.join([root, name])).st_size
+                except OSError:
+                    pass
+        return size
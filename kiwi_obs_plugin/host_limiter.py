@@ -0,0 +1,83 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import time
+import threading
+from typing import (
+    Dict, Tuple
+)
+
+
+class HostLimiter:
+    """
+    **Implements per host limits for the request rate and the
+    number of requests in flight**
+
+    The request rate is enforced by a token bucket per host
+    which holds up to max(1, rate) tokens, such that short
+    bursts are possible while the average rate does not exceed
+    rate. The number of requests in flight is enforced by a
+    semaphore per host. A value of 0 switches a limit off
+
+    :param float rate: max number of requests per second and host
+    :param int max_requests: max number of requests in flight per host
+    """
+    def __init__(self, rate: float, max_requests: int):
+        self.rate = rate
+        self.max_requests = max_requests
+        self.burst = max(1.0, rate)
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.slots: Dict[str, threading.BoundedSemaphore] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, host: str) -> None:
+        """
+        Wait until a request to host is allowed. Each call
+        must be followed by a call of release
+
+        :param str host: host name
+        """
+        if self.max_requests:
+            with self.lock:
+                slot = self.slots.setdefault(
+                    host, threading.BoundedSemaphore(self.max_requests)
+                )
+            slot.acquire()
+        if self.rate:
+            self._take_token(host)
+
+    def release(self, host: str) -> None:
+        """
+        Mark a request to host as finished
+
+        :param str host: host name
+        """
+        if self.max_requests:
+            self.slots[host].release()
+
+    def _take_token(self, host: str) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                (tokens, last) = self.buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self.buckets[host] = (tokens - 1, now)
+                    return
+                self.buckets[host] = (tokens, now)
+                delay = (1 - tokens) / self.rate
+            time.sleep(delay)
@@ -0,0 +1,241 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import json
+import hashlib
+import logging
+from tempfile import mkstemp
+from typing import (
+    Any, Dict, Iterator, List, Optional, Tuple
+)
+
+log: Any = logging.getLogger('kiwi')
+
+
+class HTTPCache:
+    """
+    **Implements a cache for HTTP responses which is revalidated
+    by conditional requests**
+
+    Responses which carry an ETag or Last-Modified header are
+    stored while they are streamed to the consumer. For the next
+    request of the same url the stored validators are sent as
+    If-None-Match and If-Modified-Since headers. If the server
+    answers with 304 Not Modified, the stored response is used.
+    If the size of all entries exceeds max_size the least
+    recently used entries are evicted
+
+    :param str cache_dir: cache directory
+    :param int max_size: size budget in bytes
+    :param str namespace:
+        prefix of the entry keys, e.g the account name as the
+        response of the server depends on the access rights
+    """
+    def __init__(self, cache_dir: str, max_size: int, namespace: str = ''):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.namespace = namespace
+
+    def get_conditional_headers(self, url: str) -> Dict[str, str]:
+        """
+        Return the request headers to revalidate the cache
+        entry for url
+
+        :param str url: request url
+
+        :return: dict of request headers, empty if there is no entry
+
+        :rtype: dict
+        """
+        headers = {}
+        entry_header = self._read_entry_header(self._get_entry_path(url))
+        if entry_header.get('etag'):
+            headers['If-None-Match'] = entry_header['etag']
+        if entry_header.get('last_modified'):
+            headers['If-Modified-Since'] = entry_header['last_modified']
+        return headers
+
+    def get(self, url: str) -> Optional['CachedResponse']:
+        """
+        Return the cached response for url
+
+        :param str url: request url
+
+        :return: CachedResponse or None if there is no entry
+
+        :rtype: CachedResponse
+        """
+        entry = self._get_entry_path(url)
+        if not self._read_entry_header(entry):
+            return None
+        log.debug(f'Using cached response for {url}')
+        os.utime(entry)
+        return CachedResponse(entry)
+
+    def record(self, url: str, response: Any) -> Any:
+        """
+        Wrap the given streamed response such that its content
+        is stored as cache entry for url while it is consumed.
+        Responses without validators are returned as they are
+
+        :param str url: request url
+        :param object response: requests.Response
+
+        :return: RecordingResponse or response
+
+        :rtype: object
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return response
+        return RecordingResponse(
+            self, self._get_entry_path(url), response, {
+                'url': url,
+                'etag': etag,
+                'last_modified': last_modified
+            }
+        )
+
+    def evict(self) -> None:
+        """
+        Delete least recently used entries until the size of all
+        entries fits into max_size
+        """
+        entries: List[Tuple[float, int, str]] = []
+        cache_size = 0
+        for name in os.listdir(self.cache_dir):
+            entry = os.sep.join([self.cache_dir, name])
+            try:
+                entry_stat = os.stat(entry)
+            except OSError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry))
+            cache_size += entry_stat.st_size
+        for (mtime, size, entry) in sorted(entries):
+            if cache_size <= self.max_size:
+                break
+            log.debug(f'Evicting HTTP cache entry {entry!r}')
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            cache_size -= size
+
+    def _get_entry_path(self, url: str) -> str:
+        key = hashlib.sha256(
+            f'{self.namespace} {url}'.encode()
+        ).hexdigest()
+        return os.sep.join([self.cache_dir, key])
+
+    @staticmethod
+    def _read_entry_header(entry: str) -> Dict[str, Any]:
+        try:
+            with open(entry, 'rb') as cache:
+                entry_header = json.loads(cache.readline())
+        except (OSError, ValueError):
+            return {}
+        return entry_header if isinstance(entry_header, dict) else {}
+
+
+class CachedResponse:
+    """
+    **Implements a response read from an HTTPCache entry**
+
+    The entry consists out of one line of JSON with the url
+    and validators of the response followed by the content
+
+    :param str entry: cache entry file path
+    """
+    def __init__(self, entry: str):
+        self.cache = open(entry, 'rb')
+        self.cache.readline()
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        """
+        Iterate over the response content in chunks of chunk_size
+
+        :param int chunk_size: max size of a chunk in bytes
+        """
+        for chunk in iter(lambda: self.cache.read(chunk_size), b''):
+            yield chunk
+
+    def close(self) -> None:
+        self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordingResponse:
+    """
+    **Implements a streamed response which stores its content
+    as HTTPCache entry while it is consumed**
+
+    The entry is only created if the content was consumed
+    completely, an interrupted transfer leaves the cache as
+    it was
+
+    :param HTTPCache http_cache: HTTPCache instance
+    :param str entry: cache entry file path
+    :param object response: requests.Response
+    :param dict entry_header: url and validators of the response
+    """
+    def __init__(
+        self, http_cache: HTTPCache, entry: str, response: Any,
+        entry_header: Dict[str, Any]
+    ):
+        self.http_cache = http_cache
+        self.entry = entry
+        self.response = response
+        self.entry_header = entry_header
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        """
+        Iterate over the response content in chunks of chunk_size
+
+        :param int chunk_size: max size of a chunk in bytes
+        """
+        os.makedirs(self.http_cache.cache_dir, exist_ok=True)
+        (fd, entry_tmp) = mkstemp(dir=self.http_cache.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as cache:
+                cache.write(json.dumps(self.entry_header).encode())
+                cache.write(b'\n')
+                for chunk in self.response.iter_content(
+                    chunk_size=chunk_size
+                ):
+                    cache.write(chunk)
+                    yield chunk
+        except BaseException:
+            os.remove(entry_tmp)
+            raise
+        os.replace(entry_tmp, self.entry)
+        self.http_cache.evict()
+
+    def close(self) -> None:
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,106 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+from typing import (
+    List, NamedTuple, Optional
+)
+
+from kiwi_obs_plugin.exceptions import KiwiOBSPluginManifestError
+
+manifest_entry_type = NamedTuple(
+    'manifest_entry_type', [
+        ('name', str),
+        ('image', str),
+        ('profile', Optional[str]),
+        ('arch', str)
+    ]
+)
+
+
+class Manifest:
+    """
+    **Implements reading of a manifest of OBS images**
+
+    Each line of a manifest references one image in the form
+    project/package[:flavor][@arch]. Empty lines and lines
+    starting with a # are ignored
+    """
+    @staticmethod
+    def read(
+        manifest_file: str, arches: Optional[List[str]] = None
+    ) -> List[manifest_entry_type]:
+        """
+        Read the entries of the given manifest file. An entry
+        without @arch is expanded into one entry per architecture
+        in arches, named with the architecture appended if there
+        is more than one
+
+        :param str manifest_file: manifest file path
+        :param list arches:
+            architectures of entries without @arch, defaults
+            to x86_64
+
+        :return: entries in manifest order
+
+        :rtype: list
+        """
+        arches = arches or ['x86_64']
+        entries: List[manifest_entry_type] = []
+        with open(manifest_file) as manifest:
+            for line in manifest:
+                name = line.strip()
+                if not name or name.startswith('#'):
+                    continue
+                if '@' in name or len(arches) == 1:
+                    entries.append(Manifest.parse_entry(name, arches[0]))
+                else:
+                    entries.extend(
+                        Manifest.parse_entry(f'{name}@{arch}')
+                        for arch in arches
+                    )
+        if not entries:
+            raise KiwiOBSPluginManifestError(
+                f'Manifest {manifest_file!r} has no entries'
+            )
+        return entries
+
+    @staticmethod
+    def parse_entry(name: str, arch: str = 'x86_64') -> manifest_entry_type:
+        """
+        Parse one manifest entry
+
+        :param str name: entry in the form project/package[:flavor][@arch]
+        :param str arch: architecture if the entry has no @arch
+
+        :return: manifest entry
+
+        :rtype: manifest_entry_type
+        """
+        (image, at, entry_arch) = name.partition('@')
+        (project, slash, package) = image.partition('/')
+        (package, colon, profile) = package.partition(':')
+        if (at and not entry_arch) or not project or not package or \
+                (colon and not profile) or '/' in package + profile:
+            raise KiwiOBSPluginManifestError(
+                f'Invalid manifest entry: {name!r}'
+            )
+        return manifest_entry_type(
+            name=name,
+            image=f'{project}/{package}',
+            profile=profile or None,
+            arch=entry_arch or arch
+        )
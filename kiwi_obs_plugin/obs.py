@@ -16,32 +16,55 @@
 # along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
 #
 import os
+import copy
+import time
+import random
+import hashlib
 import logging
 import shutil
+import threading
+import tarfile
 from lxml import etree
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from tempfile import NamedTemporaryFile
+from urllib.parse import urlparse
+from contextlib import ExitStack
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, wait, FIRST_EXCEPTION
+)
 from typing import (
-    Any, Dict, List, NamedTuple, Optional
+    Any, Dict, IO, List, NamedTuple, Optional, Tuple, cast
 )
 
 # project
+import kiwi.defaults as defaults
 from kiwi.xml_state import XMLState
-from kiwi.runtime_config import RuntimeConfig
 from kiwi.solver.repository.base import SolverRepositoryBase
 from kiwi.system.uri import Uri
 from kiwi.command import Command
+from kiwi.utils.checksum import Checksum
 
 from kiwi.exceptions import KiwiUriOpenError
 
+from kiwi_obs_plugin.runtime_config import RuntimeConfig
 from kiwi_obs_plugin.credentials import Credentials
+from kiwi_obs_plugin.cpio import Cpio
+from kiwi_obs_plugin.file_copy import FileCopy
+from kiwi_obs_plugin.source_cache import SourceCache
+from kiwi_obs_plugin.repository_cache import RepositoryCache
+from kiwi_obs_plugin.http_cache import HTTPCache
+from kiwi_obs_plugin.git_cache import GitCache
+from kiwi_obs_plugin.circuit_breaker import CircuitBreaker
+from kiwi_obs_plugin.host_limiter import HostLimiter
 
 from kiwi_obs_plugin.exceptions import (
     KiwiOBSPluginBuildInfoError,
     KiwiOBSPluginProjectError,
     KiwiOBSPluginSourceError,
-    KiwiOBSPluginCredentialsError
+    KiwiOBSPluginCpioError,
+    KiwiOBSPluginCredentialsError,
+    KiwiOBSPluginCancelledError
 )
 
 git_source_type = NamedTuple(
@@ -50,7 +73,25 @@ git_source_type = NamedTuple(
         ('revision', str),
         ('source_dir', str),
         ('use_entire_source_dir', bool),
-        ('files', List[str])
+        ('files', List[str]),
+        ('excludes', List[str])
+    ]
+)
+
+git_clone_type = NamedTuple(
+    'git_clone_type', [
+        ('git_dir', str),
+        ('checkout', bool)
+    ]
+)
+
+git_clone_request_type = NamedTuple(
+    'git_clone_request_type', [
+        ('url', str),
+        ('revision', str),
+        ('target_dir', str),
+        ('sparse_paths', List[str]),
+        ('checkout', bool)
     ]
 )
 
@@ -61,6 +102,13 @@ obs_checkout_type = NamedTuple(
     ]
 )
 
+obs_package_type = NamedTuple(
+    'obs_package_type', [
+        ('name', str),
+        ('srcmd5', str)
+    ]
+)
+
 obs_repo_status_type = NamedTuple(
     'obs_repo_status_type', [
         ('flag', str),
@@ -68,8 +116,59 @@ obs_repo_status_type = NamedTuple(
     ]
 )
 
+obs_repo_probe_type = NamedTuple(
+    'obs_repo_probe_type', [
+        ('url', str),
+        ('repo_type', Optional[str]),
+        ('status', obs_repo_status_type)
+    ]
+)
+
 log: Any = logging.getLogger('kiwi')
 
+# Size of the blocks written to disk when streaming a download
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+# Base delay in seconds of the exponential backoff between retries
+RETRY_BACKOFF = 0.5
+
+# Temporary server errors for which a request is repeated
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+# Request errors for which a request is repeated
+RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout
+)
+
+# Names of the session cookies OBS hands out after a login, the
+# first one is set by the openSUSE login proxy in front of OBS
+API_SESSION_COOKIES = ('openSUSE_session', '_obs_api_session')
+
+# Number of consecutive failed requests after which a host is skipped
+CIRCUIT_BREAKER_THRESHOLD = 3
+
+# Seconds a host is skipped before it is contacted again
+CIRCUIT_BREAKER_RESET_TIMEOUT = 60
+
+# Repository type and the metadata file identifying that type
+REPOSITORY_METADATA_FILES = [
+    ('rpm-md', 'repodata/repomd.xml'),
+    ('apt-deb', 'Packages.gz')
+]
+
+# Build recipe extensions of packages providing an image description
+IMAGE_DESCRIPTION_EXTENSIONS = ('.kiwi', '.xml')
+
+# Copy of the OBS source listing kept in the checkout directory
+SOURCE_LISTING_FILE = '.obs_source_listing'
+
+# Name of the image description used by the first checkout
+IMAGE_DESCRIPTION_FILE = '.obs_image_description'
+
+# srcmd5 of the OBS sources the config files of an arch got written for
+COMPLETED_ARCH_FILE = '.obs_completed.{0}'
+
 
 class OBS:
     """
@@ -77,7 +176,8 @@ class OBS:
     """
     def __init__(
         self, image_path: str, ssl_verify: bool = True,
-        user: Optional[str] = None, password: Optional[str] = None
+        user: Optional[str] = None, password: Optional[str] = None,
+        jobs: int = 4, use_cache: bool = True
     ):
         """
         Initialize OBS API access for a given project and package
@@ -85,14 +185,11 @@ class OBS:
         :param str image_path: OBS project/package path
         :param str user: OBS account user name
         :param str password: OBS account password
+        :param int jobs: max number of concurrent downloads
+        :param bool use_cache: use the local caches
         """
         runtime_config = RuntimeConfig()
-        try:
-            (self.project, self.package) = image_path.split(os.sep)
-        except ValueError:
-            raise KiwiOBSPluginProjectError(
-                f'Invalid image path: {image_path}'
-            )
+        (self.project, self.package) = OBS._split_image_path(image_path)
         if not password:
             for credentials in runtime_config.get_obs_api_credentials() or []:
                 if not user:
@@ -116,9 +213,135 @@ class OBS:
         self.password = password
         self.api_server = runtime_config.get_obs_api_server_url()
         self.ssl_verify = ssl_verify or True
+        self.jobs = jobs
+        self.timeout = (
+            runtime_config.get_obs_connect_timeout(),
+            runtime_config.get_obs_read_timeout()
+        )
+        self.retries = runtime_config.get_obs_retries()
+        self.circuit_breaker = CircuitBreaker(
+            CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_RESET_TIMEOUT
+        )
+        self.host_limiter = HostLimiter(
+            runtime_config.get_obs_host_request_rate(),
+            runtime_config.get_obs_host_max_requests()
+        )
+        self.session = requests.Session()
+        # Keep one keep-alive connection per concurrent download
+        adapter = HTTPAdapter(pool_maxsize=self.jobs)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        source_cache_size = runtime_config.get_obs_source_cache_size()
+        self.source_cache = SourceCache(
+            os.sep.join([runtime_config.get_obs_cache_dir(), 'sources']),
+            source_cache_size * 1024 * 1024
+        ) if use_cache and source_cache_size else None
+        repository_cache_ttl = runtime_config.get_obs_repository_cache_ttl()
+        self.repository_cache = RepositoryCache(
+            os.sep.join(
+                [runtime_config.get_obs_cache_dir(), 'repositories.json']
+            ), repository_cache_ttl
+        ) if use_cache and repository_cache_ttl else None
+        http_cache_size = runtime_config.get_obs_http_cache_size()
+        self.http_cache = HTTPCache(
+            os.sep.join([runtime_config.get_obs_cache_dir(), 'http']),
+            http_cache_size * 1024 * 1024, self.user
+        ) if use_cache and http_cache_size else None
+        git_cache_size = runtime_config.get_obs_git_cache_size()
+        self.git_cache = GitCache(
+            os.sep.join([runtime_config.get_obs_cache_dir(), 'git']),
+            git_cache_size * 1024 * 1024
+        ) if use_cache and git_cache_size else None
+        # The worker threads are started on demand, the pool is
+        # shared by all instances created by for_image
+        self.repository_lookup_pool = ThreadPoolExecutor(
+            max_workers=self.jobs
+        )
+        self.repository_lookups: Dict[
+            Tuple[Optional[str], str, str], Future
+        ] = {}
+        self.repository_probes: Dict[str, Future] = {}
+        self.repository_probes_lock = threading.Lock()
+        self.cancel_event: Optional[threading.Event] = None
+
+    def for_image(self, image_path: str) -> 'OBS':
+        """
+        Create an OBS API access for another project and package
+        which shares the credentials, the HTTP session, the caches,
+        the repository lookup pool and the repository probe results
+        with this instance
+
+        :param str image_path: OBS project/package path
+
+        :return: OBS instance
+
+        :rtype: OBS
+        """
+        obs = copy.copy(self)
+        (obs.project, obs.package) = OBS._split_image_path(image_path)
+        obs.repository_lookups = {}
+        return obs
+
+    def with_cancel_event(self, cancel_event: threading.Event) -> 'OBS':
+        """
+        Create an OBS API access for the same project and package
+        which stops to send requests once cancel_event is set. The
+        pending request then raises KiwiOBSPluginCancelledError.
+        Everything else, including the repository lookups, is
+        shared with this instance
+
+        :param threading.Event cancel_event: event to cancel the calls
+
+        :return: OBS instance
+
+        :rtype: OBS
+        """
+        obs = copy.copy(self)
+        obs.cancel_event = cancel_event
+        return obs
+
+    def get_image_packages(self) -> List[obs_package_type]:
+        """
+        Lookup the packages of the obs project which provide an
+        image description. All packages are looked up in one
+        request from the source info of the project. Multibuild
+        flavors are not listed separately
+
+        :return: packages with the srcmd5 of their sources
+
+        :rtype: list
+        """
+        log.info(f'Looking up image packages in {self.project}')
+        project_link = os.sep.join(
+            [self.api_server, 'source', self.project]
+        )
+        request = self._create_cached_request(f'{project_link}?view=info')
+        source_info_xml_tree = OBS._import_xml_request(request)
+        image_packages = []
+        for source_info in source_info_xml_tree.getroot().xpath(
+            '/sourceinfolist/sourceinfo'
+        ):
+            package = source_info.get('package')
+            # The srcmd5 of a link is the one of the expanded
+            # sources, the package listing refers to the link
+            srcmd5 = source_info.get('lsrcmd5') or source_info.get('srcmd5')
+            if ':' in package or not srcmd5:
+                continue
+            for recipe in source_info.xpath('filename'):
+                if (recipe.text or '').endswith(IMAGE_DESCRIPTION_EXTENSIONS):
+                    log.info(f'--> {package}')
+                    image_packages.append(
+                        obs_package_type(name=package, srcmd5=srcmd5)
+                    )
+                    break
+        return image_packages
 
     def fetch_obs_image(
-        self, checkout_dir: str, force: bool = False, profile: list = None
+        self, checkout_dir: str, force: bool = False,
+        profile: Optional[list] = None, sync: bool = False,
+        bulk: bool = False, pipeline: bool = False,
+        arch: str = 'x86_64', repo: str = 'images',
+        git_sources: bool = True
     ) -> obs_checkout_type:
         """
         Fetch image description from the obs project
@@ -128,6 +351,28 @@ class OBS:
             created if it does not exist
         :param bool force:
             allow to override existing checkout_dir content
+        :param bool sync:
+            allow to update existing checkout_dir content. Only
+            source files whose md5 sum differs from the one in OBS
+            are fetched and files deleted in OBS are deleted from
+            checkout_dir. If the OBS package did not change since
+            the last checkout, only local files which got modified
+            since then are fetched again
+        :param bool bulk:
+            fetch all source files in one request as cpio archive.
+            If the server does not support this, the files are
+            fetched one by one
+        :param bool pipeline:
+            look up the repositories of the obs project for the
+            given arch and repo in the background as soon as the
+            multibuild profile is known, while the remaining
+            sources are fetched. See prefetch_obs_repositories
+        :param str arch: OBS architecture, defaults to: 'x86_64'
+        :param str repo:
+            OBS image package build repository name, defaults to: 'images'
+        :param bool git_sources:
+            fetch the git sources referenced by a _service file,
+            if False the caller takes care of it
 
         :return: checkout_dir
 
@@ -135,7 +380,7 @@ class OBS:
         """
         log.info('Checking out OBS project:')
         primary_multibuild_profile = profile[0] if profile else None
-        if os.path.exists(checkout_dir) and not force:
+        if os.path.exists(checkout_dir) and not force and not sync:
             raise KiwiOBSPluginSourceError(
                 f'OBS source checkout dir: {checkout_dir!r} already exists'
             )
@@ -146,7 +391,7 @@ class OBS:
                 self.project, self.package
             ]
         )
-        request = self._create_request(package_link)
+        request = self._create_cached_request(package_link)
         package_source_xml_tree = OBS._import_xml_request(request)
         package_source_contents = package_source_xml_tree.getroot().xpath(
             '/directory/entry'
@@ -155,24 +400,91 @@ class OBS:
             raise KiwiOBSPluginSourceError(
                 f'OBS source for {self.package!r} package is empty'
             )
-        Command.run(
-            ['mkdir', '-p', checkout_dir]
-        )
         source_files = []
+        source_md5sums = {}
         for entry in package_source_contents:
             source_files.append(entry.get('name'))
+            source_md5sums[entry.get('name')] = entry.get('md5')
 
-        for source_file in source_files:
-            log.info(f'--> {source_file}')
-            request = self._create_request(
-                os.sep.join([package_link, source_file])
+        previous_source_xml_tree = OBS._read_source_listing(
+            checkout_dir
+        ) if sync else None
+        sources_unchanged = previous_source_xml_tree is not None and \
+            OBS._get_srcmd5(previous_source_xml_tree) == \
+            OBS._get_srcmd5(package_source_xml_tree)
+        if sources_unchanged:
+            log.info('--> Sources unchanged since last checkout')
+        else:
+            Command.run(
+                ['mkdir', '-p', checkout_dir]
+            )
+            if previous_source_xml_tree is not None:
+                OBS._delete_removed_source_files(
+                    checkout_dir, previous_source_xml_tree, source_files
+                )
+        # Local files are checked also if the sources did not change
+        # in OBS, they might have been modified since the last run
+        changed_source_files = []
+        for entry in package_source_contents:
+            if not sync or not OBS._source_file_matches(
+                checkout_dir, entry
+            ):
+                changed_source_files.append(entry.get('name'))
+        if sources_unchanged and changed_source_files:
+            log.info('--> Restoring locally modified sources')
+
+        if self.source_cache and changed_source_files:
+            changed_source_files = self._fetch_cached_source_files(
+                checkout_dir, changed_source_files, source_md5sums
+            )
+
+        pending_source_files = changed_source_files
+        if pipeline:
+            # Only the _multibuild file is needed to select the
+            # profile for the repository lookup, fetch it first
+            if '_multibuild' in changed_source_files and \
+                    not primary_multibuild_profile:
+                self._fetch_source_files(
+                    package_link, checkout_dir, ['_multibuild']
+                )
+                pending_source_files = [
+                    source_file for source_file in changed_source_files
+                    if source_file != '_multibuild'
+                ]
+            if '_multibuild' in source_files and \
+                    not primary_multibuild_profile:
+                primary_multibuild_profile = \
+                    self._get_primary_multibuild_profile(checkout_dir)
+            self.prefetch_obs_repositories(
+                primary_multibuild_profile, arch, repo
             )
-            with open(os.sep.join([checkout_dir, source_file]), 'wb') as fd:
-                fd.write(request.content)
 
-        if '_service' in source_files:
+        if changed_source_files or not sources_unchanged:
+            fetched_as_archive = False
+            if bulk and len(pending_source_files) > 1:
+                fetched_as_archive = self._fetch_source_archive(
+                    package_link, checkout_dir, pending_source_files
+                )
+            if not fetched_as_archive:
+                self._fetch_source_files(
+                    package_link, checkout_dir, pending_source_files
+                )
+
+            if self.source_cache:
+                for source_file in changed_source_files:
+                    self.source_cache.add(
+                        source_md5sums[source_file],
+                        os.sep.join([checkout_dir, source_file])
+                    )
+                self.source_cache.evict()
+
+        if '_service' in source_files and git_sources:
+            # The git sources can change without a change in OBS
             self._resolve_git_source_service(checkout_dir)
 
+        if not sources_unchanged:
+            OBS._write_source_listing(checkout_dir, package_source_xml_tree)
+
         if '_multibuild' in source_files and not primary_multibuild_profile:
             primary_multibuild_profile = self._get_primary_multibuild_profile(
                 checkout_dir
@@ -204,68 +516,63 @@ class OBS:
         package_name = self.package if not profile \
             else f'{self.package}:{profile}'
         log.info(f'Using OBS repositories from {self.project}/{package_name}')
-        buildinfo_link = os.sep.join(
-            [
-                self.api_server, 'build', self.project, repo, arch,
-                package_name, '_buildinfo'
-            ]
-        )
-        request = self._create_request(buildinfo_link)
-        buildinfo_xml_tree = OBS._import_xml_request(request)
-        repo_paths = buildinfo_xml_tree.getroot().xpath(
-            '/buildinfo/path'
-        )
-        if not repo_paths:
-            raise KiwiOBSPluginBuildInfoError(
-                f'OBS buildinfo for {package_name} has no repo paths'
-            )
+        repository_lookup = self.repository_lookups.get((profile, arch, repo))
+        repo_probes = repository_lookup.result() if repository_lookup \
+            else self._lookup_obs_repositories(profile, arch, repo)
+
+        # Evaluate the probe results in _buildinfo order such that
+        # the repository priorities do not depend on which probe
+        # finished first
         repo_prio_ascending = 0
         repo_prio_descending = 501
         repo_alias = None
-        for repo_path in repo_paths:
-            repo_url = repo_path.get('url')
-            if not repo_url:
-                repo_url = 'obs://{0}/{1}'.format(
-                    repo_path.get('project'), repo_path.get('repository')
-                )
-            if repo_url:
-                try:
-                    repo_uri = Uri(repo_url)
-                    repo_url = repo_uri.translate(
-                        check_build_environment=False
-                    )
-                    request = requests.get(repo_url)
-                    request.raise_for_status()
-                except Exception as issue:
-                    repository_status_report[repo_url] = obs_repo_status_type(
-                        flag='unreachable', message=f'ignored:{issue}'
-                    )
-                    continue
+        for (repo_url, repo_type, repo_status) in repo_probes:
+            repository_status_report[repo_url] = repo_status
+            if repo_status.flag != 'ok':
+                continue
 
-                repo_check = SolverRepositoryBase(repo_uri)
-                repo_type = repo_check.get_repo_type()
-                if not repo_type:
-                    repository_status_report[repo_url] = obs_repo_status_type(
-                        flag='repo_type_unknown',
-                        message='ignored:Unknown repository type'
-                    )
-                    continue
-
-                if repo_type == 'rpm-md':
-                    repo_prio_ascending += 1
-                    repo_prio = repo_prio_ascending
-                else:
-                    repo_prio_descending -= 1
-                    repo_prio = repo_prio_descending
+            if repo_type == 'rpm-md':
+                repo_prio_ascending += 1
+                repo_prio = repo_prio_ascending
+            else:
+                repo_prio_descending -= 1
+                repo_prio = repo_prio_descending
 
-                repository_status_report[repo_url] = obs_repo_status_type(
-                    flag='ok', message='imported'
-                )
-                xml_state.add_repository(
-                    repo_url, repo_type, repo_alias, f'{repo_prio}'
-                )
+            xml_state.add_repository(
+                repo_url, repo_type, repo_alias, f'{repo_prio}'
+            )
         return repository_status_report
 
+    def prefetch_obs_repositories(
+        self, profile: Optional[str] = None, arch: str = 'x86_64',
+        repo: str = 'images'
+    ) -> Future:
+        """
+        Start the lookup of the repositories from the obs project
+        in the background. The lookup does not depend on the image
+        description and can run while the sources are fetched.
+        A later add_obs_repositories call for the same profile,
+        arch and repo waits for the result instead of looking up
+        the repositories again. If the image description does not
+        use the obsrepositories flag, the result is not used
+
+        :param str profile: multibuild profile name
+        :param str arch: OBS architecture, defaults to: 'x86_64'
+        :param str repo:
+            OBS image package build repository name, defaults to: 'images'
+
+        :return: future of the repository probe results
+
+        :rtype: Future
+        """
+        key = (profile, arch, repo)
+        lookup = self.repository_lookups.get(key)
+        if not lookup or OBS._failed_by_cancel(lookup):
+            self.repository_lookups[key] = self.repository_lookup_pool.submit(
+                self._lookup_obs_repositories, profile, arch, repo
+            )
+        return self.repository_lookups[key]
+
     @staticmethod
     def print_repository_status(
         repository_status_report: Dict[str, obs_repo_status_type]
@@ -294,6 +601,8 @@ class OBS:
     def write_kiwi_config_from_state(
         xml_state: XMLState, config_file: str
     ) -> None:
+        # The config file may share its data with a cache entry
+        FileCopy.remove(config_file)
         with open(config_file, 'w', encoding='utf-8') as config:
             config.write('<?xml version="1.0" encoding="utf-8"?>')
             config.write(os.linesep)
@@ -301,6 +610,311 @@ class OBS:
                 outfile=config, level=0
             )
 
+    @staticmethod
+    def get_multibuild_profiles(checkout_dir: str) -> List[str]:
+        """
+        Read the flavors from the _multibuild file of the checkout
+
+        :param str checkout_dir: checkout directory
+
+        :return: flavor names in _multibuild order, empty if there
+            is no _multibuild file
+
+        :rtype: list
+        """
+        multibuild_file = os.sep.join([checkout_dir, '_multibuild'])
+        if not os.path.exists(multibuild_file):
+            return []
+        log.info('Reading multibuild profile(s)...')
+        multibuild_xml = etree.parse(multibuild_file)
+        return [
+            flavor.text for flavor in multibuild_xml.getroot().xpath(
+                '/multibuild/flavor'
+            )
+        ]
+
+    @staticmethod
+    def get_checkout_srcmd5(checkout_dir: str) -> Optional[str]:
+        """
+        Lookup the srcmd5 of the OBS sources in the checkout
+
+        :param str checkout_dir: checkout directory
+
+        :return: srcmd5 or None if unknown
+
+        :rtype: str
+        """
+        source_xml_tree = OBS._read_source_listing(checkout_dir)
+        if source_xml_tree is None:
+            return None
+        return OBS._get_srcmd5(source_xml_tree)
+
+    @staticmethod
+    def get_completed_srcmd5(checkout_dir: str, arch: str) -> Optional[str]:
+        """
+        Lookup the srcmd5 of the OBS sources for which the config
+        files of the given architecture were written completely
+
+        :param str checkout_dir: checkout directory
+        :param str arch: architecture name
+
+        :return: srcmd5 or None if unknown
+
+        :rtype: str
+        """
+        completed_file = os.sep.join(
+            [checkout_dir, COMPLETED_ARCH_FILE.format(arch)]
+        )
+        if not os.path.isfile(completed_file):
+            return None
+        with open(completed_file) as completed:
+            return completed.read().strip() or None
+
+    @staticmethod
+    def set_completed_arch(checkout_dir: str, arch: str) -> None:
+        """
+        Record that the config files of the given architecture
+        were written for the OBS sources in the checkout
+
+        :param str checkout_dir: checkout directory
+        :param str arch: architecture name
+        """
+        with open(
+            os.sep.join([checkout_dir, COMPLETED_ARCH_FILE.format(arch)]), 'w'
+        ) as completed:
+            completed.write(
+                f'{OBS.get_checkout_srcmd5(checkout_dir) or ""}{os.linesep}'
+            )
+
+    @staticmethod
+    def get_image_description_file(checkout_dir: str) -> str:
+        """
+        Lookup the name of the image description file from OBS in
+        the checkout. Config files written for flavors or
+        architectures are not part of the OBS sources and thus
+        never returned. If the description is not part of the OBS
+        sources, e.g. it is extracted from git by a source service,
+        the name stored by set_image_description_file is returned
+
+        :param str checkout_dir: checkout directory
+
+        :return: config.xml or the first .kiwi file from the OBS
+            sources, empty if unknown
+
+        :rtype: str
+        """
+        source_xml_tree = OBS._read_source_listing(checkout_dir)
+        source_files = sorted(
+            entry.get('name') for entry in
+            source_xml_tree.getroot().xpath('/directory/entry')
+        ) if source_xml_tree is not None else []
+        if 'config.xml' in source_files:
+            return 'config.xml'
+        for source_file in source_files:
+            if source_file.endswith('.kiwi'):
+                return source_file
+        description_file = os.sep.join([checkout_dir, IMAGE_DESCRIPTION_FILE])
+        if os.path.isfile(description_file):
+            with open(description_file) as description:
+                source_file = description.read().strip()
+            if os.path.isfile(os.sep.join([checkout_dir, source_file])):
+                return source_file
+        return ''
+
+    @staticmethod
+    def set_image_description_file(
+        checkout_dir: str, source_file: str
+    ) -> None:
+        """
+        Store the name of the image description file in the
+        checkout, such that get_image_description_file finds it
+        again once config files for other targets got written
+
+        :param str checkout_dir: checkout directory
+        :param str source_file: image description file name
+        """
+        with open(
+            os.sep.join([checkout_dir, IMAGE_DESCRIPTION_FILE]), 'w'
+        ) as description:
+            description.write(f'{source_file}{os.linesep}')
+
+    def _lookup_obs_repositories(
+        self, profile: Optional[str], arch: str, repo: str
+    ) -> List[obs_repo_probe_type]:
+        """
+        Fetch the repository paths from the _buildinfo of the obs
+        package and probe them concurrently
+
+        :return: probe results in _buildinfo order
+
+        :rtype: list
+        """
+        package_name = self.package if not profile \
+            else f'{self.package}:{profile}'
+        buildinfo_link = os.sep.join(
+            [
+                self.api_server, 'build', self.project, repo, arch,
+                package_name, '_buildinfo'
+            ]
+        )
+        request = self._create_cached_request(buildinfo_link)
+        repo_paths = OBS._import_buildinfo_paths(request)
+        if not repo_paths:
+            raise KiwiOBSPluginBuildInfoError(
+                f'OBS buildinfo for {package_name} has no repo paths'
+            )
+        repo_urls = []
+        for repo_path in repo_paths:
+            repo_url = repo_path.get('url')
+            if not repo_url:
+                repo_url = 'obs://{0}/{1}'.format(
+                    repo_path.get('project'), repo_path.get('repository')
+                )
+            repo_urls.append(repo_url)
+
+        if self.repository_cache:
+            self.repository_cache.load()
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            repo_probes = [
+                pool.submit(self._probe_shared_repository, repo_url)
+                for repo_url in repo_urls
+            ]
+        if self.repository_cache:
+            self.repository_cache.save()
+        return [repo_probe.result() for repo_probe in repo_probes]
+
+    def _probe_shared_repository(
+        self, repo_url: str
+    ) -> obs_repo_probe_type:
+        """
+        Probe the given repository once per OBS instance. The
+        repository lookups of multiple multibuild flavors mostly
+        share their repositories, a concurrent probe of the same
+        repository waits for the result of the first one
+
+        :param str repo_url: repository url from _buildinfo
+
+        :return: translated url, repository type and status
+
+        :rtype: obs_repo_probe_type
+        """
+        with self.repository_probes_lock:
+            probe_owner = repo_url not in self.repository_probes
+            if probe_owner:
+                self.repository_probes[repo_url] = Future()
+            repo_probe = self.repository_probes[repo_url]
+        if probe_owner:
+            try:
+                repo_probe.set_result(self._probe_repository(repo_url))
+            except BaseException as issue:
+                repo_probe.set_exception(issue)
+        elif OBS._failed_by_cancel(repo_probe, wait=True):
+            # The probe of a cancelled call is no result, probe again
+            with self.repository_probes_lock:
+                if self.repository_probes.get(repo_url) is repo_probe:
+                    del self.repository_probes[repo_url]
+            return self._probe_shared_repository(repo_url)
+        return repo_probe.result()
+
+    def _probe_repository(self, repo_url: str) -> obs_repo_probe_type:
+        """
+        Translate the given repository url and check if the
+        repository is reachable and of a known type. Results
+        of reachable repositories are taken from and stored in
+        the repository cache if it is used
+
+        :param str repo_url: repository url from _buildinfo
+
+        :return: translated url, repository type and status
+
+        :rtype: obs_repo_probe_type
+        """
+        try:
+            repo_uri = Uri(repo_url)
+            repo_url = repo_uri.translate(
+                check_build_environment=False
+            )
+            cached = self.repository_cache.get(repo_url) \
+                if self.repository_cache else None
+            if cached:
+                return obs_repo_probe_type(
+                    url=repo_url, repo_type=cached['repo_type'],
+                    status=obs_repo_status_type(
+                        flag=cached['flag'], message=cached['message']
+                    )
+                )
+            if urlparse(repo_url).scheme in ('http', 'https'):
+                repo_type = self._probe_repository_type(repo_url)
+            else:
+                repo_type = SolverRepositoryBase(repo_uri).get_repo_type()
+        except KiwiOBSPluginCancelledError:
+            raise
+        except Exception as issue:
+            return obs_repo_probe_type(
+                url=repo_url, repo_type=None, status=obs_repo_status_type(
+                    flag='unreachable', message=f'ignored:{issue}'
+                )
+            )
+        if not repo_type:
+            repo_status = obs_repo_status_type(
+                flag='repo_type_unknown',
+                message='ignored:Unknown repository type'
+            )
+        else:
+            repo_status = obs_repo_status_type(
+                flag='ok', message='imported'
+            )
+        if self.repository_cache:
+            self.repository_cache.set(
+                repo_url, repo_type, repo_status.flag, repo_status.message
+            )
+        return obs_repo_probe_type(
+            url=repo_url, repo_type=repo_type, status=repo_status
+        )
+
+    def _probe_repository_type(self, repo_url: str) -> Optional[str]:
+        """
+        Detect the type of the repository at the given http(s) url
+        by checking for the type specific metadata files the same
+        way SolverRepositoryBase.get_repo_type does, but without
+        downloading them. Requests go through the pooled session
+        such that connections to a mirror are reused for all of
+        its repositories. Connection errors are raised, they mark
+        the repository as unreachable
+
+        :param str repo_url: http(s) repository url
+
+        :return: repository type name or None
+
+        :rtype: str
+        """
+        repo_url = repo_url.rstrip('/')
+        for (repo_type, metadata_file) in REPOSITORY_METADATA_FILES:
+            if self._probe_url(f'{repo_url}/{metadata_file}'):
+                return repo_type
+        listing = self._send(
+            'GET', f'{repo_url}/{defaults.PLATFORM_MACHINE}/'
+        )
+        if listing.ok and '.db.sig"' in listing.text:
+            return 'pacman'
+        return None
+
+    def _probe_url(self, url: str) -> bool:
+        """
+        Check if the given url exists using a HEAD request, or
+        a GET request for the first byte if the server does not
+        allow HEAD requests
+
+        :rtype: bool
+        """
+        response = self._send('HEAD', url, allow_redirects=True)
+        if response.status_code in (405, 501):
+            response = self._send(
+                'GET', url, headers={'Range': 'bytes=0-0'}, stream=True
+            )
+            response.close()
+        return response.ok
+
     @staticmethod
     def _delete_obsrepositories_placeholder_repo(xml_state):
         """
@@ -325,16 +939,157 @@ class OBS:
         xml_state.xml_data.set_repository(repository_sections_to_keep)
         return has_obsrepositories
 
+    @staticmethod
+    def _split_image_path(image_path: str) -> Tuple[str, str]:
+        try:
+            (project, package) = image_path.split(os.sep)
+        except ValueError:
+            raise KiwiOBSPluginProjectError(
+                f'Invalid image path: {image_path}'
+            )
+        return (project, package)
+
+    @staticmethod
+    def _read_source_listing(checkout_dir: str) -> Optional[Any]:
+        """
+        Read the OBS source listing stored by a previous checkout
+
+        :return: XML etree or None
+
+        :rtype: object
+        """
+        source_listing = os.sep.join([checkout_dir, SOURCE_LISTING_FILE])
+        if os.path.isfile(source_listing):
+            return etree.parse(source_listing)
+        return None
+
+    @staticmethod
+    def _write_source_listing(checkout_dir: str, source_xml_tree) -> None:
+        source_xml_tree.write(
+            os.sep.join([checkout_dir, SOURCE_LISTING_FILE])
+        )
+
+    @staticmethod
+    def _get_srcmd5(source_xml_tree) -> Optional[str]:
+        return source_xml_tree.getroot().get('srcmd5')
+
+    @staticmethod
+    def _source_file_matches(checkout_dir: str, entry) -> bool:
+        """
+        Check if the source file described by the given listing
+        entry exists in checkout_dir with the same md5 sum
+
+        :rtype: bool
+        """
+        source_file = os.sep.join([checkout_dir, entry.get('name')])
+        return os.path.isfile(source_file) and \
+            Checksum(source_file).md5() == entry.get('md5')
+
+    @staticmethod
+    def _delete_removed_source_files(
+        checkout_dir: str, previous_source_xml_tree, source_files: List[str]
+    ) -> None:
+        for entry in previous_source_xml_tree.getroot().xpath(
+            '/directory/entry'
+        ):
+            source_file = entry.get('name')
+            if source_file not in source_files:
+                log.info(f'--> Deleting {source_file}')
+                source_file = os.sep.join([checkout_dir, source_file])
+                if os.path.isfile(source_file):
+                    os.remove(source_file)
+
     @staticmethod
     def _import_xml_request(request):
-        download = NamedTemporaryFile()
-        with open(download.name, 'wb') as request_info:
-            request_info.write(request.content)
-        return etree.parse(download.name)
+        """
+        Parse the XML response of the given streamed request
+        while it is received
+
+        :return: XML etree
+
+        :rtype: object
+        """
+        parser = etree.XMLParser()
+        with request:
+            for chunk in request.iter_content(
+                chunk_size=DOWNLOAD_CHUNK_SIZE
+            ):
+                parser.feed(chunk)
+        return etree.ElementTree(parser.close())
 
     @staticmethod
-    def _resolve_git_source_service(checkout_dir):
+    def _import_buildinfo_paths(request) -> List[Dict[str, str]]:
+        """
+        Parse the /buildinfo/path elements from the XML response of
+        the given streamed _buildinfo request while it is received.
+        All other elements, e.g the potentially thousands of bdep
+        elements, are dropped as soon as they are parsed such that
+        the memory footprint does not depend on the response size
+
+        :return: list of path element attribute dicts
+
+        :rtype: list
+        """
+        repo_paths = []
+        parser = etree.XMLPullParser(events=('end',))
+        with request:
+            for chunk in request.iter_content(
+                chunk_size=DOWNLOAD_CHUNK_SIZE
+            ):
+                parser.feed(chunk)
+                for (event, element) in parser.read_events():
+                    parent = element.getparent()
+                    if parent is None:
+                        continue
+                    if element.tag == 'path' and \
+                            parent.tag == 'buildinfo' and \
+                            parent.getparent() is None:
+                        repo_paths.append(dict(element.attrib))
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del parent[0]
+        parser.close()
+        return repo_paths
+
+    def _resolve_git_source_service(self, checkout_dir):
         log.info('Looking up git source service...')
+        git_sources = OBS.get_git_sources(checkout_dir)
+        with ExitStack() as mirror_locks:
+            if self.git_cache:
+                # The mirrors must not be evicted while they are read
+                for url in set(git_source.clone for git_source in git_sources):
+                    mirror_locks.enter_context(self.git_cache.lock(url))
+            git_clones = self._clone_git_sources(checkout_dir, git_sources)
+            for git_source in git_sources:
+                git_clone = git_clones[
+                    (git_source.clone, git_source.revision)
+                ]
+                if git_clone.checkout:
+                    OBS.copy_git_source(
+                        git_clone.git_dir, git_source, checkout_dir,
+                        self.jobs
+                    )
+                elif git_source.files:
+                    OBS._log_git_source(git_source)
+                    OBS._export_git_files(
+                        git_clone.git_dir, git_source.revision,
+                        OBS.get_git_source_files(git_source), checkout_dir
+                    )
+        if self.git_cache:
+            self.git_cache.evict()
+
+    @staticmethod
+    def get_git_sources(checkout_dir: str) -> List[git_source_type]:
+        """
+        Read the git sources referenced by the obs_scm services of
+        the _service file in checkout_dir
+
+        :param str checkout_dir: checkout directory
+
+        :return: git sources in _service order
+
+        :rtype: list
+        """
         git_sources: List[git_source_type] = []
         service_xml = etree.parse(
             os.sep.join([checkout_dir, '_service'])
@@ -344,6 +1099,7 @@ class OBS:
         )
         for scm_service in scm_services:
             source_files: List[str] = []
+            source_excludes: List[str] = []
             (source_ok, source_url, source_dir, source_branch, full_source) = (
                 False, None, '', 'master', False
             )
@@ -359,6 +1115,8 @@ class OBS:
                     source_branch = param.text
                 if scm_type == 'extract':
                     source_files.append(param.text)
+                if scm_type == 'exclude':
+                    source_excludes.append(param.text)
                 if scm_type == 'filename':
                     full_source = True
             if source_ok and source_url:
@@ -368,67 +1126,657 @@ class OBS:
                         revision=source_branch,
                         source_dir=source_dir,
                         files=source_files,
-                        use_entire_source_dir=full_source
+                        use_entire_source_dir=full_source,
+                        excludes=source_excludes
                     )
                 )
+        return git_sources
+
+    @staticmethod
+    def get_git_clone_requests(
+        checkout_dir: str, git_sources: List[git_source_type]
+    ) -> List[git_clone_request_type]:
+        """
+        Return the clones needed for the given git sources. There
+        is one clone per distinct url and revision below the
+        _obs_scm_git directory in checkout_dir, which is shared by
+        all sources referencing it. If all of these sources only
+        extract files, no working tree is checked out and the files
+        are exported by git archive instead
+
+        :param str checkout_dir: checkout directory
+        :param list git_sources: git sources from get_git_sources
+
+        :return: clone requests in order of first use
+
+        :rtype: list
+        """
+        git_clone_sources: Dict[
+            Tuple[str, str], List[git_source_type]
+        ] = {}
         for git_source in git_sources:
-            git_checkout_dir = os.sep.join([checkout_dir, '_obs_scm_git'])
-            if not os.path.exists(git_checkout_dir):
-                log.info(f'Cloning git: {git_source.clone!r}')
-                Command.run(
+            git_clone_sources.setdefault(
+                (git_source.clone, git_source.revision), []
+            ).append(git_source)
+        return [
+            git_clone_request_type(
+                url=url,
+                revision=revision,
+                target_dir=os.sep.join(
                     [
-                        'git', 'clone', '--branch', git_source.revision,
-                        git_source.clone, git_checkout_dir
+                        checkout_dir, '_obs_scm_git',
+                        hashlib.sha256(
+                            f'{url}#{revision}'.encode()
+                        ).hexdigest()[0:16]
                     ]
+                ),
+                sparse_paths=OBS._get_git_sparse_paths(sources),
+                checkout=any(
+                    source.use_entire_source_dir for source in sources
                 )
-            if git_source.files or git_source.use_entire_source_dir:
-                log.info(f'Fetching from {git_source.source_dir!r}')
-                for source_file in git_source.files:
-                    log.info(f'--> {source_file!r}')
-                    shutil.copy(
-                        os.sep.join(
-                            [
-                                git_checkout_dir, git_source.source_dir,
-                                source_file
-                            ]
-                        ), checkout_dir
-                    )
-                if git_source.use_entire_source_dir:
-                    log.info('--> Copy of directory')
-                    Command.run(
-                        [
-                            'cp', '-a', os.sep.join(
-                                [git_checkout_dir, git_source.source_dir]
-                            ), checkout_dir
-                        ]
+            ) for (url, revision), sources in git_clone_sources.items()
+        ]
+
+    @staticmethod
+    def get_git_source_files(git_source: git_source_type) -> List[str]:
+        """
+        Return the repository paths of the files extracted from
+        the given git source
+
+        :param git_source_type git_source: git source
+
+        :return: file paths relative to the repository root
+
+        :rtype: list
+        """
+        return [
+            '/'.join(
+                filter(None, [git_source.source_dir.strip('/'), source_file])
+            ) for source_file in git_source.files
+        ]
+
+    @staticmethod
+    def copy_git_source(
+        git_dir: str, git_source: git_source_type, checkout_dir: str,
+        jobs: int = 4
+    ) -> None:
+        """
+        Copy the extracted files and, if used, the source directory
+        of the given git source from the working tree in git_dir
+        into checkout_dir
+
+        :param str git_dir: git clone with a working tree
+        :param git_source_type git_source: git source
+        :param str checkout_dir: checkout directory
+        :param int jobs: number of concurrent file copies
+        """
+        if not git_source.files and not git_source.use_entire_source_dir:
+            return
+        OBS._log_git_source(git_source)
+        for source_file in git_source.files:
+            FileCopy.copy(
+                os.sep.join([git_dir, git_source.source_dir, source_file]),
+                os.sep.join([checkout_dir, os.path.basename(source_file)])
+            )
+        if git_source.use_entire_source_dir:
+            log.info('--> Copy of directory')
+            source_dir = os.path.normpath(
+                os.sep.join([git_dir, git_source.source_dir])
+            )
+            FileCopy.copy_tree(
+                source_dir, os.sep.join(
+                    [checkout_dir, os.path.basename(source_dir)]
+                ), jobs, git_source.excludes
+            )
+
+    def _clone_git_sources(
+        self, checkout_dir: str, git_sources: List[git_source_type]
+    ) -> Dict[Tuple[str, str], git_clone_type]:
+        """
+        Clone the git repositories of the given git sources as
+        listed by get_git_clone_requests. Clones from a previous
+        run are replaced by a fresh clone of the updated git mirror.
+        Up to self.jobs clones run concurrently, the first failed
+        clone cancels all clones not yet started and its exception
+        is raised
+
+        :return: git repository per url and revision
+
+        :rtype: dict
+        """
+        clone_requests = OBS.get_git_clone_requests(checkout_dir, git_sources)
+        clones = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            for clone_request in clone_requests:
+                (url, revision) = (clone_request.url, clone_request.revision)
+                log.info(f'Cloning git: {url!r} at {revision!r}')
+                clones[(url, revision)] = pool.submit(
+                    self._clone_git_source, url, revision,
+                    clone_request.target_dir, clone_request.sparse_paths,
+                    clone_request.checkout
+                )
+            (done, pending) = wait(
+                list(clones.values()), return_when=FIRST_EXCEPTION
+            )
+            for clone in pending:
+                clone.cancel()
+        for clone in clones.values():
+            issue = None if clone.cancelled() else clone.exception()
+            if issue:
+                raise issue
+        return {
+            (clone_request.url, clone_request.revision): git_clone_type(
+                git_dir=clones[
+                    (clone_request.url, clone_request.revision)
+                ].result(),
+                checkout=clone_request.checkout
+            ) for clone_request in clone_requests
+        }
+
+    def _clone_git_source(
+        self, url: str, revision: str, target_dir: str,
+        sparse_paths: List[str], checkout: bool = True
+    ) -> str:
+        if os.path.exists(target_dir):
+            shutil.rmtree(target_dir)
+        promisor_url = None
+        if self.git_cache:
+            mirror_dir = self.git_cache.update(url)
+            if not checkout:
+                # git archive reads from the mirror directly
+                return mirror_dir
+            (url, promisor_url) = (f'file://{mirror_dir}', url)
+        OBS._git_clone(
+            url, revision, target_dir, sparse_paths, checkout, promisor_url
+        )
+        return target_dir
+
+    @staticmethod
+    def _export_git_files(
+        git_dir: str, revision: str, source_files: List[str],
+        target_dir: str
+    ) -> None:
+        """
+        Export the given files of revision from the git repository
+        in git_dir into target_dir using git archive. The archive
+        is extracted while git produces it and the files are stored
+        by their base name. No working tree is needed, in a blobless
+        clone only the blobs of the exported files are fetched
+
+        :param str git_dir: git repository, bare or not
+        :param str revision: branch or tag name
+        :param list source_files: file paths in the repository
+        :param str target_dir: target directory
+        """
+        git_archive = Command.call(
+            OBS.get_git_archive_command(git_dir, revision, source_files)
+        )
+        tar_issue = None
+        try:
+            OBS.extract_git_archive(git_archive.output, target_dir)
+        except tarfile.TarError as issue:
+            tar_issue = issue
+        finally:
+            git_archive.output.close()
+        error = git_archive.error.read().decode()
+        if git_archive.process.wait() != 0:
+            raise KiwiOBSPluginSourceError(
+                f'git archive of {source_files} failed: {error}'
+            )
+        if tar_issue:
+            raise KiwiOBSPluginSourceError(
+                f'git archive of {source_files} failed: {tar_issue}'
+            )
+
+    @staticmethod
+    def get_git_archive_command(
+        git_dir: str, revision: str, source_files: List[str]
+    ) -> List[str]:
+        """
+        Return the git archive call which writes a tar archive
+        of the given files of revision to stdout
+
+        :param str git_dir: git repository, bare or not
+        :param str revision: branch or tag name
+        :param list source_files: file paths in the repository
+
+        :return: command and arguments
+
+        :rtype: list
+        """
+        return [
+            'git', '-C', git_dir, 'archive', '--format=tar', revision, '--'
+        ] + source_files
+
+    @staticmethod
+    def extract_git_archive(archive_fd: IO[bytes], target_dir: str) -> None:
+        """
+        Extract the files and symlinks of the tar archive read from
+        archive_fd into target_dir. The archive is read as a stream
+        and the files are stored by their base name
+
+        :param object archive_fd: file object of a tar archive
+        :param str target_dir: target directory
+        """
+        with tarfile.open(fileobj=archive_fd, mode='r|') as archive:
+            for member in archive:
+                if not member.isfile() and not member.issym():
+                    continue
+                target = os.sep.join(
+                    [target_dir, os.path.basename(member.name)]
+                )
+                FileCopy.remove(target)
+                if member.issym():
+                    os.symlink(member.linkname, target)
+                    continue
+                # extractfile returns None for non regular files only
+                source_fd = cast(IO[bytes], archive.extractfile(member))
+                with open(target, 'wb') as target_fd:
+                    shutil.copyfileobj(source_fd, target_fd)
+                os.chmod(target, member.mode)
+
+    @staticmethod
+    def _get_git_sparse_paths(git_sources: List[git_source_type]) -> List[str]:
+        """
+        Return the sparse checkout patterns which cover the files
+        and directories used from the given git sources. The
+        exclude patterns of a source directory are added as negated
+        patterns right after it, such that excluded content is not
+        fetched. Extracted files are listed last, as the last
+        matching pattern wins
+
+        :return:
+            list of patterns, empty if the entire repository is used
+
+        :rtype: list
+        """
+        sparse_paths = []
+        file_paths = []
+        for git_source in git_sources:
+            source_dir = git_source.source_dir.strip('/')
+            if git_source.use_entire_source_dir:
+                if not source_dir and not git_source.excludes:
+                    return []
+                sparse_paths.append(f'/{source_dir}/' if source_dir else '/*')
+                for exclude in git_source.excludes:
+                    if '/' not in exclude.strip('/'):
+                        exclude = '/'.join(['**', exclude.strip('/')])
+                    sparse_paths.append(
+                        '!/' + '/'.join(
+                            filter(None, [source_dir, exclude.strip('/')])
+                        )
                     )
+            for source_file in git_source.files:
+                file_paths.append(
+                    '/' + '/'.join(filter(None, [source_dir, source_file]))
+                )
+        return sparse_paths + file_paths
 
     @staticmethod
-    def _get_primary_multibuild_profile(checkout_dir):
-        log.info('Reading multibuild profile(s)...')
-        multibuild_profile = None
-        multibuild_xml = etree.parse(
-            os.sep.join([checkout_dir, '_multibuild'])
+    def _git_clone(
+        url: str, revision: str, target_dir: str, sparse_paths: List[str],
+        checkout: bool = True, promisor_url: Optional[str] = None
+    ) -> None:
+        """
+        Clone the given revision of the git repository at url into
+        target_dir. The clone is shallow and blobless, only the
+        commit and tree of revision are fetched. If sparse_paths
+        are given only the matching files are checked out, and
+        only their content is fetched from the server
+
+        :param str url: git repository url
+        :param str revision: branch or tag name
+        :param str target_dir: clone directory
+        :param list sparse_paths: sparse checkout patterns
+        :param bool checkout:
+            check out a working tree, if False only the commit
+            and tree objects are fetched
+        :param str promisor_url:
+            repository to fetch blobs from which are missing in
+            the blobless mirror at url
+        """
+        (clone_command, checkout_command) = OBS.get_git_clone_commands(
+            url, revision, target_dir, sparse_paths, promisor_url
         )
-        multibuild_profile_list = multibuild_xml.getroot().xpath(
-            '/multibuild/flavor'
+        Command.run(clone_command)
+        if not checkout:
+            return
+        OBS.write_git_sparse_checkout(target_dir, sparse_paths)
+        Command.run(checkout_command)
+
+    @staticmethod
+    def get_git_clone_commands(
+        url: str, revision: str, target_dir: str, sparse_paths: List[str],
+        promisor_url: Optional[str] = None
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Return the git calls which clone the given revision of the
+        git repository at url into target_dir and check out its
+        working tree. The clone is shallow and blobless, and sparse
+        checkout is enabled if sparse_paths are given. The patterns
+        must be written by write_git_sparse_checkout before the
+        working tree is checked out
+
+        :param str url: git repository url
+        :param str revision: branch or tag name
+        :param str target_dir: clone directory
+        :param list sparse_paths: sparse checkout patterns
+        :param str promisor_url:
+            repository to fetch blobs from which are missing in
+            the blobless mirror at url
+
+        :return: clone and checkout command
+
+        :rtype: tuple
+        """
+        clone_command = [
+            'git', 'clone', '--depth', '1', '--filter=blob:none',
+            '--no-checkout'
+        ]
+        if sparse_paths:
+            clone_command += ['--config', 'core.sparseCheckout=true']
+        if promisor_url:
+            # The mirror does not fetch missing blobs for its clones,
+            # the checkout fetches them from the mirrored repository
+            clone_command += [
+                '--config', f'remote.upstream.url={promisor_url}',
+                '--config', 'remote.upstream.promisor=true',
+                '--config', 'remote.upstream.partialclonefilter=blob:none'
+            ]
+        return (
+            clone_command + ['--branch', revision, url, target_dir],
+            ['git', '-C', target_dir, 'read-tree', '-mu', 'HEAD']
         )
+
+    @staticmethod
+    def write_git_sparse_checkout(
+        target_dir: str, sparse_paths: List[str]
+    ) -> None:
+        """
+        Write the sparse checkout patterns of the git clone in
+        target_dir, nothing is written if there are none
+
+        :param str target_dir: clone directory
+        :param list sparse_paths: sparse checkout patterns
+        """
+        if not sparse_paths:
+            return
+        git_info_dir = os.sep.join([target_dir, '.git', 'info'])
+        os.makedirs(git_info_dir, exist_ok=True)
+        with open(
+            os.sep.join([git_info_dir, 'sparse-checkout']), 'w'
+        ) as sparse_checkout:
+            for sparse_path in sparse_paths:
+                sparse_checkout.write(f'{sparse_path}{os.linesep}')
+
+    @staticmethod
+    def _log_git_source(git_source: git_source_type) -> None:
+        log.info(f'Fetching from {git_source.source_dir!r}')
+        for source_file in git_source.files:
+            log.info(f'--> {source_file!r}')
+
+    @staticmethod
+    def _get_primary_multibuild_profile(checkout_dir):
+        multibuild_profile = None
+        multibuild_profile_list = OBS.get_multibuild_profiles(checkout_dir)
         if multibuild_profile_list:
-            multibuild_profile = multibuild_profile_list[0].text
+            multibuild_profile = multibuild_profile_list[0]
             log.info(
                 f'--> Using profile {multibuild_profile!r}'
             )
         return multibuild_profile
 
-    def _create_request(self, url):
+    def _fetch_source_files(
+        self, package_link: str, checkout_dir: str, source_files: List[str]
+    ) -> None:
+        """
+        Download the given package source files into checkout_dir
+        using a pool of at most self.jobs concurrent downloads.
+        The first failed download cancels all downloads which
+        have not yet been started and its exception is raised
+        """
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            downloads = []
+            for source_file in source_files:
+                log.info(f'--> {source_file}')
+                downloads.append(
+                    pool.submit(
+                        self._fetch_source_file,
+                        os.sep.join([package_link, source_file]),
+                        os.sep.join([checkout_dir, source_file])
+                    )
+                )
+            (done, pending) = wait(downloads, return_when=FIRST_EXCEPTION)
+            for download in pending:
+                download.cancel()
+        for download in downloads:
+            issue = None if download.cancelled() else download.exception()
+            if issue:
+                raise issue
+
+    def _fetch_cached_source_files(
+        self, checkout_dir: str, source_files: List[str],
+        source_md5sums: Dict[str, str]
+    ) -> List[str]:
+        """
+        Materialize the given package source files from the source
+        cache into checkout_dir
+
+        :return: list of source files not found in the cache
+
+        :rtype: list
+        """
+        uncached_source_files = []
+        for source_file in source_files:
+            if self.source_cache and self.source_cache.get(
+                source_md5sums[source_file],
+                os.sep.join([checkout_dir, source_file])
+            ):
+                log.info(f'--> {source_file} (cached)')
+            else:
+                uncached_source_files.append(source_file)
+        return uncached_source_files
+
+    def _fetch_source_archive(
+        self, package_link: str, checkout_dir: str, source_files: List[str]
+    ) -> bool:
+        """
+        Download the given package source files into checkout_dir
+        using a single request which provides all package sources
+        as cpio archive. The archive is extracted while it streams
+        in. Files missing in the archive are downloaded one by one
+
+        :return:
+            True if the archive could be used, False if the server
+            did not provide it and nothing was fetched
+
+        :rtype: bool
+        """
+        try:
+            request = self._create_request(
+                f'{package_link}?view=cpio', stream=True
+            )
+            with request:
+                request.raw.decode_content = True
+                extracted = Cpio(request.raw).extract(
+                    checkout_dir, source_files
+                )
+        except (KiwiUriOpenError, KiwiOBSPluginCpioError) as issue:
+            log.warning(f'--> Bulk download not possible: {issue}')
+            log.warning('--> Falling back to single file downloads')
+            return False
+        missing_source_files = [
+            source_file for source_file in source_files
+            if source_file not in extracted
+        ]
+        if missing_source_files:
+            self._fetch_source_files(
+                package_link, checkout_dir, missing_source_files
+            )
+        return True
+
+    def _fetch_source_file(self, url: str, target: str) -> None:
+        self._download(url, target)
+
+    def _download(self, url: str, target: str) -> None:
+        """
+        Stream the response of the given url into the target file
+        in chunks of DOWNLOAD_CHUNK_SIZE such that the memory
+        footprint does not depend on the size of the download
+        """
+        request = self._create_request(url, stream=True)
+        with request:
+            # The target may share its data with a cache entry
+            FileCopy.remove(target)
+            with open(target, 'wb') as fd:
+                for chunk in request.iter_content(
+                    chunk_size=DOWNLOAD_CHUNK_SIZE
+                ):
+                    fd.write(chunk)
+
+    def _has_api_session_cookie(self) -> bool:
+        # The session is shared with the repository probes, thus
+        # only a session cookie which is sent to the API server counts
+        api_host = urlparse(self.api_server).hostname or ''
+        for cookie in self.session.cookies:
+            domain = cookie.domain.lower().lstrip('.')
+            if cookie.name in API_SESSION_COOKIES and domain and (
+                api_host == domain or api_host.endswith(f'.{domain}')
+            ):
+                return True
+        return False
+
+    def _create_cached_request(self, url):
+        """
+        Create streamed request for url which is answered from
+        the HTTP cache if the server reports that the response
+        did not change since it was cached
+        """
+        if not self.http_cache:
+            return self._create_request(url, stream=True)
+        request = self._create_request(
+            url, stream=True,
+            headers=self.http_cache.get_conditional_headers(url)
+        )
+        if request.status_code == 304:
+            request.close()
+            cached_request = self.http_cache.get(url)
+            if cached_request:
+                return cached_request
+            # The entry got evicted in the meantime
+            request = self._create_request(url, stream=True)
+        return self.http_cache.record(url, request)
+
+    def _create_request(self, url, stream=False, headers=None):
         try:
-            request = requests.get(
-                url, auth=HTTPBasicAuth(self.user, self.password),
-                verify=self.ssl_verify
+            # Once OBS handed out a session cookie it is used to
+            # authenticate instead of the basic auth credentials.
+            # If the session has expired the request is repeated
+            # with the credentials
+            auth = None if self._has_api_session_cookie() else \
+                HTTPBasicAuth(self.user, self.password)
+            request = self._send(
+                'GET', url, auth=auth, verify=self.ssl_verify,
+                stream=stream, headers=headers
             )
+            if request.status_code == 401 and not auth:
+                request.close()
+                self.session.cookies.clear()
+                request = self._send(
+                    'GET', url, auth=HTTPBasicAuth(self.user, self.password),
+                    verify=self.ssl_verify, stream=stream, headers=headers
+                )
+            if not request.ok:
+                request.close()
             request.raise_for_status()
+        except KiwiOBSPluginCancelledError:
+            raise
         except Exception as issue:
             raise KiwiUriOpenError(
                 f'{type(issue).__name__}: {issue}'
             )
         return request
+
+    def _send(self, method: str, url: str, **kwargs) -> Any:
+        """
+        Send request for url with the configured connect and read
+        timeouts. Requests which fail due to a connection problem
+        or a temporary server error are repeated up to self.retries
+        times with exponential backoff and full jitter. Requests
+        which still failed after all retries are counted per host
+        and further requests to a host which failed repeatedly are
+        refused by the circuit breaker without contacting the host.
+        The OBS API server is exempt from the circuit breaker, as
+        the checkout cannot do without it. The per host request
+        rate and number of requests in flight are limited by the
+        host limiter. A streamed response counts as in flight
+        until it is closed. Once self.cancel_event is set, no
+        further request or retry is sent
+
+        :param str method: HTTP method
+        :param str url: request url
+
+        :return: requests.Response
+
+        :rtype: object
+        """
+        host = urlparse(url).hostname or ''
+        use_circuit_breaker = host != urlparse(self.api_server).hostname
+        if use_circuit_breaker and not self.circuit_breaker.allow(host):
+            raise requests.exceptions.ConnectionError(
+                f'Skipped request to {host} after repeated failures'
+            )
+        attempt = 0
+        while True:
+            if self.cancel_event and self.cancel_event.is_set():
+                raise KiwiOBSPluginCancelledError(
+                    f'Skipped {method} request to {url} of a cancelled call'
+                )
+            self.host_limiter.acquire(host)
+            try:
+                response = self.session.request(
+                    method, url, timeout=self.timeout, **kwargs
+                )
+            except BaseException as issue:
+                self.host_limiter.release(host)
+                if not isinstance(issue, RETRY_EXCEPTIONS):
+                    raise
+                if attempt >= self.retries:
+                    if use_circuit_breaker:
+                        self.circuit_breaker.record_failure(host)
+                    raise
+            else:
+                if kwargs.get('stream'):
+                    self._release_host_on_close(host, response)
+                else:
+                    self.host_limiter.release(host)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    if use_circuit_breaker:
+                        self.circuit_breaker.record_success(host)
+                    return response
+                if attempt >= self.retries:
+                    # Throttling is no sign of a broken host
+                    if use_circuit_breaker and response.status_code != 429:
+                        self.circuit_breaker.record_failure(host)
+                    return response
+                response.close()
+            attempt += 1
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            log.debug(f'Retrying {method} request to {url} in up to {delay}s')
+            time.sleep(random.uniform(0, delay))
+
+    @staticmethod
+    def _failed_by_cancel(future: Future, wait: bool = False) -> bool:
+        if future.cancelled() or (not wait and not future.done()):
+            return False
+        return isinstance(future.exception(), KiwiOBSPluginCancelledError)
+
+    def _release_host_on_close(self, host: str, response: Any) -> None:
+        close = response.close
+
+        def close_and_release():
+            response.close = close
+            close()
+            self.host_limiter.release(host)
+
+        response.close = close_and_release
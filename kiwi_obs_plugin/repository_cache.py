@@ -0,0 +1,127 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import json
+import time
+import logging
+import threading
+from tempfile import mkstemp
+from typing import (
+    Any, Dict, Optional
+)
+
+log: Any = logging.getLogger('kiwi')
+
+
+class RepositoryCache:
+    """
+    **Implements a persistent cache for repository probe results**
+
+    The result of probing a repository, its type and status, is
+    stored per translated repository url in a JSON file. Entries
+    older than ttl seconds are considered stale and not used.
+    The cache can be shared by parallel probes of one process
+    as well as by multiple processes
+
+    :param str cache_file: JSON cache file path
+    :param int ttl: time to live of an entry in seconds
+    """
+    def __init__(self, cache_file: str, ttl: int):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.new_entries: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Read cache entries from the cache file
+        """
+        with self.lock:
+            self.entries = self._read()
+
+    def get(self, repo_url: str) -> Optional[Dict[str, Any]]:
+        """
+        Lookup probe result for the given repository url
+
+        :param str repo_url: translated repository url
+
+        :return:
+            dict with repo_type, flag and message or None if there
+            is no entry which is younger than ttl
+
+        :rtype: dict
+        """
+        with self.lock:
+            entry = self.entries.get(repo_url)
+        if entry and time.time() - entry.get('time', 0) < self.ttl:
+            log.debug(f'Using cached probe result for {repo_url}')
+            return entry
+        return None
+
+    def set(
+        self, repo_url: str, repo_type: Optional[str], flag: str, message: str
+    ) -> None:
+        """
+        Store probe result for the given repository url
+
+        :param str repo_url: translated repository url
+        :param str repo_type: repository type or None
+        :param str flag: status flag
+        :param str message: status message
+        """
+        entry = {
+            'repo_type': repo_type,
+            'flag': flag,
+            'message': message,
+            'time': time.time()
+        }
+        with self.lock:
+            self.entries[repo_url] = entry
+            self.new_entries[repo_url] = entry
+
+    def save(self) -> None:
+        """
+        Merge the entries stored since the last save into the
+        cache file. Stale entries are dropped
+        """
+        with self.lock:
+            if not self.new_entries:
+                return
+            entries = self._read()
+            entries.update(self.new_entries)
+            self.new_entries = {}
+            now = time.time()
+            entries = {
+                repo_url: entry for repo_url, entry in entries.items()
+                if now - entry.get('time', 0) < self.ttl
+            }
+            cache_dir = os.path.dirname(self.cache_file)
+            os.makedirs(cache_dir, exist_ok=True)
+            (fd, cache_file_tmp) = mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as cache:
+                json.dump(entries, cache)
+            os.replace(cache_file_tmp, self.cache_file)
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.cache_file) as cache:
+                entries = json.load(cache)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
@@ -0,0 +1,276 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+
+# project
+from kiwi.runtime_config import RuntimeConfig as KiwiRuntimeConfig
+
+# Default size budget of the OBS source cache in MB
+DEFAULT_SOURCE_CACHE_SIZE = 1024
+
+# Default size budget of the git mirror cache in MB
+DEFAULT_GIT_CACHE_SIZE = 2048
+
+# Default size budget of the OBS API response cache in MB
+DEFAULT_HTTP_CACHE_SIZE = 64
+
+# Default time in seconds repository probe results are cached
+DEFAULT_REPOSITORY_CACHE_TTL = 3600
+
+# Default time in seconds to wait for a connection to a server
+DEFAULT_CONNECT_TIMEOUT = 10
+
+# Default time in seconds to wait for data from a server
+DEFAULT_READ_TIMEOUT = 60
+
+# Default number of times a failed request is repeated
+DEFAULT_RETRIES = 3
+
+# Default max number of requests per second and host, 0 is unlimited
+DEFAULT_HOST_REQUEST_RATE = 0
+
+# Default max number of requests in flight per host, 0 is unlimited
+DEFAULT_HOST_MAX_REQUESTS = 8
+
+
+class RuntimeConfig(KiwiRuntimeConfig):
+    """
+    **Implements reading of the plugin specific settings from
+    the obs section of the KIWI runtime configuration file**
+    """
+    def get_obs_cache_dir(self) -> str:
+        """
+        Return directory used to cache data fetched from OBS:
+
+        obs:
+          - cache_dir: /var/cache/kiwi-obs-plugin
+
+        if no configuration exists the directory kiwi-obs-plugin
+        below $XDG_CACHE_HOME or ~/.cache is used
+
+        :return: directory path
+
+        :rtype: str
+        """
+        cache_dir = self._get_attribute(
+            element='obs', attribute='cache_dir'
+        )
+        if not cache_dir:
+            cache_dir = os.sep.join(
+                [
+                    os.environ.get('XDG_CACHE_HOME') or '~/.cache',
+                    'kiwi-obs-plugin'
+                ]
+            )
+        return os.path.expanduser(cache_dir)
+
+    def get_obs_source_cache_size(self) -> int:
+        """
+        Return size budget in MB of the OBS source file cache:
+
+        obs:
+          - source_cache_size: 1024
+
+        if no configuration exists DEFAULT_SOURCE_CACHE_SIZE
+        is used. A size of 0 switches the cache off
+
+        :return: size in MB
+
+        :rtype: int
+        """
+        source_cache_size = self._get_attribute(
+            element='obs', attribute='source_cache_size'
+        )
+        if source_cache_size is None:
+            return DEFAULT_SOURCE_CACHE_SIZE
+        return int(source_cache_size)
+
+    def get_obs_repository_cache_ttl(self) -> int:
+        """
+        Return time in seconds the result of a repository probe
+        is cached:
+
+        obs:
+          - repository_cache_ttl: 3600
+
+        if no configuration exists DEFAULT_REPOSITORY_CACHE_TTL
+        is used. A time of 0 switches the cache off
+
+        :return: time in seconds
+
+        :rtype: int
+        """
+        repository_cache_ttl = self._get_attribute(
+            element='obs', attribute='repository_cache_ttl'
+        )
+        if repository_cache_ttl is None:
+            return DEFAULT_REPOSITORY_CACHE_TTL
+        return int(repository_cache_ttl)
+
+    def get_obs_http_cache_size(self) -> int:
+        """
+        Return size budget in MB of the OBS API response cache:
+
+        obs:
+          - http_cache_size: 64
+
+        if no configuration exists DEFAULT_HTTP_CACHE_SIZE
+        is used. A size of 0 switches the cache off
+
+        :return: size in MB
+
+        :rtype: int
+        """
+        http_cache_size = self._get_attribute(
+            element='obs', attribute='http_cache_size'
+        )
+        if http_cache_size is None:
+            return DEFAULT_HTTP_CACHE_SIZE
+        return int(http_cache_size)
+
+    def get_obs_connect_timeout(self) -> float:
+        """
+        Return time in seconds to wait for a connection
+        to a server:
+
+        obs:
+          - connect_timeout: 10
+
+        if no configuration exists DEFAULT_CONNECT_TIMEOUT
+        is used
+
+        :return: time in seconds
+
+        :rtype: float
+        """
+        connect_timeout = self._get_attribute(
+            element='obs', attribute='connect_timeout'
+        )
+        if connect_timeout is None:
+            return DEFAULT_CONNECT_TIMEOUT
+        return float(connect_timeout)
+
+    def get_obs_read_timeout(self) -> float:
+        """
+        Return time in seconds to wait for data from
+        a server:
+
+        obs:
+          - read_timeout: 60
+
+        if no configuration exists DEFAULT_READ_TIMEOUT
+        is used
+
+        :return: time in seconds
+
+        :rtype: float
+        """
+        read_timeout = self._get_attribute(
+            element='obs', attribute='read_timeout'
+        )
+        if read_timeout is None:
+            return DEFAULT_READ_TIMEOUT
+        return float(read_timeout)
+
+    def get_obs_retries(self) -> int:
+        """
+        Return number of times a request which failed
+        due to a connection problem or a temporary server
+        error is repeated:
+
+        obs:
+          - retries: 3
+
+        if no configuration exists DEFAULT_RETRIES
+        is used
+
+        :return: number of retries
+
+        :rtype: int
+        """
+        retries = self._get_attribute(
+            element='obs', attribute='retries'
+        )
+        if retries is None:
+            return DEFAULT_RETRIES
+        return int(retries)
+
+    def get_obs_host_request_rate(self) -> float:
+        """
+        Return max number of requests per second sent to
+        one host:
+
+        obs:
+          - host_request_rate: 5
+
+        if no configuration exists DEFAULT_HOST_REQUEST_RATE
+        is used. A rate of 0 switches the limit off
+
+        :return: requests per second
+
+        :rtype: float
+        """
+        host_request_rate = self._get_attribute(
+            element='obs', attribute='host_request_rate'
+        )
+        if host_request_rate is None:
+            return DEFAULT_HOST_REQUEST_RATE
+        return float(host_request_rate)
+
+    def get_obs_host_max_requests(self) -> int:
+        """
+        Return max number of requests in flight to one host:
+
+        obs:
+          - host_max_requests: 8
+
+        if no configuration exists DEFAULT_HOST_MAX_REQUESTS
+        is used. A number of 0 switches the limit off
+
+        :return: number of requests
+
+        :rtype: int
+        """
+        host_max_requests = self._get_attribute(
+            element='obs', attribute='host_max_requests'
+        )
+        if host_max_requests is None:
+            return DEFAULT_HOST_MAX_REQUESTS
+        return int(host_max_requests)
+
+    def get_obs_git_cache_size(self) -> int:
+        """
+        Return size budget in MB of the cache of git mirrors
+        used for obs_scm services:
+
+        obs:
+          - git_cache_size: 2048
+
+        if no configuration exists DEFAULT_GIT_CACHE_SIZE
+        is used. A size of 0 switches the cache off
+
+        :return: size in MB
+
+        :rtype: int
+        """
+        git_cache_size = self._get_attribute(
+            element='obs', attribute='git_cache_size'
+        )
+        if git_cache_size is None:
+            return DEFAULT_GIT_CACHE_SIZE
+        return int(git_cache_size)
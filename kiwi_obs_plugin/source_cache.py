@@ -0,0 +1,124 @@
+# Copyright (c) 2021 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of kiwi-obs-plugin.
+#
+# kiwi-obs-plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kiwi-obs-plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kiwi-obs-plugin.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import re
+import logging
+from tempfile import mkstemp
+from typing import (
+    Any, List, Tuple
+)
+
+# project
+from kiwi.utils.checksum import Checksum
+
+from kiwi_obs_plugin.file_copy import FileCopy
+
+log: Any = logging.getLogger('kiwi')
+
+
+class SourceCache:
+    """
+    **Implements a content addressed store for OBS source files**
+
+    Files are stored by the md5 sum OBS provides for them in
+    the package source listing. Entries are verified against
+    their md5 sum on lookup such that a modified entry is never
+    handed out. If the size of all entries exceeds max_size the
+    least recently used entries are evicted
+
+    :param str cache_dir: cache directory
+    :param int max_size: size budget in bytes
+    """
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def get(self, md5: str, target: str) -> bool:
+        """
+        Materialize the cache entry for md5 as target file
+
+        :param str md5: md5 sum of the source file
+        :param str target: target file path
+
+        :return: True on cache hit, otherwise False
+
+        :rtype: bool
+        """
+        entry = self._get_entry_path(md5)
+        if not entry or not os.path.isfile(entry):
+            return False
+        if Checksum(entry).md5() != md5:
+            log.debug(f'Dropping modified source cache entry {entry!r}')
+            FileCopy.remove(entry)
+            return False
+        os.utime(entry)
+        FileCopy.link_or_copy(entry, target)
+        return True
+
+    def add(self, md5: str, source: str) -> None:
+        """
+        Add source file as cache entry for md5. The file is only
+        added if its md5 sum matches
+
+        :param str md5: md5 sum of the source file
+        :param str source: source file path
+        """
+        entry = self._get_entry_path(md5)
+        if not entry or os.path.isfile(entry):
+            return
+        if Checksum(source).md5() != md5:
+            log.debug(f'Not caching {source!r}: md5 sum mismatch')
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        (fd, entry_tmp) = mkstemp(dir=os.path.dirname(entry))
+        os.close(fd)
+        FileCopy.link_or_copy(source, entry_tmp)
+        os.replace(entry_tmp, entry)
+
+    def evict(self) -> None:
+        """
+        Delete least recently used entries until the size of all
+        entries fits into max_size
+        """
+        entries: List[Tuple[float, int, str]] = []
+        cache_size = 0
+        for (root, dirs, files) in os.walk(self.cache_dir):
+            for name in files:
+                entry = os.sep.join([root, name])
+                try:
+                    entry_stat = os.stat(entry)
+                except OSError:
+                    continue
+                entries.append(
+                    (entry_stat.st_mtime, entry_stat.st_size, entry)
+                )
+                cache_size += entry_stat.st_size
+        for (mtime, size, entry) in sorted(entries):
+            if cache_size <= self.max_size:
+                break
+            log.debug(f'Evicting source cache entry {entry!r}')
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            cache_size -= size
+
+    def _get_entry_path(self, md5: str) -> str:
+        if not md5 or not re.match('^[0-9a-f]{32}$', md5):
+            return ''
+        return os.sep.join([self.cache_dir, md5[0:2], md5])
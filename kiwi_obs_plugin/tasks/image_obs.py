@@ -18,11 +18,25 @@
 """
 usage: kiwi-ng image obs -h | --help
        kiwi-ng image obs --image=<path> --target-dir=<directory>
-           [--force]
+           [--force|--sync]
+           [--bulk]
            [--user=<name>]
            [--ssl-no-verify]
            [--arch=<arch>]
            [--repo=<repo>]
+           [--jobs=<number>]
+           [--no-cache]
+           [--pipeline]
+           [--all-flavors|--flavors=<names>]
+       kiwi-ng image obs --manifest=<file> --target-dir=<directory>
+           [--force|--sync]
+           [--bulk]
+           [--user=<name>]
+           [--ssl-no-verify]
+           [--arch=<arch>]
+           [--repo=<repo>]
+           [--jobs=<number>]
+           [--no-cache]
        kiwi-ng image obs help
 
 
@@ -32,9 +46,24 @@ commands:
         for local build capabilities
 
 options:
+    --all-flavors
+        Check out all flavors from the _multibuild file of the
+        image. The sources are fetched once and each flavor gets
+        its own config file named after the flavor
+
     --arch=<arch>
         Optional architecture reference for the specifified image
-        image. This defaults to x86_64
+        image. This defaults to x86_64. A comma separated list of
+        architectures checks out the image for each of them. The
+        sources are fetched once and each architecture gets its
+        own config file named after the architecture
+
+    --bulk
+        Fetch all image sources from OBS in one request
+
+    --flavors=<names>
+        Comma separated list of flavors from the _multibuild file
+        to check out like with --all-flavors
 
     --force
         Allow to override existing content from --target-dir
@@ -43,6 +72,35 @@ options:
         Image location for an image description in the Open Build Service.
         The specification consists out of the project and package name
         specified like a storage path, e.g `OBS:project:name/package`
+        If only the project is specified, e.g `OBS:project:name/`,
+        all packages of the project which provide an image
+        description are checked out below project/package in
+        --target-dir. Packages unchanged since the last complete
+        checkout of all --arch values are skipped unless --force
+        is set, changed packages are updated like with --sync.
+        The config files are named after the architecture
+
+    --jobs=<number>
+        Optional number of concurrent downloads used to fetch
+        the image sources from OBS. The number must be at least
+        1 and defaults to 4
+
+    --manifest=<file>
+        Check out all images listed in the given manifest file.
+        Each line references one image as project/package with
+        an optional :flavor and @arch suffix. Entries without
+        @arch are checked out for each --arch. The images are
+        stored in project/package below --target-dir. All
+        images share one OBS connection and the local caches
+        and are fetched by a pool of --jobs workers
+
+    --no-cache
+        Do not use the local caches for OBS sources, OBS API
+        responses, git mirrors and repository probe results
+
+    --pipeline
+        Look up the OBS repositories in the background while
+        the image sources are fetched
 
     --repo=<repo>
         Optional repository name. This defaults to: image
@@ -50,6 +108,11 @@ options:
     --ssl-no-verify
         Do not verify SSL server certificate when connecting to OBS
 
+    --sync
+        Update existing content from --target-dir incrementally.
+        Only files which differ from the sources in OBS are fetched
+        and files deleted in OBS are deleted from --target-dir
+
     --target-dir=<directory>
         the target directory to store the image description checked
         out from OBS and adapted by kiwi to be build locally
@@ -58,11 +121,27 @@ options:
         Open Build Service account user name. KIWI will ask for the
         user credentials which blocks stdin until entered
 """
+import os
+import time
 import logging
+from concurrent.futures import (
+    ThreadPoolExecutor, as_completed
+)
+from typing import (
+    Dict, List, Optional, Tuple
+)
 from kiwi.tasks.base import CliTask
 from kiwi.help import Help
 
-from kiwi_obs_plugin.obs import OBS
+from kiwi_obs_plugin.obs import (
+    OBS, obs_checkout_type
+)
+from kiwi_obs_plugin.manifest import (
+    Manifest, manifest_entry_type
+)
+from kiwi_obs_plugin.exceptions import (
+    KiwiOBSPluginJobsError, KiwiOBSPluginSourceError
+)
 
 log = logging.getLogger('kiwi')
 
@@ -73,28 +152,47 @@ class ImageObsTask(CliTask):
         if self.command_args.get('help'):
             return self.manual.show('kiwi::image::obs')
 
+        if self.command_args.get('--manifest'):
+            return self._process_manifest()
+
+        if (self.command_args.get('--image') or '').endswith(os.sep):
+            return self._process_project()
+
         if self.command_args.get('--image'):
-            ssl_verify = bool(
-                self.command_args['--ssl-no-verify']
-            )
-            self.obs = OBS(
-                self.command_args['--image'], ssl_verify,
-                self.command_args['--user']
-            )
+            self.obs = self._create_obs(self.command_args['--image'])
+            arches = (self.command_args['--arch'] or 'x86_64').split(',')
+            repo = self.command_args['--repo'] or 'images'
             obs_checkout = self.obs.fetch_obs_image(
                 self.command_args['--target-dir'],
                 self.command_args['--force'],
-                self.global_args['--profile']
+                self.global_args['--profile'],
+                self.command_args['--sync'],
+                self.command_args['--bulk'],
+                self.command_args['--pipeline'],
+                arches[0], repo
             )
+            flavors = self._get_flavors(obs_checkout.checkout_dir)
+            if flavors or len(arches) > 1:
+                profiles: List[Optional[str]] = list(flavors) \
+                    if flavors else [obs_checkout.profile]
+                config_files = self._process_targets(
+                    obs_checkout.checkout_dir, [
+                        (profile, arch)
+                        for profile in profiles for arch in arches
+                    ], repo, bool(flavors), len(arches) > 1
+                )
+                log.info('Successfully checked out OBS project at:')
+                for config_file in config_files:
+                    log.info(f'--> {config_file}')
+                return
             if obs_checkout.profile:
                 self.global_args['--profile'] = [obs_checkout.profile]
             self.load_xml_description(
-                obs_checkout.checkout_dir
+                obs_checkout.checkout_dir,
+                OBS.get_image_description_file(obs_checkout.checkout_dir)
             )
             repo_status = self.obs.add_obs_repositories(
-                self.xml_state, obs_checkout.profile,
-                self.command_args['--arch'] or 'x86_64',
-                self.command_args['--repo'] or 'images'
+                self.xml_state, obs_checkout.profile, arches[0], repo
             )
             self.obs.write_kiwi_config_from_state(
                 self.xml_state, self.config_file
@@ -102,3 +200,213 @@ class ImageObsTask(CliTask):
             self.obs.print_repository_status(repo_status)
             log.info('Successfully checked out OBS project at:')
             log.info(f'--> {obs_checkout.checkout_dir}')
+
+    def _create_obs(self, image: str) -> OBS:
+        return OBS(
+            image, bool(self.command_args['--ssl-no-verify']),
+            self.command_args['--user'], None,
+            self._get_jobs(), not self.command_args['--no-cache']
+        )
+
+    def _get_jobs(self) -> int:
+        jobs = self.command_args['--jobs'] or '4'
+        try:
+            number_of_jobs = int(jobs)
+        except ValueError:
+            number_of_jobs = 0
+        if number_of_jobs < 1:
+            raise KiwiOBSPluginJobsError(
+                f'--jobs must be a positive integer, got {jobs!r}'
+            )
+        return number_of_jobs
+
+    def _get_flavors(self, checkout_dir: str) -> Optional[List[str]]:
+        if not self.command_args['--all-flavors'] and \
+                not self.command_args['--flavors']:
+            return None
+        multibuild_profiles = OBS.get_multibuild_profiles(checkout_dir)
+        if self.command_args['--all-flavors']:
+            return multibuild_profiles
+        flavors = self.command_args['--flavors'].split(',')
+        for flavor in flavors:
+            if flavor not in multibuild_profiles:
+                raise KiwiOBSPluginSourceError(
+                    f'Flavor {flavor!r} not found in _multibuild'
+                )
+        return flavors
+
+    def _process_targets(
+        self, checkout_dir: str, targets: List[Tuple[Optional[str], str]],
+        repo: str, name_by_profile: bool, name_by_arch: bool
+    ) -> List[str]:
+        # Start the _buildinfo lookups of all targets at once
+        for (profile, arch) in targets:
+            self.obs.prefetch_obs_repositories(profile, arch, repo)
+        # Always load the description from OBS and not a config
+        # file written for another target
+        kiwi_file = OBS.get_image_description_file(checkout_dir)
+        config_files = []
+        for (profile, arch) in targets:
+            self.global_args['--profile'] = [profile] if profile else []
+            self.load_xml_description(checkout_dir, kiwi_file)
+            if not kiwi_file:
+                # kiwi looked up the description, remember it for
+                # the next run which also finds the written files
+                OBS.set_image_description_file(
+                    checkout_dir,
+                    os.path.relpath(self.config_file, checkout_dir)
+                )
+            kiwi_file = os.path.relpath(self.config_file, checkout_dir)
+            repo_status = self.obs.add_obs_repositories(
+                self.xml_state, profile, arch, repo
+            )
+            (config_file_base, config_file_ext) = os.path.splitext(
+                self.config_file
+            )
+            config_file_name = [config_file_base]
+            if name_by_profile:
+                config_file_name.append(f'{profile}')
+            if name_by_arch:
+                config_file_name.append(arch)
+            config_file = '.'.join(config_file_name) + config_file_ext
+            self.obs.write_kiwi_config_from_state(
+                self.xml_state, config_file
+            )
+            self.obs.print_repository_status(repo_status)
+            config_files.append(config_file)
+        return config_files
+
+    def _process_manifest(self) -> None:
+        entries = Manifest.read(
+            self.command_args['--manifest'],
+            (self.command_args['--arch'] or 'x86_64').split(',')
+        )
+        self._process_entries(self._create_obs(entries[0].image), entries)
+
+    def _process_project(self) -> None:
+        obs = self._create_obs(self.command_args['--image'])
+        arches = (self.command_args['--arch'] or 'x86_64').split(',')
+        entries = []
+        for package in obs.get_image_packages():
+            checkout_dir = os.sep.join(
+                [self.command_args['--target-dir'], obs.project, package.name]
+            )
+            # Sources from an earlier run only count once the config
+            # files of all architectures got written for them
+            completed_srcmd5s = set(
+                OBS.get_completed_srcmd5(checkout_dir, arch)
+                for arch in arches
+            )
+            if not self.command_args['--force'] and \
+                    completed_srcmd5s == {package.srcmd5}:
+                log.info(f'--> {package.name}: unchanged since last checkout')
+                continue
+            for arch in arches:
+                entries.append(
+                    Manifest.parse_entry(
+                        f'{obs.project}/{package.name}@{arch}'
+                    )
+                )
+        if not entries:
+            log.info('No changed image packages to check out')
+            return
+        self._process_entries(obs, entries, project=True)
+
+    def _process_entries(
+        self, obs: OBS, entries: List[manifest_entry_type],
+        project: bool = False
+    ) -> None:
+        repo = self.command_args['--repo'] or 'images'
+        # Package dirs of a project checkout are updated in place
+        # unless everything is fetched again with --force
+        sync = bool(self.command_args['--sync']) or \
+            (project and not self.command_args['--force'])
+        images: Dict[str, List[manifest_entry_type]] = {}
+        for entry in entries:
+            images.setdefault(entry.image, []).append(entry)
+        summary: Dict[str, Tuple[str, float]] = {}
+        with ThreadPoolExecutor(max_workers=self._get_jobs()) as pool:
+            image_fetches = {
+                pool.submit(
+                    self._fetch_image, obs.for_image(image),
+                    images[image], repo, sync
+                ): image for image in images
+            }
+            # The descriptions are adapted by the main thread as the
+            # images come in, while the remaining images are fetched
+            for image_fetch in as_completed(image_fetches):
+                image = image_fetches[image_fetch]
+                (self.obs, obs_checkout, fetch_time, fetch_issue) = \
+                    image_fetch.result()
+                name_by_profile = len(
+                    set(entry.profile for entry in images[image])
+                ) > 1
+                # The config files of a project checkout are always
+                # named after the arch, such that the description
+                # from OBS is never written over
+                name_by_arch = project or len(
+                    set(entry.arch for entry in images[image])
+                ) > 1
+                failed_arches = set()
+                for entry in images[image]:
+                    start_time = time.monotonic()
+                    status = f'failed: {fetch_issue}' if fetch_issue else 'ok'
+                    if obs_checkout:
+                        try:
+                            self._process_targets(
+                                obs_checkout.checkout_dir, [
+                                    (
+                                        entry.profile or obs_checkout.profile,
+                                        entry.arch
+                                    )
+                                ], repo, name_by_profile, name_by_arch
+                            )
+                        except Exception as issue:
+                            status = f'failed: {issue}'
+                            failed_arches.add(entry.arch)
+                    summary[entry.name] = (
+                        status, fetch_time + time.monotonic() - start_time
+                    )
+                if obs_checkout:
+                    for arch in sorted(
+                        set(entry.arch for entry in images[image])
+                    ):
+                        if arch not in failed_arches:
+                            OBS.set_completed_arch(
+                                obs_checkout.checkout_dir, arch
+                            )
+        log.info('Checkout summary:')
+        failed = 0
+        for entry in entries:
+            (status, entry_time) = summary[entry.name]
+            log.info(f'--> {entry.name}: {status} ({entry_time:.1f}s)')
+            if status != 'ok':
+                failed += 1
+        if failed:
+            raise KiwiOBSPluginSourceError(
+                f'{failed} of {len(entries)} images failed to check out'
+            )
+
+    def _fetch_image(
+        self, obs: OBS, entries: List[manifest_entry_type], repo: str,
+        sync: bool
+    ) -> Tuple[OBS, Optional[obs_checkout_type], float, Optional[Exception]]:
+        start_time = time.monotonic()
+        try:
+            obs_checkout = obs.fetch_obs_image(
+                os.sep.join(
+                    [
+                        self.command_args['--target-dir'],
+                        obs.project, obs.package
+                    ]
+                ),
+                self.command_args['--force'], None,
+                sync, self.command_args['--bulk']
+            )
+        except Exception as issue:
+            return (obs, None, time.monotonic() - start_time, issue)
+        for entry in entries:
+            obs.prefetch_obs_repositories(
+                entry.profile or obs_checkout.profile, entry.arch, repo
+            )
+        return (obs, obs_checkout, time.monotonic() - start_time, None)
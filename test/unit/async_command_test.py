@@ -0,0 +1,65 @@
+import os
+import asyncio
+from pytest import raises
+
+from kiwi.exceptions import KiwiCommandError
+
+from kiwi_obs_plugin.async_command import AsyncCommand
+
+
+class TestAsyncCommand:
+    def setup(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def teardown(self):
+        self.loop.close()
+
+    def test_run(self):
+        assert self.loop.run_until_complete(
+            AsyncCommand.run(['echo', 'foo'])
+        ) == b'foo\n'
+
+    def test_start_with_stdout(self):
+        async def start_and_wait():
+            try:
+                process = await AsyncCommand.start(
+                    ['echo', 'foo'], stdout=output_fd
+                )
+            finally:
+                os.close(output_fd)
+            return await AsyncCommand.wait(process, ['echo', 'foo'])
+
+        (read_fd, output_fd) = os.pipe()
+        with open(read_fd, 'rb') as output:
+            # the output is not collected if written elsewhere
+            assert self.loop.run_until_complete(start_and_wait()) == b''
+            assert output.read() == b'foo\n'
+
+    def test_run_failed(self):
+        with raises(KiwiCommandError) as issue:
+            self.loop.run_until_complete(
+                AsyncCommand.run(['sh', '-c', 'echo error >&2; exit 1'])
+            )
+        assert 'sh: stderr: error' in str(issue.value)
+        assert '(no output on stdout)' in str(issue.value)
+
+    def test_run_not_found(self):
+        with raises(KiwiCommandError):
+            self.loop.run_until_complete(
+                AsyncCommand.run(['/does/not/exist'])
+            )
+
+    def test_run_cancelled(self):
+        async def run_and_cancel():
+            command = asyncio.ensure_future(
+                AsyncCommand.run(['sleep', '60'])
+            )
+            await asyncio.sleep(0.2)
+            command.cancel()
+            with raises(asyncio.CancelledError):
+                await command
+
+        self.loop.run_until_complete(
+            asyncio.wait_for(run_and_cancel(), 10)
+        )
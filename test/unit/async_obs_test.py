@@ -0,0 +1,345 @@
+import io
+import os
+import time
+import asyncio
+import tarfile
+import threading
+from tempfile import TemporaryDirectory
+from mock import (
+    Mock, patch, call
+)
+from pytest import raises
+
+from kiwi_obs_plugin.async_command import AsyncCommand
+from kiwi_obs_plugin.async_obs import AsyncOBS
+from kiwi_obs_plugin.obs import OBS
+from kiwi_obs_plugin.exceptions import KiwiOBSPluginSourceError
+
+
+start_command = AsyncCommand.start
+
+
+class TestAsyncOBS:
+    def setup(self):
+        self.obs = Mock()
+        self.obs.with_cancel_event.return_value = self.obs
+        self.obs.git_cache = None
+        self.async_obs = AsyncOBS(self.obs, 2)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def teardown(self):
+        self.async_obs.close()
+        self.loop.close()
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    @staticmethod
+    def _write_service(checkout_dir):
+        with open(os.sep.join([checkout_dir, '_service']), 'w') as service:
+            service.write(
+                '<services>'
+                '<service name="obs_scm">'
+                '<param name="url">url_a</param>'
+                '<param name="scm">git</param>'
+                '<param name="subdir">/build-tests/</param>'
+                '<param name="extract">config.sh</param>'
+                '</service>'
+                '<service name="obs_scm">'
+                '<param name="url">url_b</param>'
+                '<param name="scm">git</param>'
+                '<param name="subdir">root</param>'
+                '<param name="filename">root</param>'
+                '</service>'
+                '</services>'
+            )
+
+    @staticmethod
+    def _git_archive(name, data):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        return archive.getvalue()
+
+    def test_fetch_obs_image(self):
+        with TemporaryDirectory() as checkout_dir:
+            assert self._run(
+                self.async_obs.fetch_obs_image(checkout_dir, sync=True)
+            ) == self.obs.fetch_obs_image.return_value
+            self.obs.fetch_obs_image.assert_called_once_with(
+                checkout_dir, False, None, True, False, False,
+                'x86_64', 'images', False
+            )
+            # the git sources are fetched on the event loop
+            self._write_service(checkout_dir)
+            with patch.object(
+                AsyncOBS, 'resolve_git_source_service'
+            ) as mock_resolve_git_source_service:
+                self._run(self.async_obs.fetch_obs_image(checkout_dir))
+            mock_resolve_git_source_service.assert_called_once_with(
+                checkout_dir
+            )
+
+    def test_add_obs_repositories(self):
+        xml_state = Mock()
+        assert self._run(
+            self.async_obs.add_obs_repositories(xml_state, 'Kernel')
+        ) == self.obs.add_obs_repositories.return_value
+        self.obs.add_obs_repositories.assert_called_once_with(
+            xml_state, 'Kernel', 'x86_64', 'images'
+        )
+
+    @staticmethod
+    def _start_output_of(command):
+        async def start(git_archive, stdout):
+            # the output of command stands in for the git archive
+            return await start_command(command, stdout=stdout)
+
+        return start
+
+    @patch('kiwi_obs_plugin.async_obs.OBS.copy_git_source')
+    @patch('kiwi_obs_plugin.async_obs.AsyncCommand.start')
+    @patch('kiwi_obs_plugin.async_obs.AsyncCommand.run')
+    def test_resolve_git_source_service(
+        self, mock_AsyncCommand_run, mock_AsyncCommand_start,
+        mock_copy_git_source
+    ):
+        async def update_async(url):
+            return f'/cache/git/{url}.git'
+
+        async def lock_async(url):
+            mirror_locks[url] = Mock()
+            return mirror_locks[url]
+
+        mirror_locks = {}
+        mock_AsyncCommand_run.return_value = b''
+        self.obs.git_cache = Mock()
+        self.obs.git_cache.update_async.side_effect = update_async
+        self.obs.git_cache.lock_async.side_effect = lock_async
+        with TemporaryDirectory() as checkout_dir:
+            archive = os.sep.join([checkout_dir, 'archive.tar'])
+            with open(archive, 'wb') as archive_fd:
+                archive_fd.write(
+                    self._git_archive('build-tests/config.sh', b'sh')
+                )
+            mock_AsyncCommand_start.side_effect = self._start_output_of(
+                ['cat', archive]
+            )
+            self._write_service(checkout_dir)
+            self._run(
+                self.async_obs.resolve_git_source_service(checkout_dir)
+            )
+            with open(os.sep.join([checkout_dir, 'config.sh'])) as config:
+                assert config.read() == 'sh'
+        git_dir = mock_copy_git_source.call_args[0][0]
+        assert git_dir.startswith(f'{checkout_dir}/_obs_scm_git/')
+        assert mock_copy_git_source.call_args[0][1].clone == 'url_b'
+        assert mock_copy_git_source.call_args[0][2:] == (checkout_dir, 2)
+        assert mock_AsyncCommand_run.call_args_list == [
+            call(
+                [
+                    'git', 'clone', '--depth', '1', '--filter=blob:none',
+                    '--no-checkout', '--config', 'core.sparseCheckout=true',
+                    '--config', 'remote.upstream.url=url_b',
+                    '--config', 'remote.upstream.promisor=true',
+                    '--config', 'remote.upstream.partialclonefilter=blob:none',
+                    '--branch', 'master', 'file:///cache/git/url_b.git',
+                    git_dir
+                ]
+            ),
+            call(['git', '-C', git_dir, 'read-tree', '-mu', 'HEAD'])
+        ]
+        # the files are exported from the mirror
+        assert mock_AsyncCommand_start.call_args[0][0] == [
+            'git', '-C', '/cache/git/url_a.git', 'archive',
+            '--format=tar', 'master', '--', 'build-tests/config.sh'
+        ]
+        self.obs.git_cache.evict.assert_called_once_with()
+        # the mirrors were locked while they were read
+        assert sorted(mirror_locks) == ['url_a', 'url_b']
+        for mirror_lock in mirror_locks.values():
+            mirror_lock.close.assert_called_once_with()
+
+    @patch('kiwi_obs_plugin.async_obs.AsyncCommand.start')
+    @patch('kiwi_obs_plugin.async_obs.AsyncCommand.run')
+    def test_resolve_git_source_service_without_cache(
+        self, mock_AsyncCommand_run, mock_AsyncCommand_start
+    ):
+        def write_service(checkout_dir):
+            with open(os.sep.join([checkout_dir, '_service']), 'w') as service:
+                service.write(
+                    '<services><service name="obs_scm">'
+                    '<param name="url">url_a</param>'
+                    '<param name="scm">git</param>'
+                    '<param name="extract">config.sh</param>'
+                    '</service></services>'
+                )
+
+        mock_AsyncCommand_run.return_value = b''
+        with TemporaryDirectory() as checkout_dir:
+            archive = os.sep.join([checkout_dir, 'archive.tar'])
+            with open(archive, 'wb') as archive_fd:
+                archive_fd.write(self._git_archive('config.sh', b'sh'))
+            mock_AsyncCommand_start.side_effect = self._start_output_of(
+                ['cat', archive]
+            )
+            write_service(checkout_dir)
+            # a clone from a previous run is replaced
+            git_dir = OBS.get_git_clone_requests(
+                checkout_dir, OBS.get_git_sources(checkout_dir)
+            )[0].target_dir
+            os.makedirs(os.sep.join([git_dir, 'outdated']))
+            self._run(
+                self.async_obs.resolve_git_source_service(checkout_dir)
+            )
+            assert not os.path.exists(git_dir)
+            assert os.path.isfile(os.sep.join([checkout_dir, 'config.sh']))
+        mock_AsyncCommand_run.assert_called_once_with(
+            [
+                'git', 'clone', '--depth', '1', '--filter=blob:none',
+                '--no-checkout', '--config', 'core.sparseCheckout=true',
+                '--branch', 'master', 'url_a', git_dir
+            ]
+        )
+        assert mock_AsyncCommand_start.call_args[0][0] == [
+            'git', '-C', git_dir, 'archive', '--format=tar',
+            'master', '--', 'config.sh'
+        ]
+
+        # failed git archive, git not found and no tar archive
+        for command in [
+            ['sh', '-c', 'exit 1'], ['/does/not/exist'], ['echo', 'no tar']
+        ]:
+            mock_AsyncCommand_start.side_effect = self._start_output_of(
+                command
+            )
+            with TemporaryDirectory() as checkout_dir:
+                write_service(checkout_dir)
+                with raises(KiwiOBSPluginSourceError):
+                    self._run(
+                        self.async_obs.resolve_git_source_service(
+                            checkout_dir
+                        )
+                    )
+
+    @patch('kiwi_obs_plugin.async_obs.AsyncCommand.start')
+    @patch('kiwi_obs_plugin.async_obs.AsyncCommand.run')
+    def test_export_git_files_stops_git_on_failed_extract(
+        self, mock_AsyncCommand_run, mock_AsyncCommand_start
+    ):
+        async def start(git_archive, stdout):
+            processes.append(
+                await start_command(
+                    ['sh', '-c', 'printf %020480d 1; exec sleep 60'],
+                    stdout=stdout
+                )
+            )
+            return processes[0]
+
+        processes = []
+        mock_AsyncCommand_run.return_value = b''
+        mock_AsyncCommand_start.side_effect = start
+        with TemporaryDirectory() as checkout_dir:
+            with open(os.sep.join([checkout_dir, '_service']), 'w') as service:
+                service.write(
+                    '<services><service name="obs_scm">'
+                    '<param name="url">url_a</param>'
+                    '<param name="scm">git</param>'
+                    '<param name="extract">config.sh</param>'
+                    '</service></services>'
+                )
+            with raises(KiwiOBSPluginSourceError):
+                self._run(
+                    asyncio.wait_for(
+                        self.async_obs.resolve_git_source_service(
+                            checkout_dir
+                        ), 10
+                    )
+                )
+        # git got killed instead of running to its end
+        assert processes[0].returncode < 0
+
+    def test_for_image(self):
+        async_obs = self.async_obs.for_image('OBS:Other/image')
+        assert async_obs.obs == self.obs.for_image.return_value
+        self.obs.for_image.assert_called_once_with('OBS:Other/image')
+        assert async_obs.pool is self.async_obs.pool
+
+    def test_concurrent_calls_are_bounded(self):
+        def fetch_obs_image(checkout_dir, *args):
+            with lock:
+                running.append(checkout_dir)
+                max_running[0] = max(max_running[0], len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(checkout_dir)
+            return checkout_dir
+
+        lock = threading.Lock()
+        running = []
+        max_running = [0]
+        self.obs.fetch_obs_image.side_effect = fetch_obs_image
+        checkout_dirs = [f'checkout_dir_{count}' for count in range(20)]
+        assert self._run(
+            AsyncOBS.gather(
+                *[
+                    self.async_obs.fetch_obs_image(checkout_dir)
+                    for checkout_dir in checkout_dirs
+                ]
+            )
+        ) == checkout_dirs
+        assert max_running[0] <= 2
+
+    def test_gather_cancels_on_failure(self):
+        def fetch_obs_image(checkout_dir, *args):
+            if checkout_dir == 'broken':
+                raise Exception('fetch failed')
+            time.sleep(0.05)
+            return checkout_dir
+
+        self.obs.fetch_obs_image.side_effect = fetch_obs_image
+        with raises(Exception):
+            self._run(
+                AsyncOBS.gather(
+                    *[
+                        self.async_obs.fetch_obs_image(checkout_dir)
+                        for checkout_dir in ['a', 'broken', 'b', 'c', 'd']
+                    ]
+                )
+            )
+        # the calls still queued in the pool never started, only
+        # the one picked up after the failed call might have
+        assert self.obs.fetch_obs_image.call_count <= 3
+
+    def test_cancel_running_call(self):
+        def with_cancel_event(cancel_event):
+            cancel_events.append(cancel_event)
+            return self.obs
+
+        def fetch_obs_image(checkout_dir, *args):
+            started.set()
+            # like OBS._send the call stops once it got cancelled
+            stopped.append(cancel_events[0].wait(5))
+            return checkout_dir
+
+        async def fetch_and_cancel():
+            fetch = asyncio.ensure_future(
+                self.async_obs.fetch_obs_image('checkout_dir')
+            )
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            fetch.cancel()
+            with raises(asyncio.CancelledError):
+                await fetch
+            # the cancelled coroutine waited for the call
+            assert stopped == [True]
+
+        cancel_events = []
+        started = threading.Event()
+        stopped = []
+        self.obs.with_cancel_event.side_effect = with_cancel_event
+        self.obs.fetch_obs_image.side_effect = fetch_obs_image
+        self._run(fetch_and_cancel())
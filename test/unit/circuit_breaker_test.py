@@ -0,0 +1,35 @@
+from mock import patch
+
+from kiwi_obs_plugin.circuit_breaker import CircuitBreaker
+
+
+class TestCircuitBreaker:
+    def setup(self):
+        self.circuit_breaker = CircuitBreaker(2, 60)
+
+    @patch('kiwi_obs_plugin.circuit_breaker.time.monotonic')
+    def test_circuit(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        assert self.circuit_breaker.allow('host')
+        self.circuit_breaker.record_failure('host')
+        assert self.circuit_breaker.allow('host')
+        self.circuit_breaker.record_failure('host')
+        assert not self.circuit_breaker.allow('host')
+        assert self.circuit_breaker.allow('other_host')
+
+        # one trial request after reset_timeout
+        mock_monotonic.return_value = 160
+        assert self.circuit_breaker.allow('host')
+        assert not self.circuit_breaker.allow('host')
+
+        # trial failed, the circuit stays open
+        self.circuit_breaker.record_failure('host')
+        assert not self.circuit_breaker.allow('host')
+
+        # trial succeeded, the circuit closes
+        mock_monotonic.return_value = 220
+        assert self.circuit_breaker.allow('host')
+        self.circuit_breaker.record_success('host')
+        assert self.circuit_breaker.allow('host')
+        self.circuit_breaker.record_failure('host')
+        assert self.circuit_breaker.allow('host')
@@ -0,0 +1,85 @@
+import io
+import os
+from tempfile import TemporaryDirectory
+from pytest import raises
+
+from kiwi_obs_plugin.exceptions import KiwiOBSPluginCpioError
+
+from kiwi_obs_plugin.cpio import Cpio
+
+
+def cpio_member(name, data=b'', mode=0o100644, magic=b'070701'):
+    name_data = name.encode() + b'\0'
+    header = magic + b''.join(
+        b'%08X' % field for field in [
+            0, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name_data), 0
+        ]
+    )
+    member = header + name_data
+    member += b'\0' * ((4 - len(member) % 4) % 4)
+    member += data
+    member += b'\0' * ((4 - len(data) % 4) % 4)
+    return member
+
+
+class TestCpio:
+    def test_extract(self):
+        archive = io.BytesIO(
+            b''.join(
+                [
+                    cpio_member('appliance.kiwi', b'<image/>'),
+                    cpio_member('subdir', mode=0o040755),
+                    cpio_member('config.sh', b'#!/bin/sh\n'),
+                    cpio_member('skipped', b'data'),
+                    cpio_member('TRAILER!!!')
+                ]
+            )
+        )
+        with TemporaryDirectory() as target_dir:
+            assert Cpio(archive).extract(
+                target_dir, ['appliance.kiwi', 'config.sh', 'subdir']
+            ) == ['appliance.kiwi', 'config.sh']
+            assert sorted(os.listdir(target_dir)) == [
+                'appliance.kiwi', 'config.sh'
+            ]
+            with open(os.sep.join([target_dir, 'config.sh']), 'rb') as data:
+                assert data.read() == b'#!/bin/sh\n'
+
+    def test_extract_all(self):
+        archive = io.BytesIO(
+            b''.join(
+                [
+                    cpio_member('a', b'a', magic=b'070702'),
+                    cpio_member('TRAILER!!!')
+                ]
+            )
+        )
+        with TemporaryDirectory() as target_dir:
+            assert Cpio(archive).extract(target_dir) == ['a']
+
+    def test_extract_raises_on_server_errors(self):
+        archive = io.BytesIO(
+            cpio_member('.errors', b'package not found\n')
+        )
+        with raises(KiwiOBSPluginCpioError) as issue:
+            Cpio(archive).extract('target_dir')
+        assert 'package not found' in str(issue.value)
+
+    def test_extract_raises_on_invalid_name(self):
+        archive = io.BytesIO(cpio_member('../etc/passwd', b'x'))
+        with raises(KiwiOBSPluginCpioError):
+            Cpio(archive).extract('target_dir')
+
+    def test_extract_raises_on_invalid_magic(self):
+        with raises(KiwiOBSPluginCpioError):
+            Cpio(io.BytesIO(b'<html>' + b' ' * 104)).extract('target_dir')
+
+    def test_extract_raises_on_invalid_header(self):
+        with raises(KiwiOBSPluginCpioError):
+            Cpio(io.BytesIO(b'070701' + b'X' * 104)).extract('target_dir')
+
+    def test_extract_raises_on_truncated_archive(self):
+        archive = io.BytesIO(cpio_member('a', b'data')[:-6])
+        with TemporaryDirectory() as target_dir:
+            with raises(KiwiOBSPluginCpioError):
+                Cpio(archive).extract(target_dir)
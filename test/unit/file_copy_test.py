@@ -0,0 +1,128 @@
+import os
+from tempfile import TemporaryDirectory
+from mock import patch
+from pytest import raises
+
+from kiwi_obs_plugin.file_copy import FileCopy
+
+
+class TestFileCopy:
+    def setup(self):
+        self.tmpdir = TemporaryDirectory()
+        self.source = os.sep.join([self.tmpdir.name, 'source'])
+        self.target = os.sep.join([self.tmpdir.name, 'target'])
+        with open(self.source, 'w') as source:
+            source.write('data')
+        with open(self.target, 'w') as target:
+            target.write('old')
+
+    def teardown(self):
+        self.tmpdir.cleanup()
+
+    def _read_target(self):
+        with open(self.target) as target:
+            return target.read()
+
+    @patch('kiwi_obs_plugin.file_copy.fcntl.ioctl')
+    def test_link_or_copy_reflink(self, mock_ioctl):
+        FileCopy.link_or_copy(self.source, self.target)
+        assert mock_ioctl.call_count == 1
+        assert mock_ioctl.call_args[0][1] == 0x40049409
+        assert os.stat(self.source).st_ino != os.stat(self.target).st_ino
+
+    @patch('kiwi_obs_plugin.file_copy.fcntl.ioctl')
+    def test_link_or_copy_hardlink(self, mock_ioctl):
+        mock_ioctl.side_effect = OSError
+        FileCopy.link_or_copy(self.source, self.target)
+        assert os.stat(self.source).st_ino == os.stat(self.target).st_ino
+        assert self._read_target() == 'data'
+
+    @patch('kiwi_obs_plugin.file_copy.os.link')
+    @patch('kiwi_obs_plugin.file_copy.fcntl.ioctl')
+    def test_link_or_copy_data(self, mock_ioctl, mock_os_link):
+        mock_ioctl.side_effect = OSError
+        mock_os_link.side_effect = OSError
+        FileCopy.link_or_copy(self.source, self.target)
+        assert os.stat(self.source).st_ino != os.stat(self.target).st_ino
+        assert self._read_target() == 'data'
+
+    @patch('kiwi_obs_plugin.file_copy.os.link')
+    @patch('kiwi_obs_plugin.file_copy.fcntl.ioctl')
+    def test_link_or_copy_data_sendfile(self, mock_ioctl, mock_os_link):
+        mock_ioctl.side_effect = OSError
+        mock_os_link.side_effect = OSError
+        with patch.object(os, 'copy_file_range', None, create=True):
+            FileCopy.link_or_copy(self.source, self.target)
+        assert self._read_target() == 'data'
+
+    @patch('kiwi_obs_plugin.file_copy.os.sendfile')
+    @patch('kiwi_obs_plugin.file_copy.os.link')
+    @patch('kiwi_obs_plugin.file_copy.fcntl.ioctl')
+    def test_link_or_copy_data_in_user_space(
+        self, mock_ioctl, mock_os_link, mock_os_sendfile
+    ):
+        mock_ioctl.side_effect = OSError
+        mock_os_link.side_effect = OSError
+        mock_os_sendfile.side_effect = [2, OSError]
+        with patch.object(os, 'copy_file_range', None, create=True):
+            FileCopy.link_or_copy(self.source, self.target)
+        assert self._read_target() == 'data'
+        # source file shrinks while it is copied
+        mock_os_sendfile.side_effect = [0]
+        with patch.object(os, 'copy_file_range', None, create=True):
+            FileCopy.link_or_copy(self.source, self.target)
+        assert self._read_target() == ''
+
+    def test_copy(self):
+        os.chmod(self.source, 0o755)
+        os.utime(self.source, (1000, 1000))
+        FileCopy.copy(self.source, self.target)
+        assert self._read_target() == 'data'
+        assert os.stat(self.target).st_mode & 0o777 == 0o755
+        assert os.stat(self.target).st_mtime == 1000
+
+        os.symlink('source', os.sep.join([self.tmpdir.name, 'link']))
+        FileCopy.copy(os.sep.join([self.tmpdir.name, 'link']), self.target)
+        assert os.readlink(self.target) == 'source'
+
+    def test_copy_tree(self):
+        source_dir = os.sep.join([self.tmpdir.name, 'root'])
+        target_dir = os.sep.join([self.tmpdir.name, 'checkout', 'root'])
+        os.makedirs(os.sep.join([source_dir, 'etc', 'empty']))
+        with open(os.sep.join([source_dir, 'etc', 'motd']), 'w') as motd:
+            motd.write('hello')
+        os.symlink('etc', os.sep.join([source_dir, 'config']))
+        os.utime(os.sep.join([source_dir, 'etc']), (1000, 1000))
+        FileCopy.copy_tree(source_dir, target_dir, 2)
+        with open(os.sep.join([target_dir, 'etc', 'motd'])) as motd:
+            assert motd.read() == 'hello'
+        assert os.path.isdir(os.sep.join([target_dir, 'etc', 'empty']))
+        assert os.readlink(os.sep.join([target_dir, 'config'])) == 'etc'
+        assert os.stat(os.sep.join([target_dir, 'etc'])).st_mtime == 1000
+
+        with patch.object(FileCopy, 'copy') as mock_copy:
+            mock_copy.side_effect = OSError
+            with raises(OSError):
+                FileCopy.copy_tree(source_dir, target_dir)
+
+    def test_copy_tree_excludes(self):
+        source_dir = os.sep.join([self.tmpdir.name, 'root'])
+        target_dir = os.sep.join([self.tmpdir.name, 'checkout', 'root'])
+        os.makedirs(os.sep.join([source_dir, 'etc', 'root']))
+        os.makedirs(os.sep.join([source_dir, 'usr']))
+        for name in ['etc/motd', 'etc/issue', 'etc/root/a', 'usr/a.pyc']:
+            with open(os.sep.join([source_dir, name]), 'w'):
+                pass
+        FileCopy.copy_tree(
+            source_dir, target_dir, 2, ['root/', '*.pyc', '/etc/issue']
+        )
+        assert sorted(
+            os.path.relpath(os.sep.join([root, name]), target_dir)
+            for (root, dirs, names) in os.walk(target_dir)
+            for name in dirs + names
+        ) == ['etc', 'etc/motd', 'usr']
+
+    def test_remove(self):
+        FileCopy.remove(self.target)
+        assert not os.path.exists(self.target)
+        FileCopy.remove(self.target)
@@ -0,0 +1,233 @@
+import os
+import fcntl
+import asyncio
+from tempfile import TemporaryDirectory
+from mock import (
+    patch, call
+)
+from pytest import raises
+
+from kiwi.exceptions import KiwiCommandError
+
+from kiwi_obs_plugin.git_cache import GitCache
+
+
+class TestGitCache:
+    def setup(self):
+        self.tmpdir = TemporaryDirectory()
+        self.cache_dir = os.sep.join([self.tmpdir.name, 'git'])
+        self.git_cache = GitCache(self.cache_dir, 1024)
+
+    def teardown(self):
+        self.tmpdir.cleanup()
+
+    @patch('kiwi_obs_plugin.git_cache.Command.run')
+    def test_update(self, mock_Command_run):
+        def run(command):
+            if command[1] == 'clone':
+                os.makedirs(os.sep.join([command[-1], 'objects']))
+
+        mock_Command_run.side_effect = run
+        mirror_dir = self.git_cache.update('url')
+        assert mirror_dir.startswith(self.cache_dir)
+        assert mirror_dir.endswith('.git')
+        assert os.path.isdir(os.sep.join([mirror_dir, 'objects']))
+        mirror_tmp = mock_Command_run.call_args_list[0][0][0][-1]
+        assert mock_Command_run.call_args_list == [
+            call(
+                [
+                    'git', 'clone', '--mirror', '--filter=blob:none',
+                    'url', mirror_tmp
+                ]
+            ),
+            call(
+                [
+                    'git', '-C', mirror_tmp,
+                    'config', 'uploadpack.allowFilter', 'true'
+                ]
+            )
+        ]
+
+        # a mirror is updated once per instance
+        mock_Command_run.reset_mock()
+        assert self.git_cache.update('url') == mirror_dir
+        assert not mock_Command_run.called
+
+        git_cache = GitCache(self.cache_dir, 1024)
+        assert git_cache.update('url') == mirror_dir
+        mock_Command_run.assert_called_once_with(
+            ['git', '-C', mirror_dir, 'fetch', '--prune']
+        )
+
+        # outdated mirrors are used if the update fails
+        git_cache = GitCache(self.cache_dir, 1024)
+        mock_Command_run.side_effect = KiwiCommandError('offline')
+        assert git_cache.update('url') == mirror_dir
+
+    @patch('kiwi_obs_plugin.git_cache.Command.run')
+    def test_update_failed_clone(self, mock_Command_run):
+        mock_Command_run.side_effect = KiwiCommandError('not found')
+        with raises(KiwiCommandError):
+            self.git_cache.update('url')
+        assert [
+            name for name in os.listdir(self.cache_dir)
+            if not name.endswith('.lock')
+        ] == []
+
+    @patch('kiwi_obs_plugin.git_cache.AsyncCommand.run')
+    def test_update_async(self, mock_AsyncCommand_run):
+        async def run(command):
+            if command[1] == 'clone':
+                os.makedirs(os.sep.join([command[-1], 'objects']))
+            return b''
+
+        async def update_locked(git_cache, url):
+            # wait for the lock held by another process
+            os.makedirs(self.cache_dir, exist_ok=True)
+            mirror_dir = git_cache._get_mirror_path(url)
+            with open(f'{mirror_dir}.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                update = asyncio.ensure_future(git_cache.update_async(url))
+                await asyncio.sleep(0.2)
+                assert not update.done()
+            return await update
+
+        loop = asyncio.new_event_loop()
+        mock_AsyncCommand_run.side_effect = run
+        try:
+            mirror_dir = loop.run_until_complete(
+                self.git_cache.update_async('url')
+            )
+            assert mirror_dir == self.git_cache._get_mirror_path('url')
+            assert os.path.isdir(os.sep.join([mirror_dir, 'objects']))
+            mirror_tmp = mock_AsyncCommand_run.call_args_list[0][0][0][-1]
+            assert mock_AsyncCommand_run.call_args_list == [
+                call(
+                    [
+                        'git', 'clone', '--mirror', '--filter=blob:none',
+                        'url', mirror_tmp
+                    ]
+                ),
+                call(
+                    [
+                        'git', '-C', mirror_tmp,
+                        'config', 'uploadpack.allowFilter', 'true'
+                    ]
+                )
+            ]
+
+            # a mirror is updated once per instance
+            mock_AsyncCommand_run.reset_mock()
+            assert loop.run_until_complete(
+                self.git_cache.update_async('url')
+            ) == mirror_dir
+            assert not mock_AsyncCommand_run.called
+
+            git_cache = GitCache(self.cache_dir, 1024)
+            assert loop.run_until_complete(
+                update_locked(git_cache, 'url')
+            ) == mirror_dir
+            mock_AsyncCommand_run.assert_called_once_with(
+                ['git', '-C', mirror_dir, 'fetch', '--prune']
+            )
+
+            # outdated mirrors are used if the update fails
+            git_cache = GitCache(self.cache_dir, 1024)
+            mock_AsyncCommand_run.side_effect = KiwiCommandError('offline')
+            assert loop.run_until_complete(
+                git_cache.update_async('url')
+            ) == mirror_dir
+        finally:
+            loop.close()
+
+    @patch('kiwi_obs_plugin.git_cache.AsyncCommand.run')
+    def test_update_async_failed_clone(self, mock_AsyncCommand_run):
+        loop = asyncio.new_event_loop()
+        mock_AsyncCommand_run.side_effect = KiwiCommandError('not found')
+        try:
+            with raises(KiwiCommandError):
+                loop.run_until_complete(self.git_cache.update_async('url'))
+        finally:
+            loop.close()
+        assert [
+            name for name in os.listdir(self.cache_dir)
+            if not name.endswith('.lock')
+        ] == []
+
+    @patch('kiwi_obs_plugin.git_cache.Command.run')
+    def test_lock(self, mock_Command_run):
+        def run(command):
+            if command[1] == 'clone':
+                os.makedirs(os.sep.join([command[-1], 'objects']))
+                with open(
+                    os.sep.join([command[-1], 'objects', 'pack']), 'w'
+                ) as pack:
+                    pack.write('x' * 2048)
+
+        async def lock_while_evicted(url):
+            with open(f'{mirror_dir}.use', 'a') as evict_lock:
+                fcntl.flock(evict_lock, fcntl.LOCK_EX)
+                lock = asyncio.ensure_future(self.git_cache.lock_async(url))
+                await asyncio.sleep(0.2)
+                assert not lock.done()
+            return await lock
+
+        mock_Command_run.side_effect = run
+        with self.git_cache.lock('url'):
+            mirror_dir = self.git_cache.update('url')
+            # a mirror in use is not evicted
+            self.git_cache.evict()
+            assert os.path.isdir(mirror_dir)
+        self.git_cache.evict()
+        assert not os.path.exists(mirror_dir)
+
+        # an evicted mirror is created again
+        with self.git_cache.lock('url'):
+            assert self.git_cache.update('url') == mirror_dir
+            assert os.path.isdir(mirror_dir)
+
+        loop = asyncio.new_event_loop()
+        try:
+            with loop.run_until_complete(lock_while_evicted('url')):
+                self.git_cache.evict()
+                assert os.path.isdir(mirror_dir)
+            # a cancelled lock is not held
+            with open(f'{mirror_dir}.use', 'a') as evict_lock:
+                fcntl.flock(evict_lock, fcntl.LOCK_EX)
+                with raises(asyncio.TimeoutError):
+                    loop.run_until_complete(
+                        asyncio.wait_for(
+                            self.git_cache.lock_async('url'), 0.2
+                        )
+                    )
+        finally:
+            loop.close()
+        self.git_cache.evict()
+        assert not os.path.exists(mirror_dir)
+
+    def test_evict(self):
+        self.git_cache.evict()
+        mirrors = []
+        for index, name in enumerate(['b.git', 'a.git', 'c.git']):
+            mirror_dir = os.sep.join([self.cache_dir, name])
+            os.makedirs(os.sep.join([mirror_dir, 'objects']))
+            with open(os.sep.join([mirror_dir, 'objects', 'pack']), 'w') as p:
+                p.write('x' * 512)
+            os.utime(mirror_dir, (index, index))
+            mirrors.append(mirror_dir)
+        os.makedirs(os.sep.join([self.cache_dir, 'tmpdir']))
+        with patch('kiwi_obs_plugin.git_cache.os.lstat') as mock_lstat:
+            mock_lstat.side_effect = OSError
+            assert GitCache._get_size(mirrors[0]) == 0
+
+        # mirrors locked by another process are kept
+        with patch('kiwi_obs_plugin.git_cache.fcntl.flock') as mock_flock:
+            mock_flock.side_effect = OSError
+            self.git_cache.evict()
+        assert all(os.path.isdir(mirror) for mirror in mirrors)
+
+        self.git_cache.evict()
+        assert sorted(
+            name for name in os.listdir(self.cache_dir)
+            if not name.endswith(('.lock', '.use'))
+        ) == ['a.git', 'c.git', 'tmpdir']
@@ -0,0 +1,36 @@
+from mock import (
+    call, patch
+)
+
+from kiwi_obs_plugin.host_limiter import HostLimiter
+
+
+class TestHostLimiter:
+    @patch('kiwi_obs_plugin.host_limiter.time.sleep')
+    @patch('kiwi_obs_plugin.host_limiter.time.monotonic')
+    def test_rate(self, mock_monotonic, mock_sleep):
+        def sleep(delay):
+            now[0] += delay
+
+        now = [100.0]
+        mock_monotonic.side_effect = lambda: now[0]
+        mock_sleep.side_effect = sleep
+        host_limiter = HostLimiter(2, 0)
+        # burst of two requests
+        host_limiter.acquire('host')
+        host_limiter.acquire('host')
+        assert not mock_sleep.called
+        # other hosts have their own bucket
+        host_limiter.acquire('other_host')
+        assert not mock_sleep.called
+        host_limiter.acquire('host')
+        assert mock_sleep.call_args_list == [call(0.5)]
+        host_limiter.release('host')
+
+    def test_max_requests(self):
+        host_limiter = HostLimiter(0, 2)
+        host_limiter.acquire('host')
+        host_limiter.acquire('host')
+        assert not host_limiter.slots['host'].acquire(blocking=False)
+        host_limiter.release('host')
+        assert host_limiter.slots['host'].acquire(blocking=False)
@@ -0,0 +1,92 @@
+import os
+from tempfile import TemporaryDirectory
+from mock import (
+    Mock, patch
+)
+from pytest import raises
+
+from kiwi_obs_plugin.http_cache import (
+    HTTPCache, CachedResponse
+)
+
+
+class TestHTTPCache:
+    def setup(self):
+        self.tmpdir = TemporaryDirectory()
+        self.cache_dir = os.sep.join([self.tmpdir.name, 'http'])
+        self.http_cache = HTTPCache(self.cache_dir, 1024, 'bob')
+
+    def teardown(self):
+        self.tmpdir.cleanup()
+
+    def _response(self, headers, content):
+        response = Mock()
+        response.headers = headers
+        response.iter_content.return_value = content
+        return response
+
+    def test_record_without_validators(self):
+        response = self._response({}, [b'data'])
+        assert self.http_cache.record('url', response) == response
+
+    def test_record_and_get(self):
+        assert self.http_cache.get_conditional_headers('url') == {}
+        assert self.http_cache.get('url') is None
+
+        response = self._response(
+            {'ETag': '"1"', 'Last-Modified': 'Tue, 01 Jun 2021'},
+            [b'<directory/>', b'\n']
+        )
+        with self.http_cache.record('url', response) as request:
+            assert list(request.iter_content(chunk_size=4)) == \
+                [b'<directory/>', b'\n']
+        response.iter_content.assert_called_once_with(chunk_size=4)
+        response.close.assert_called_once_with()
+
+        assert self.http_cache.get_conditional_headers('url') == {
+            'If-None-Match': '"1"',
+            'If-Modified-Since': 'Tue, 01 Jun 2021'
+        }
+        # entries are private to the namespace
+        assert HTTPCache(self.cache_dir, 1024, 'alice').get('url') is None
+
+        with self.http_cache.get('url') as request:
+            assert isinstance(request, CachedResponse)
+            assert b''.join(request.iter_content(chunk_size=4)) == \
+                b'<directory/>\n'
+
+    def test_record_interrupted(self):
+        response = self._response({'ETag': '"1"'}, None)
+        response.iter_content.side_effect = Exception
+        with raises(Exception):
+            list(self.http_cache.record('url', response).iter_content())
+        assert os.listdir(self.cache_dir) == []
+
+    def test_get_invalid_entry(self):
+        os.makedirs(self.cache_dir)
+        with open(self.http_cache._get_entry_path('url'), 'w') as entry:
+            entry.write('[]\n')
+        assert self.http_cache.get('url') is None
+
+    @patch('kiwi_obs_plugin.http_cache.os.stat')
+    @patch('kiwi_obs_plugin.http_cache.os.remove')
+    @patch('kiwi_obs_plugin.http_cache.os.listdir')
+    def test_evict(self, mock_listdir, mock_remove, mock_stat):
+        def stat(entry):
+            if entry.endswith('gone'):
+                raise OSError
+            return Mock(
+                st_mtime=int(entry[-1]), st_size=512
+            )
+
+        mock_listdir.return_value = ['gone', 'a3', 'b1', 'c2']
+        mock_stat.side_effect = stat
+        mock_remove.side_effect = [None, OSError]
+        self.http_cache.max_size = 512
+        self.http_cache.evict()
+        assert [
+            call_args[0][0] for call_args in mock_remove.call_args_list
+        ] == [
+            os.sep.join([self.cache_dir, 'b1']),
+            os.sep.join([self.cache_dir, 'c2'])
+        ]
@@ -0,0 +1,76 @@
+import os
+from tempfile import TemporaryDirectory
+from pytest import raises
+
+from kiwi_obs_plugin.manifest import (
+    Manifest, manifest_entry_type
+)
+from kiwi_obs_plugin.exceptions import KiwiOBSPluginManifestError
+
+
+class TestManifest:
+    def setup(self):
+        self.tmpdir = TemporaryDirectory()
+        self.manifest_file = os.sep.join([self.tmpdir.name, 'manifest'])
+
+    def teardown(self):
+        self.tmpdir.cleanup()
+
+    def _write_manifest(self, content):
+        with open(self.manifest_file, 'w') as manifest:
+            manifest.write(content)
+
+    def test_read(self):
+        self._write_manifest(
+            '# nightly images\n'
+            'OBS:project:name/box\n'
+            '\n'
+            '  OBS:project:name/box:Kernel@aarch64  \n'
+        )
+        assert Manifest.read(self.manifest_file, ['s390x']) == [
+            manifest_entry_type(
+                name='OBS:project:name/box', image='OBS:project:name/box',
+                profile=None, arch='s390x'
+            ),
+            manifest_entry_type(
+                name='OBS:project:name/box:Kernel@aarch64',
+                image='OBS:project:name/box', profile='Kernel',
+                arch='aarch64'
+            )
+        ]
+
+    def test_read_arches(self):
+        self._write_manifest(
+            'OBS:project:name/box\n'
+            'OBS:project:name/box:Kernel@aarch64\n'
+        )
+        assert Manifest.read(
+            self.manifest_file, ['x86_64', 'aarch64']
+        ) == [
+            manifest_entry_type(
+                name='OBS:project:name/box@x86_64',
+                image='OBS:project:name/box', profile=None, arch='x86_64'
+            ),
+            manifest_entry_type(
+                name='OBS:project:name/box@aarch64',
+                image='OBS:project:name/box', profile=None, arch='aarch64'
+            ),
+            manifest_entry_type(
+                name='OBS:project:name/box:Kernel@aarch64',
+                image='OBS:project:name/box', profile='Kernel',
+                arch='aarch64'
+            )
+        ]
+
+    def test_read_empty(self):
+        self._write_manifest('# nothing\n')
+        with raises(KiwiOBSPluginManifestError):
+            Manifest.read(self.manifest_file)
+
+    def test_parse_entry_invalid(self):
+        for name in [
+            'project', 'project/', '/package', 'project/package/x',
+            'project/package:', 'project/package@', 'project/package:a/b'
+        ]:
+            with raises(KiwiOBSPluginManifestError):
+                Manifest.parse_entry(name)
@@ -1,6 +1,15 @@
 import io
 import os
+import time
+import tarfile
 import logging
+import requests
+import threading
+from lxml import etree
+from tempfile import TemporaryDirectory
+from concurrent.futures import (
+    Future, ThreadPoolExecutor
+)
 from typing import Any
 from mock import (
     patch, Mock, MagicMock, call
@@ -17,11 +26,13 @@ from kiwi_obs_plugin.exceptions import (
     KiwiOBSPluginBuildInfoError,
     KiwiOBSPluginProjectError,
     KiwiOBSPluginSourceError,
-    KiwiOBSPluginCredentialsError
+    KiwiOBSPluginCredentialsError,
+    KiwiOBSPluginCancelledError
 )
 
 from kiwi_obs_plugin.obs import (
-    OBS, obs_repo_status_type
+    OBS, obs_repo_status_type, obs_repo_probe_type, git_source_type,
+    git_clone_type, obs_package_type
 )
 
 
@@ -30,11 +41,22 @@ class TestOBS:
     def inject_fixtures(self, caplog):
         self._caplog = caplog
 
+    @patch('kiwi_obs_plugin.obs.requests.Session')
     @patch('kiwi_obs_plugin.obs.RuntimeConfig')
-    def setup(self, mock_RuntimeConfig):
+    def setup(self, mock_RuntimeConfig, mock_Session):
         runtime_config = Mock()
         runtime_config.get_obs_api_server_url.return_value = \
             Defaults.get_obs_api_server_url()
+        runtime_config.get_obs_cache_dir.return_value = 'cache_dir'
+        runtime_config.get_obs_source_cache_size.return_value = 0
+        runtime_config.get_obs_repository_cache_ttl.return_value = 0
+        runtime_config.get_obs_http_cache_size.return_value = 0
+        runtime_config.get_obs_git_cache_size.return_value = 0
+        runtime_config.get_obs_connect_timeout.return_value = 10
+        runtime_config.get_obs_read_timeout.return_value = 60
+        runtime_config.get_obs_retries.return_value = 0
+        runtime_config.get_obs_host_request_rate.return_value = 0
+        runtime_config.get_obs_host_max_requests.return_value = 0
         mock_RuntimeConfig.return_value = runtime_config
         self.obs = OBS(
             'Virtualization:Appliances:SelfContained:suse/box',
@@ -58,9 +80,81 @@ class TestOBS:
     ):
         credentials = Mock()
         mock_Credentials.return_value = credentials
+        runtime_config = mock_RuntimeConfig.return_value
+        runtime_config.get_obs_cache_dir.return_value = 'cache_dir'
+        runtime_config.get_obs_host_request_rate.return_value = 0
         OBS('OBS:Project/package', True, 'bob')
         credentials.get_obs_credentials.assert_called_once_with('bob')
 
+    @patch('kiwi_obs_plugin.obs.RuntimeConfig')
+    @patch('kiwi_obs_plugin.obs.SourceCache')
+    def test_init_source_cache(self, mock_SourceCache, mock_RuntimeConfig):
+        runtime_config = mock_RuntimeConfig.return_value
+        runtime_config.get_obs_cache_dir.return_value = 'cache_dir'
+        runtime_config.get_obs_source_cache_size.return_value = 10
+        runtime_config.get_obs_host_request_rate.return_value = 0
+        obs = OBS('OBS:Project/package', True, 'bob', 'secret')
+        mock_SourceCache.assert_called_once_with(
+            'cache_dir/sources', 10485760
+        )
+        assert obs.source_cache == mock_SourceCache.return_value
+        runtime_config.get_obs_source_cache_size.return_value = 0
+        assert OBS(
+            'OBS:Project/package', True, 'bob', 'secret'
+        ).source_cache is None
+
+    @patch('kiwi_obs_plugin.obs.RuntimeConfig')
+    @patch('kiwi_obs_plugin.obs.HTTPCache')
+    def test_init_http_cache(self, mock_HTTPCache, mock_RuntimeConfig):
+        runtime_config = mock_RuntimeConfig.return_value
+        runtime_config.get_obs_cache_dir.return_value = 'cache_dir'
+        runtime_config.get_obs_http_cache_size.return_value = 1
+        runtime_config.get_obs_host_request_rate.return_value = 0
+        obs = OBS('OBS:Project/package', True, 'bob', 'secret')
+        mock_HTTPCache.assert_called_once_with(
+            'cache_dir/http', 1024 * 1024, 'bob'
+        )
+        assert obs.http_cache == mock_HTTPCache.return_value
+        runtime_config.get_obs_http_cache_size.return_value = 0
+        assert OBS(
+            'OBS:Project/package', True, 'bob', 'secret'
+        ).http_cache is None
+
+    @patch('kiwi_obs_plugin.obs.RuntimeConfig')
+    @patch('kiwi_obs_plugin.obs.GitCache')
+    def test_init_git_cache(self, mock_GitCache, mock_RuntimeConfig):
+        runtime_config = mock_RuntimeConfig.return_value
+        runtime_config.get_obs_host_request_rate.return_value = 0
+        runtime_config.get_obs_cache_dir.return_value = 'cache_dir'
+        runtime_config.get_obs_git_cache_size.return_value = 1
+        obs = OBS('OBS:Project/package', True, 'bob', 'secret')
+        mock_GitCache.assert_called_once_with('cache_dir/git', 1024 * 1024)
+        assert obs.git_cache == mock_GitCache.return_value
+        assert OBS(
+            'OBS:Project/package', True, 'bob', 'secret', use_cache=False
+        ).git_cache is None
+
+    @patch('kiwi_obs_plugin.obs.RuntimeConfig')
+    @patch('kiwi_obs_plugin.obs.SourceCache')
+    @patch('kiwi_obs_plugin.obs.RepositoryCache')
+    def test_init_repository_cache(
+        self, mock_RepositoryCache, mock_SourceCache, mock_RuntimeConfig
+    ):
+        runtime_config = mock_RuntimeConfig.return_value
+        runtime_config.get_obs_cache_dir.return_value = 'cache_dir'
+        runtime_config.get_obs_repository_cache_ttl.return_value = 60
+        runtime_config.get_obs_host_request_rate.return_value = 0
+        obs = OBS('OBS:Project/package', True, 'bob', 'secret')
+        mock_RepositoryCache.assert_called_once_with(
+            'cache_dir/repositories.json', 60
+        )
+        assert obs.repository_cache == mock_RepositoryCache.return_value
+        obs = OBS(
+            'OBS:Project/package', True, 'bob', 'secret', use_cache=False
+        )
+        assert obs.repository_cache is None
+        assert obs.source_cache is None
+
     @patch('kiwi_obs_plugin.obs.RuntimeConfig')
     @patch('kiwi_obs_plugin.obs.Credentials')
     def test_init_credentials_from_runtime_config_setup(
@@ -70,6 +164,11 @@ class TestOBS:
         runtime_config.get_obs_api_credentials.return_value = [
             {'bob': 'secret'}
         ]
+        runtime_config.get_obs_source_cache_size.return_value = 0
+        runtime_config.get_obs_repository_cache_ttl.return_value = 0
+        runtime_config.get_obs_http_cache_size.return_value = 0
+        runtime_config.get_obs_git_cache_size.return_value = 0
+        runtime_config.get_obs_host_request_rate.return_value = 0
         mock_RuntimeConfig.return_value = runtime_config
         obs_with_user = OBS('OBS:Project/package', True, 'bob')
         assert obs_with_user.password == 'secret'
@@ -88,9 +187,7 @@ class TestOBS:
         self.obs.add_obs_repositories(Mock())
         assert not mock_create_request.called
 
-    @patch('requests.get')
     @patch('kiwi_obs_plugin.obs.HTTPBasicAuth')
-    @patch('kiwi_obs_plugin.obs.NamedTemporaryFile')
     @patch('kiwi_obs_plugin.obs.etree')
     @patch('os.path.exists')
     @patch('kiwi_obs_plugin.obs.Command.run')
@@ -99,8 +196,7 @@ class TestOBS:
     def test_fetch_obs_image(
         self, mock_get_primary_multibuild_profile,
         mock_resolve_git_source_service, mock_Command_run,
-        mock_os_path_exists, mock_etree, mock_NamedTemporaryFile,
-        mock_HTTPBasicAuth, mock_requests_get
+        mock_os_path_exists, mock_etree, mock_HTTPBasicAuth
     ):
         # check exception on existing checkout dir
         mock_os_path_exists.return_value = True
@@ -111,9 +207,9 @@ class TestOBS:
         mock_os_path_exists.return_value = False
         xml_root = MagicMock()
         xml_root.xpath.return_value = []
-        buildinfo_xml_tree = MagicMock()
-        buildinfo_xml_tree.getroot.return_value = xml_root
-        mock_etree.parse.return_value = buildinfo_xml_tree
+        source_xml_tree = MagicMock()
+        source_xml_tree.getroot.return_value = xml_root
+        mock_etree.ElementTree.return_value = source_xml_tree
         with patch('builtins.open', create=True):
             with raises(KiwiOBSPluginSourceError):
                 self.obs.fetch_obs_image('checkout_dir')
@@ -135,7 +231,6 @@ class TestOBS:
 
         # check correct checkout of one source file
         mock_Command_run.reset_mock()
-        mock_requests_get.reset_mock()
         entry = Mock()
         entry.get.return_value = 'some_source_file'
         xml_root.xpath.return_value = [entry]
@@ -146,46 +241,1052 @@ class TestOBS:
                 ['mkdir', '-p', 'checkout_dir']
             )
             assert mock_open.call_args_list == [
-                call(mock_NamedTemporaryFile.return_value.name, 'wb'),
                 call('checkout_dir/some_source_file', 'wb')
             ]
 
+    @patch.object(OBS, '_create_request')
+    @patch.object(OBS, '_import_xml_request')
+    @patch.object(OBS, '_fetch_source_files')
+    def test_fetch_obs_image_sync(
+        self, mock_fetch_source_files, mock_import_xml_request,
+        mock_create_request
+    ):
+        def source_listing(srcmd5, entries):
+            return etree.ElementTree(
+                etree.fromstring(
+                    '<directory name="box" srcmd5="{0}">{1}</directory>'.format(
+                        srcmd5, ''.join(
+                            '<entry name="{0}" md5="{1}"/>'.format(name, md5)
+                            for name, md5 in entries
+                        )
+                    )
+                )
+            )
+
+        def fetch_source_files(package_link, checkout_dir, source_files):
+            for source_file in source_files:
+                with open(os.sep.join([checkout_dir, source_file]), 'w') as fd:
+                    fd.write(source_file)
+
+        mock_fetch_source_files.side_effect = fetch_source_files
+        with TemporaryDirectory() as checkout_dir:
+            # first sync of an existing checkout without listing
+            with open(os.sep.join([checkout_dir, 'a']), 'w') as source:
+                source.write('outdated')
+            mock_import_xml_request.return_value = source_listing(
+                'rev1', [
+                    ('a', '0cc175b9c0f1b6a831c399e269772661'),
+                    ('gone', '50c1f58be7f5e47e0f53d64c094783c2')
+                ]
+            )
+            self.obs.fetch_obs_image(checkout_dir, sync=True)
+            mock_fetch_source_files.assert_called_once_with(
+                'https://api.opensuse.org/source/'
+                'Virtualization:Appliances:SelfContained:suse/box',
+                checkout_dir, ['a', 'gone']
+            )
+            assert os.path.isfile(
+                os.sep.join([checkout_dir, '.obs_source_listing'])
+            )
+
+            # package unchanged in OBS
+            mock_fetch_source_files.reset_mock()
+            self.obs.fetch_obs_image(checkout_dir, sync=True)
+            assert not mock_fetch_source_files.called
+
+            # package unchanged in OBS, but 'a' got modified locally,
+            # e.g. by writing an adapted config file over it
+            with open(os.sep.join([checkout_dir, 'a']), 'w') as source:
+                source.write('modified')
+            self.obs.fetch_obs_image(checkout_dir, sync=True)
+            mock_fetch_source_files.assert_called_once_with(
+                'https://api.opensuse.org/source/'
+                'Virtualization:Appliances:SelfContained:suse/box',
+                checkout_dir, ['a']
+            )
+            mock_fetch_source_files.reset_mock()
+
+            # git sources are refreshed for an unchanged package
+            mock_import_xml_request.return_value = source_listing(
+                'rev1', [
+                    ('a', '0cc175b9c0f1b6a831c399e269772661'),
+                    ('_service', '47604966d065c53f5cb685727aa4a1cc')
+                ]
+            )
+            with open(
+                os.sep.join([checkout_dir, '_service']), 'w'
+            ) as source:
+                source.write('_service')
+            with patch.object(
+                OBS, '_resolve_git_source_service'
+            ) as mock_resolve_git_source_service:
+                self.obs.fetch_obs_image(checkout_dir, sync=True)
+                mock_resolve_git_source_service.assert_called_once_with(
+                    checkout_dir
+                )
+                # the caller fetches the git sources itself
+                mock_resolve_git_source_service.reset_mock()
+                self.obs.fetch_obs_image(
+                    checkout_dir, sync=True, git_sources=False
+                )
+                assert not mock_resolve_git_source_service.called
+            assert not mock_fetch_source_files.called
+
+            # package changed in OBS, 'a' is up to date, 'gone' got
+            # deleted in OBS and 'b' is new
+            with open(os.sep.join([checkout_dir, 'gone']), 'w') as source:
+                source.write('gone')
+            mock_import_xml_request.return_value = source_listing(
+                'rev2', [
+                    ('a', '0cc175b9c0f1b6a831c399e269772661'),
+                    ('b', 'some-md5')
+                ]
+            )
+            self.obs.fetch_obs_image(checkout_dir, sync=True)
+            mock_fetch_source_files.assert_called_once_with(
+                'https://api.opensuse.org/source/'
+                'Virtualization:Appliances:SelfContained:suse/box',
+                checkout_dir, ['b']
+            )
+            assert not os.path.exists(os.sep.join([checkout_dir, 'gone']))
+
+            # 'b' got deleted in OBS and does not exist locally,
+            # 'a' got deleted locally
+            mock_fetch_source_files.reset_mock()
+            mock_import_xml_request.return_value = source_listing(
+                'rev3', [('a', '0cc175b9c0f1b6a831c399e269772661')]
+            )
+            os.remove(os.sep.join([checkout_dir, 'a']))
+            self.obs.fetch_obs_image(checkout_dir, sync=True)
+            mock_fetch_source_files.assert_called_once_with(
+                'https://api.opensuse.org/source/'
+                'Virtualization:Appliances:SelfContained:suse/box',
+                checkout_dir, ['a']
+            )
+
+    @patch.object(OBS, '_create_request')
+    @patch.object(OBS, '_import_xml_request')
+    @patch.object(OBS, '_fetch_source_archive')
+    @patch.object(OBS, '_fetch_source_files')
     @patch('kiwi_obs_plugin.obs.Command.run')
-    @patch('shutil.copy')
-    @patch('os.path.exists')
-    def test_resolve_git_source_service(
-        self, mock_os_path_exists, mock_shutil_copy, mock_Command_run
+    def test_fetch_obs_image_bulk(
+        self, mock_Command_run, mock_fetch_source_files,
+        mock_fetch_source_archive, mock_import_xml_request,
+        mock_create_request
     ):
-        mock_os_path_exists.side_effect = [
-            False, True
+        mock_import_xml_request.return_value = etree.ElementTree(
+            etree.fromstring(
+                '<directory name="box" srcmd5="rev1">'
+                '<entry name="a" md5="x"/><entry name="b" md5="y"/>'
+                '</directory>'
+            )
+        )
+        package_link = 'https://api.opensuse.org/source/' \
+            'Virtualization:Appliances:SelfContained:suse/box'
+        with TemporaryDirectory() as checkout_dir:
+            mock_fetch_source_archive.return_value = True
+            self.obs.fetch_obs_image(checkout_dir, force=True, bulk=True)
+            mock_fetch_source_archive.assert_called_once_with(
+                package_link, checkout_dir, ['a', 'b']
+            )
+            assert not mock_fetch_source_files.called
+
+            # server does not support the cpio view
+            mock_fetch_source_archive.return_value = False
+            self.obs.fetch_obs_image(checkout_dir, force=True, bulk=True)
+            mock_fetch_source_files.assert_called_once_with(
+                package_link, checkout_dir, ['a', 'b']
+            )
+
+    @patch.object(OBS, '_create_request')
+    @patch.object(OBS, '_import_xml_request')
+    @patch.object(OBS, '_fetch_source_files')
+    @patch.object(OBS, '_get_primary_multibuild_profile')
+    @patch.object(OBS, '_lookup_obs_repositories')
+    @patch('kiwi_obs_plugin.obs.Command.run')
+    def test_fetch_obs_image_pipeline(
+        self, mock_Command_run, mock_lookup_obs_repositories,
+        mock_get_primary_multibuild_profile, mock_fetch_source_files,
+        mock_import_xml_request, mock_create_request
+    ):
+        mock_import_xml_request.return_value = etree.ElementTree(
+            etree.fromstring(
+                '<directory name="box" srcmd5="rev1">'
+                '<entry name="a" md5="x"/><entry name="_multibuild" md5="y"/>'
+                '</directory>'
+            )
+        )
+        mock_get_primary_multibuild_profile.return_value = 'Kernel'
+        mock_lookup_obs_repositories.return_value = [
+            obs_repo_probe_type(
+                url='http://r', repo_type='rpm-md',
+                status=obs_repo_status_type(flag='ok', message='imported')
+            )
         ]
+        package_link = 'https://api.opensuse.org/source/' \
+            'Virtualization:Appliances:SelfContained:suse/box'
+        with TemporaryDirectory() as checkout_dir:
+            obs_checkout = self.obs.fetch_obs_image(
+                checkout_dir, force=True, pipeline=True, arch='aarch64'
+            )
+            assert obs_checkout.profile == 'Kernel'
+            # _multibuild is fetched ahead of the other sources
+            assert mock_fetch_source_files.call_args_list == [
+                call(package_link, checkout_dir, ['_multibuild']),
+                call(package_link, checkout_dir, ['a'])
+            ]
+            lookup = self.obs.prefetch_obs_repositories(
+                'Kernel', 'aarch64', 'images'
+            )
+            assert lookup is self.obs.repository_lookups[
+                ('Kernel', 'aarch64', 'images')
+            ]
+            assert lookup.result() == \
+                mock_lookup_obs_repositories.return_value
+
+        # the prefetched repositories are used
+        xml_state = MagicMock()
+        repository_section_obs = MagicMock()
+        repository_section_obs.get_source().get_path.return_value = \
+            'obsrepositories'
+        xml_state.get_repository_sections.return_value = \
+            [repository_section_obs]
+        self.obs.add_obs_repositories(xml_state, 'Kernel', 'aarch64')
+        mock_lookup_obs_repositories.assert_called_once_with(
+            'Kernel', 'aarch64', 'images'
+        )
+        xml_state.add_repository.assert_called_once_with(
+            'http://r', 'rpm-md', None, '1'
+        )
+
+    @patch.object(OBS, '_create_request')
+    @patch.object(OBS, '_import_xml_request')
+    @patch.object(OBS, '_fetch_source_files')
+    @patch('kiwi_obs_plugin.obs.Command.run')
+    def test_fetch_obs_image_source_cache(
+        self, mock_Command_run, mock_fetch_source_files,
+        mock_import_xml_request, mock_create_request
+    ):
+        mock_import_xml_request.return_value = etree.ElementTree(
+            etree.fromstring(
+                '<directory name="box" srcmd5="rev1">'
+                '<entry name="a" md5="md5_a"/><entry name="b" md5="md5_b"/>'
+                '</directory>'
+            )
+        )
+        self.obs.source_cache = Mock()
+        self.obs.source_cache.get.side_effect = [True, False]
+        with TemporaryDirectory() as checkout_dir:
+            self.obs.fetch_obs_image(checkout_dir, force=True)
+            assert self.obs.source_cache.get.call_args_list == [
+                call('md5_a', os.sep.join([checkout_dir, 'a'])),
+                call('md5_b', os.sep.join([checkout_dir, 'b']))
+            ]
+            mock_fetch_source_files.assert_called_once_with(
+                'https://api.opensuse.org/source/'
+                'Virtualization:Appliances:SelfContained:suse/box',
+                checkout_dir, ['b']
+            )
+            self.obs.source_cache.add.assert_called_once_with(
+                'md5_b', os.sep.join([checkout_dir, 'b'])
+            )
+            self.obs.source_cache.evict.assert_called_once_with()
+
+    @patch.object(OBS, '_create_request')
+    @patch.object(OBS, '_fetch_source_files')
+    @patch('kiwi_obs_plugin.obs.Cpio')
+    def test_fetch_source_archive(
+        self, mock_Cpio, mock_fetch_source_files, mock_create_request
+    ):
+        request = mock_create_request.return_value
+        mock_Cpio.return_value.extract.return_value = ['a']
+        assert self.obs._fetch_source_archive(
+            'package_link', 'checkout_dir', ['a', 'b']
+        ) is True
+        mock_create_request.assert_called_once_with(
+            'package_link?view=cpio', stream=True
+        )
+        mock_Cpio.assert_called_once_with(request.raw)
+        mock_Cpio.return_value.extract.assert_called_once_with(
+            'checkout_dir', ['a', 'b']
+        )
+        assert request.raw.decode_content is True
+        # files missing in the archive are fetched one by one
+        mock_fetch_source_files.assert_called_once_with(
+            'package_link', 'checkout_dir', ['b']
+        )
+
+        mock_fetch_source_files.reset_mock()
+        mock_Cpio.return_value.extract.return_value = ['a', 'b']
+        assert self.obs._fetch_source_archive(
+            'package_link', 'checkout_dir', ['a', 'b']
+        ) is True
+        assert not mock_fetch_source_files.called
+
+        mock_create_request.side_effect = KiwiUriOpenError('not supported')
+        assert self.obs._fetch_source_archive(
+            'package_link', 'checkout_dir', ['a', 'b']
+        ) is False
+
+    @patch.object(OBS, '_fetch_source_file')
+    def test_fetch_source_files_stops_on_first_error(
+        self, mock_fetch_source_file
+    ):
+        def fetch_source_file(url, target):
+            if target.endswith('a'):
+                raise KiwiUriOpenError('a failed')
+            time.sleep(0.1)
+
+        mock_fetch_source_file.side_effect = fetch_source_file
+        self.obs.jobs = 1
+        with raises(KiwiUriOpenError):
+            self.obs._fetch_source_files(
+                'package_link', 'checkout_dir', ['a', 'b', 'c']
+            )
+        assert call(
+            'package_link/a', 'checkout_dir/a'
+        ) in mock_fetch_source_file.call_args_list
+        assert call(
+            'package_link/c', 'checkout_dir/c'
+        ) not in mock_fetch_source_file.call_args_list
+
+    @patch.object(OBS, '_clone_git_sources')
+    @patch('kiwi_obs_plugin.obs.FileCopy.copy_tree')
+    @patch('kiwi_obs_plugin.obs.FileCopy.copy')
+    def test_resolve_git_source_service(
+        self, mock_FileCopy_copy, mock_FileCopy_copy_tree,
+        mock_clone_git_sources
+    ):
+        git_clone = git_clone_type(
+            git_dir='../data/_obs_scm_git/kiwi', checkout=True
+        )
+        mock_clone_git_sources.return_value = {
+            ('https://github.com/OSInside/kiwi.git', 'master'): git_clone
+        }
+        self.obs.git_cache = MagicMock()
         self.obs._resolve_git_source_service('../data')
-        assert mock_Command_run.call_args_list == [
+        self.obs.git_cache.evict.assert_called_once_with()
+        # the mirror is locked while it is read
+        self.obs.git_cache.lock.assert_called_once_with(
+            'https://github.com/OSInside/kiwi.git'
+        )
+        assert self.obs.git_cache.lock.return_value.__exit__.called
+        assert [
+            git_source.source_dir for git_source in
+            mock_clone_git_sources.call_args[0][1]
+        ] == [
+            'build-tests/x86/suse/test-image-pxe',
+            'build-tests/x86/suse/test-image-pxe/root'
+        ]
+        assert [
+            git_source.excludes for git_source in
+            mock_clone_git_sources.call_args[0][1]
+        ] == [['root'], []]
+        mock_FileCopy_copy_tree.assert_called_once_with(
+            '../data/_obs_scm_git/kiwi/build-tests/x86/suse/'
+            'test-image-pxe/root', '../data/root', 4, []
+        )
+        assert mock_FileCopy_copy.call_args_list == [
             call(
-                [
-                    'git', 'clone', '--branch', 'master',
-                    'https://github.com/OSInside/kiwi.git',
-                    '../data/_obs_scm_git'
-                ]
+                '../data/_obs_scm_git/kiwi/build-tests/x86/suse/'
+                'test-image-pxe/appliance.kiwi', '../data/appliance.kiwi'
             ),
+            call(
+                '../data/_obs_scm_git/kiwi/build-tests/x86/suse/'
+                'test-image-pxe/config.sh', '../data/config.sh'
+            )
+        ]
+
+    @patch('kiwi_obs_plugin.obs.FileCopy')
+    def test_copy_git_source_unused(self, mock_FileCopy):
+        OBS.copy_git_source(
+            'git_dir', git_source_type(
+                clone='url', revision='master', source_dir='a',
+                use_entire_source_dir=False, files=[], excludes=[]
+            ), 'checkout_dir'
+        )
+        assert not mock_FileCopy.copy.called
+        assert not mock_FileCopy.copy_tree.called
+
+    @patch.object(OBS, '_clone_git_sources')
+    @patch.object(OBS, '_export_git_files')
+    def test_resolve_git_source_service_export(
+        self, mock_export_git_files, mock_clone_git_sources
+    ):
+        mock_clone_git_sources.return_value = {
+            ('https://github.com/OSInside/kiwi.git', 'master'):
+                git_clone_type(git_dir='mirror.git', checkout=False)
+        }
+        with TemporaryDirectory() as checkout_dir:
+            with open(os.sep.join([checkout_dir, '_service']), 'w') as service:
+                service.write(
+                    '<services><service name="obs_scm">'
+                    '<param name="url">'
+                    'https://github.com/OSInside/kiwi.git</param>'
+                    '<param name="scm">git</param>'
+                    '<param name="subdir">/build-tests/</param>'
+                    '<param name="extract">config.sh</param>'
+                    '<param name="extract">appliance.kiwi</param>'
+                    '<param name="revision">master</param>'
+                    '</service></services>'
+                )
+            self.obs._resolve_git_source_service(checkout_dir)
+        mock_export_git_files.assert_called_once_with(
+            'mirror.git', 'master', [
+                'build-tests/config.sh', 'build-tests/appliance.kiwi'
+            ], checkout_dir
+        )
+
+    @patch.object(OBS, '_clone_git_source')
+    def test_clone_git_sources(self, mock_clone_git_source):
+        git_source = git_source_type(
+            clone='url_a', revision='master', source_dir='a',
+            use_entire_source_dir=False, files=['config.sh'], excludes=[]
+        )
+        git_sources = [
+            git_source,
+            git_source._replace(files=['config.kiwi']),
+            git_source._replace(revision='v1.0'),
+            git_source._replace(clone='url_b', use_entire_source_dir=True)
+        ]
+        mock_clone_git_source.side_effect = \
+            lambda url, revision, target_dir, sparse_paths, checkout: \
+            target_dir
+        git_clones = self.obs._clone_git_sources(
+            'checkout_dir', git_sources
+        )
+        assert list(git_clones) == [
+            ('url_a', 'master'), ('url_a', 'v1.0'), ('url_b', 'master')
+        ]
+        assert len(
+            set(git_clone.git_dir for git_clone in git_clones.values())
+        ) == 3
+        assert [
+            git_clone.checkout for git_clone in git_clones.values()
+        ] == [False, False, True]
+        assert sorted(mock_clone_git_source.call_args_list) == sorted(
+            [
+                call(
+                    'url_a', 'master', git_clones[('url_a', 'master')].git_dir,
+                    ['/a/config.sh', '/a/config.kiwi'], False
+                ),
+                call(
+                    'url_a', 'v1.0', git_clones[('url_a', 'v1.0')].git_dir,
+                    ['/a/config.sh'], False
+                ),
+                call(
+                    'url_b', 'master', git_clones[('url_b', 'master')].git_dir,
+                    ['/a/', '/a/config.sh'], True
+                )
+            ]
+        )
+
+        # clones from a previous run are refreshed
+        mock_clone_git_source.reset_mock()
+        assert self.obs._clone_git_sources(
+            'checkout_dir', git_sources
+        ) == git_clones
+        assert mock_clone_git_source.call_count == 3
+
+        # the first failed clone cancels the pending ones
+        def clone_git_source(
+            url, revision, target_dir, sparse_paths, checkout
+        ):
+            if revision == 'master':
+                raise Exception('clone failed')
+            time.sleep(0.1)
+
+        mock_clone_git_source.reset_mock()
+        mock_clone_git_source.side_effect = clone_git_source
+        self.obs.jobs = 1
+        with raises(Exception):
+            self.obs._clone_git_sources(
+                'checkout_dir', git_sources[:1] + git_sources[2:]
+            )
+        assert mock_clone_git_source.call_args_list[-1][0][0:2] != \
+            ('url_b', 'master')
+
+    @patch.object(OBS, '_git_clone')
+    def test_clone_git_source(self, mock_git_clone):
+        assert self.obs._clone_git_source(
+            'url', 'master', 'target_dir', ['/a']
+        ) == 'target_dir'
+        mock_git_clone.assert_called_once_with(
+            'url', 'master', 'target_dir', ['/a'], True, None
+        )
+        mock_git_clone.reset_mock()
+        self.obs.git_cache = Mock()
+        self.obs.git_cache.update.return_value = '/cache/git/mirror.git'
+        self.obs._clone_git_source('url', 'master', 'target_dir', ['/a'])
+        self.obs.git_cache.update.assert_called_once_with('url')
+        # missing blobs of the mirror are fetched from url
+        mock_git_clone.assert_called_once_with(
+            'file:///cache/git/mirror.git', 'master', 'target_dir', ['/a'],
+            True, 'url'
+        )
+
+        # files are exported from the mirror
+        mock_git_clone.reset_mock()
+        assert self.obs._clone_git_source(
+            'url', 'master', 'target_dir', ['/a'], False
+        ) == '/cache/git/mirror.git'
+        assert not mock_git_clone.called
+
+        # a clone from a previous run is replaced
+        with TemporaryDirectory() as temp_dir:
+            target_dir = os.sep.join([temp_dir, 'clone'])
+            os.mkdir(target_dir)
+            self.obs._clone_git_source('url', 'master', target_dir, ['/a'])
+            assert not os.path.exists(target_dir)
+
+    @patch('kiwi_obs_plugin.obs.Command.call')
+    def test_export_git_files(self, mock_Command_call):
+        def git_archive(members, returncode=0, error=b''):
+            archive = io.BytesIO()
+            with tarfile.open(fileobj=archive, mode='w') as tar:
+                for (name, data, mode) in members:
+                    info = tarfile.TarInfo(name)
+                    if data is None:
+                        info.type = tarfile.DIRTYPE
+                    elif mode is None:
+                        info.type = tarfile.SYMTYPE
+                        info.linkname = data
+                    else:
+                        info.size = len(data)
+                        info.mode = mode
+                    tar.addfile(
+                        info, io.BytesIO(data) if mode else None
+                    )
+            process = Mock()
+            process.wait.return_value = returncode
+            return Mock(
+                output=io.BytesIO(archive.getvalue()),
+                error=io.BytesIO(error), process=process
+            )
+
+        mock_Command_call.return_value = git_archive(
+            [
+                ('a/', None, 0o755),
+                ('a/config.sh', b'#!/bin/sh', 0o755),
+                ('a/link', 'config.sh', None)
+            ]
+        )
+        with TemporaryDirectory() as target_dir:
+            with open(os.sep.join([target_dir, 'config.sh']), 'w') as old:
+                old.write('old')
+            OBS._export_git_files(
+                'git_dir', 'master', ['a/config.sh', 'a/link'], target_dir
+            )
+            config_sh = os.sep.join([target_dir, 'config.sh'])
+            with open(config_sh) as config:
+                assert config.read() == '#!/bin/sh'
+            assert os.stat(config_sh).st_mode & 0o777 == 0o755
+            assert os.readlink(os.sep.join([target_dir, 'link'])) == \
+                'config.sh'
+            assert sorted(os.listdir(target_dir)) == ['config.sh', 'link']
+        mock_Command_call.assert_called_once_with(
+            [
+                'git', '-C', 'git_dir', 'archive', '--format=tar',
+                'master', '--', 'a/config.sh', 'a/link'
+            ]
+        )
+
+        # git archive failed
+        mock_Command_call.return_value = Mock(
+            output=io.BytesIO(b''), error=io.BytesIO(b'fatal: pathspec'),
+            process=Mock(wait=Mock(return_value=128))
+        )
+        with raises(KiwiOBSPluginSourceError):
+            OBS._export_git_files('git_dir', 'master', ['a'], 'target_dir')
+
+        # git archive succeeded but produced no valid archive
+        mock_Command_call.return_value = Mock(
+            output=io.BytesIO(b'garbage'), error=io.BytesIO(b''),
+            process=Mock(wait=Mock(return_value=0))
+        )
+        with raises(KiwiOBSPluginSourceError):
+            OBS._export_git_files('git_dir', 'master', ['a'], 'target_dir')
+
+    def test_get_git_sparse_paths(self):
+        git_source = git_source_type(
+            clone='url', revision='master', source_dir='',
+            use_entire_source_dir=False, files=['config.sh'], excludes=[]
+        )
+        assert OBS._get_git_sparse_paths([git_source]) == ['/config.sh']
+        assert OBS._get_git_sparse_paths(
+            [
+                git_source._replace(
+                    source_dir='root/', use_entire_source_dir=True, files=[]
+                )
+            ]
+        ) == ['/root/']
+        # excluded content is not fetched, extracted files win
+        assert OBS._get_git_sparse_paths(
+            [
+                git_source._replace(source_dir='a'),
+                git_source._replace(
+                    source_dir='a', use_entire_source_dir=True, files=[],
+                    excludes=['root/', '*.pyc', 'etc/motd']
+                )
+            ]
+        ) == [
+            '/a/', '!/a/**/root', '!/a/**/*.pyc', '!/a/etc/motd',
+            '/a/config.sh'
+        ]
+        assert OBS._get_git_sparse_paths(
+            [
+                git_source._replace(
+                    use_entire_source_dir=True, excludes=['*.pyc']
+                )
+            ]
+        ) == ['/*', '!/**/*.pyc', '/config.sh']
+        # the entire repository is used
+        assert OBS._get_git_sparse_paths(
+            [git_source, git_source._replace(use_entire_source_dir=True)]
+        ) == []
+
+    @patch('kiwi_obs_plugin.obs.Command.run')
+    def test_git_clone(self, mock_Command_run):
+        with TemporaryDirectory() as target_dir:
+            OBS._git_clone('url', 'master', target_dir, ['/a/b', '/c/'])
+            with open(
+                os.sep.join([target_dir, '.git/info/sparse-checkout'])
+            ) as sparse_checkout:
+                assert sparse_checkout.read() == '/a/b\n/c/\n'
+        assert mock_Command_run.call_args_list == [
             call(
                 [
-                    'cp', '-a',
-                    '../data/_obs_scm_git/build-tests/x86/suse/'
-                    'test-image-pxe/root', '../data'
+                    'git', 'clone', '--depth', '1', '--filter=blob:none',
+                    '--no-checkout', '--config', 'core.sparseCheckout=true',
+                    '--branch', 'master', 'url', target_dir
                 ]
-            )
+            ),
+            call(['git', '-C', target_dir, 'read-tree', '-mu', 'HEAD'])
         ]
-        assert mock_shutil_copy.call_args_list == [
+        mock_Command_run.reset_mock()
+        with TemporaryDirectory() as target_dir:
+            OBS._git_clone('url', 'master', target_dir, [])
+            assert not os.path.exists(os.sep.join([target_dir, '.git']))
+        assert mock_Command_run.call_count == 2
+        assert '--config' not in mock_Command_run.call_args_list[0][0][0]
+        mock_Command_run.reset_mock()
+        OBS._git_clone('url', 'master', 'target_dir', ['/a'], False)
+        assert mock_Command_run.call_count == 1
+        # clone of a blobless mirror
+        mock_Command_run.reset_mock()
+        OBS._git_clone(
+            'file:///mirror.git', 'master', 'target_dir', ['/a'], False,
+            'url'
+        )
+        mock_Command_run.assert_called_once_with(
+            [
+                'git', 'clone', '--depth', '1', '--filter=blob:none',
+                '--no-checkout', '--config', 'core.sparseCheckout=true',
+                '--config', 'remote.upstream.url=url',
+                '--config', 'remote.upstream.promisor=true',
+                '--config', 'remote.upstream.partialclonefilter=blob:none',
+                '--branch', 'master', 'file:///mirror.git', 'target_dir'
+            ]
+        )
+
+    def test_create_request_error_status(self):
+        response = Mock()
+        response.ok = False
+        response.raise_for_status.side_effect = \
+            requests.exceptions.HTTPError('404 Not Found')
+        self.obs.session.request.return_value = response
+        with raises(KiwiUriOpenError):
+            self.obs._create_request('url', stream=True)
+        response.close.assert_called_once_with()
+
+    def test_has_api_session_cookie(self):
+        def cookie(name, domain):
+            session_cookie = Mock()
+            session_cookie.name = name
+            session_cookie.domain = domain
+            return session_cookie
+
+        for cookies in [
+            [cookie('openSUSE_session', '.opensuse.org')],
+            [cookie('openSUSE_session', 'api.opensuse.org')],
+            [cookie('_obs_api_session', 'API.openSUSE.org')]
+        ]:
+            self.obs.session.cookies.__iter__.return_value = cookies
+            assert self.obs._has_api_session_cookie()
+        for cookies in [
+            [],
+            # cookies of another domain or of a repository server
+            [cookie('openSUSE_session', '.suse.org')],
+            [cookie('openSUSE_session', 'opensuse.org.example.com')],
+            [cookie('openSUSE_session', '')],
+            [cookie('mirror_session', '.opensuse.org')]
+        ]:
+            self.obs.session.cookies.__iter__.return_value = cookies
+            assert not self.obs._has_api_session_cookie()
+
+    @patch('kiwi_obs_plugin.obs.HTTPBasicAuth')
+    def test_create_request_uses_session_cookie(self, mock_HTTPBasicAuth):
+        cookie = Mock()
+        cookie.name = 'openSUSE_session'
+        cookie.domain = '.opensuse.org'
+        self.obs.session.cookies.__iter__.return_value = [cookie]
+        self.obs.session.request.return_value.status_code = 200
+        self.obs._create_request('url')
+        self.obs.session.request.assert_called_once_with(
+            'GET', 'url', timeout=(10, 60), auth=None, verify=True,
+            stream=False, headers=None
+        )
+
+        # session expired, repeat with credentials
+        self.obs.session.request.reset_mock()
+        self.obs.session.request.return_value.status_code = 401
+        self.obs._create_request('url')
+        self.obs.session.cookies.clear.assert_called_once_with()
+        assert self.obs.session.request.call_args_list == [
             call(
-                '../data/_obs_scm_git/build-tests/x86/suse/test-image-pxe/'
-                'appliance.kiwi', '../data'
+                'GET', 'url', timeout=(10, 60), auth=None, verify=True,
+                stream=False, headers=None
             ),
             call(
-                '../data/_obs_scm_git/build-tests/x86/suse/test-image-pxe/'
-                'config.sh', '../data'
+                'GET', 'url', timeout=(10, 60),
+                auth=mock_HTTPBasicAuth.return_value,
+                verify=True, stream=False, headers=None
             )
         ]
+        mock_HTTPBasicAuth.assert_called_once_with('bob', 'secret')
+
+    @patch.object(OBS, '_create_request')
+    def test_create_cached_request(self, mock_create_request):
+        request = mock_create_request.return_value
+        assert self.obs._create_cached_request('url') == request
+        mock_create_request.assert_called_once_with('url', stream=True)
+
+        self.obs.http_cache = Mock()
+        http_cache = self.obs.http_cache
+        http_cache.get_conditional_headers.return_value = {
+            'If-None-Match': '"etag"'
+        }
+        # changed on the server
+        mock_create_request.reset_mock()
+        request.status_code = 200
+        assert self.obs._create_cached_request('url') == \
+            http_cache.record.return_value
+        mock_create_request.assert_called_once_with(
+            'url', stream=True, headers={'If-None-Match': '"etag"'}
+        )
+        http_cache.record.assert_called_once_with('url', request)
+
+        # not modified
+        request.status_code = 304
+        assert self.obs._create_cached_request('url') == \
+            http_cache.get.return_value
+        request.close.assert_called_once_with()
+
+        # not modified but evicted in the meantime
+        mock_create_request.reset_mock()
+        http_cache.record.reset_mock()
+        http_cache.get.return_value = None
+        self.obs._create_cached_request('url')
+        assert mock_create_request.call_args_list == [
+            call('url', stream=True, headers={'If-None-Match': '"etag"'}),
+            call('url', stream=True)
+        ]
+        http_cache.record.assert_called_once_with('url', request)
+
+    @patch.object(OBS, '_create_request')
+    def test_download(self, mock_create_request):
+        request = mock_create_request.return_value
+        request.__enter__.return_value = request
+        request.iter_content.return_value = [b'foo', b'bar']
+        with patch('builtins.open', create=True) as mock_open:
+            mock_open.return_value = MagicMock(spec=io.IOBase)
+            file_handle = mock_open.return_value.__enter__.return_value
+            self.obs._download('url', 'target')
+            mock_create_request.assert_called_once_with('url', stream=True)
+            request.iter_content.assert_called_once_with(chunk_size=65536)
+            mock_open.assert_called_once_with('target', 'wb')
+            assert file_handle.write.call_args_list == [
+                call(b'foo'), call(b'bar')
+            ]
+
+    @patch.object(OBS, '_create_request')
+    @patch.object(OBS, '_import_buildinfo_paths')
+    @patch.object(OBS, '_probe_repository')
+    def test_add_obs_repositories_keeps_buildinfo_order(
+        self, mock_probe_repository, mock_import_buildinfo_paths,
+        mock_create_request
+    ):
+        def probe_repository(repo_url):
+            # let the first probes finish last
+            time.sleep(0.01 * (4 - int(repo_url[-1])))
+            return obs_repo_probe_type(
+                url=repo_url, repo_type=repo_types[repo_url],
+                status=obs_repo_status_type(flag='ok', message='imported')
+            )
+
+        repo_types = {
+            'obs://p/r1': 'rpm-md',
+            'obs://p/r2': 'apt-deb',
+            'obs://p/r3': 'rpm-md',
+            'http://example.com/r4': 'apt-deb'
+        }
+        mock_import_buildinfo_paths.return_value = [
+            {'project': 'p', 'repository': 'r1'},
+            {'project': 'p', 'repository': 'r2'},
+            {'project': 'p', 'repository': 'r3'},
+            {'url': 'http://example.com/r4'}
+        ]
+        mock_probe_repository.side_effect = probe_repository
+        xml_state = MagicMock()
+        repository_section_obs = MagicMock()
+        repository_section_obs.get_source().get_path.return_value = \
+            'obsrepositories'
+        xml_state.get_repository_sections.return_value = \
+            [repository_section_obs]
+        self.obs.add_obs_repositories(xml_state)
+        assert xml_state.add_repository.call_args_list == [
+            call('obs://p/r1', 'rpm-md', None, '1'),
+            call('obs://p/r2', 'apt-deb', None, '500'),
+            call('obs://p/r3', 'rpm-md', None, '2'),
+            call('http://example.com/r4', 'apt-deb', None, '499')
+        ]
+
+    def test_import_xml_request(self):
+        request = MagicMock()
+        request.iter_content.return_value = [
+            b'<directory srcmd5="abc">', b'<entry name="a"/></directory>'
+        ]
+        xml_tree = self.obs._import_xml_request(request)
+        request.iter_content.assert_called_once_with(chunk_size=65536)
+        assert xml_tree.getroot().get('srcmd5') == 'abc'
+        assert xml_tree.getroot().xpath('/directory/entry')[0].get(
+            'name'
+        ) == 'a'
+
+    def test_import_buildinfo_paths(self):
+        request = MagicMock()
+        request.iter_content.return_value = [
+            b'<buildinfo project="p"><arch>x86_64</arch>',
+            b'<bdep name="a"><path project="nested"/></bdep>',
+            b'<path project="p1" repository="r1"/>',
+            b'<bdep name="b"/><path project="p2" repository="r2" ',
+            b'url="http://example.com/p2"/><bdep name="c"/></buildinfo>'
+        ]
+        assert self.obs._import_buildinfo_paths(request) == [
+            {'project': 'p1', 'repository': 'r1'},
+            {
+                'project': 'p2', 'repository': 'r2',
+                'url': 'http://example.com/p2'
+            }
+        ]
+
+    @patch.object(OBS, '_probe_repository')
+    def test_probe_shared_repository(self, mock_probe_repository):
+        def probe_repository(repo_url):
+            time.sleep(0.05)
+            if repo_url == 'http://broken':
+                raise Exception('probe failed')
+            return obs_repo_probe_type(
+                url=repo_url, repo_type='rpm-md',
+                status=obs_repo_status_type(flag='ok', message='imported')
+            )
+
+        mock_probe_repository.side_effect = probe_repository
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            repo_probes = [
+                pool.submit(self.obs._probe_shared_repository, repo_url)
+                for repo_url in ['http://r', 'http://r', 'http://broken']
+            ]
+        assert repo_probes[0].result() == repo_probes[1].result()
+        with raises(Exception):
+            repo_probes[2].result()
+        assert mock_probe_repository.call_count == 2
+
+    @patch.object(OBS, '_probe_repository')
+    def test_probe_shared_repository_cancelled(self, mock_probe_repository):
+        probe = obs_repo_probe_type(
+            url='http://r', repo_type='rpm-md',
+            status=obs_repo_status_type(flag='ok', message='imported')
+        )
+        mock_probe_repository.side_effect = KiwiOBSPluginCancelledError(
+            'cancelled'
+        )
+        # the probe of the cancelled call fails
+        with raises(KiwiOBSPluginCancelledError):
+            self.obs._probe_shared_repository('http://r')
+        # and is no result for the others
+        mock_probe_repository.side_effect = None
+        mock_probe_repository.return_value = probe
+        assert self.obs._probe_shared_repository('http://r') == probe
+        assert self.obs._probe_shared_repository('http://r') == probe
+        mock_probe_repository.assert_called_with('http://r')
+        assert mock_probe_repository.call_count == 2
+
+    @patch.object(OBS, '_probe_repository_type')
+    @patch('kiwi_obs_plugin.obs.Uri')
+    def test_probe_repository_cancelled(
+        self, mock_Uri, mock_probe_repository_type
+    ):
+        mock_Uri.return_value.translate.return_value = 'http://r'
+        mock_probe_repository_type.side_effect = \
+            KiwiOBSPluginCancelledError('cancelled')
+        self.obs.repository_cache = None
+        with raises(KiwiOBSPluginCancelledError):
+            self.obs._probe_repository('http://r')
+
+    @patch.object(OBS, '_lookup_obs_repositories')
+    def test_prefetch_obs_repositories_cancelled(
+        self, mock_lookup_obs_repositories
+    ):
+        mock_lookup_obs_repositories.side_effect = \
+            KiwiOBSPluginCancelledError('cancelled')
+        lookup = self.obs.prefetch_obs_repositories(
+            'Kernel', 'x86_64', 'images'
+        )
+        with raises(KiwiOBSPluginCancelledError):
+            lookup.result()
+        # the lookup of a cancelled call is repeated
+        mock_lookup_obs_repositories.side_effect = None
+        assert self.obs.prefetch_obs_repositories(
+            'Kernel', 'x86_64', 'images'
+        ).result() == mock_lookup_obs_repositories.return_value
+        # other lookups are kept
+        cancelled_lookup = Future()
+        cancelled_lookup.cancel()
+        self.obs.repository_lookups[('System', 'x86_64', 'images')] = \
+            cancelled_lookup
+        assert self.obs.prefetch_obs_repositories(
+            'System', 'x86_64', 'images'
+        ) is cancelled_lookup
+
+    def test_with_cancel_event(self):
+        cancel_event = threading.Event()
+        obs = self.obs.with_cancel_event(cancel_event)
+        assert obs.cancel_event is cancel_event
+        assert self.obs.cancel_event is None
+        assert obs.session is self.obs.session
+        assert obs.repository_lookups is self.obs.repository_lookups
+        assert obs.repository_lookup_pool is \
+            self.obs.repository_lookup_pool
+
+    @patch('kiwi_obs_plugin.obs.time.sleep')
+    def test_send_cancelled(self, mock_sleep):
+        def request(*args, **kwargs):
+            cancel_event.set()
+            raise requests.exceptions.ConnectionError
+
+        cancel_event = threading.Event()
+        obs = self.obs.with_cancel_event(cancel_event)
+        obs.retries = 3
+        self.obs.session.request.side_effect = request
+        # the retry of a request cancelled meanwhile is not sent
+        with raises(KiwiOBSPluginCancelledError):
+            obs._send('GET', 'http://example.com/a')
+        assert self.obs.session.request.call_count == 1
+        # no further request is sent
+        with raises(KiwiOBSPluginCancelledError):
+            obs._create_request('http://example.com/b')
+        assert self.obs.session.request.call_count == 1
+
+    @patch.object(OBS, '_create_cached_request')
+    @patch.object(OBS, '_import_xml_request')
+    def test_get_image_packages(
+        self, mock_import_xml_request, mock_create_cached_request
+    ):
+        mock_import_xml_request.return_value = etree.ElementTree(
+            etree.fromstring(
+                '<sourceinfolist>'
+                '<sourceinfo package="box" srcmd5="a">'
+                '<filename>box.kiwi</filename></sourceinfo>'
+                '<sourceinfo package="box:Kernel" srcmd5="a">'
+                '<filename>box.kiwi</filename></sourceinfo>'
+                '<sourceinfo package="linked" srcmd5="b" lsrcmd5="c">'
+                '<filename>config.xml</filename></sourceinfo>'
+                '<sourceinfo package="rpm" srcmd5="d">'
+                '<filename>rpm.spec</filename></sourceinfo>'
+                '<sourceinfo package="broken">'
+                '<error>bad link</error></sourceinfo>'
+                '</sourceinfolist>'
+            )
+        )
+        assert self.obs.get_image_packages() == [
+            obs_package_type(name='box', srcmd5='a'),
+            obs_package_type(name='linked', srcmd5='c')
+        ]
+        mock_create_cached_request.assert_called_once_with(
+            'https://api.opensuse.org/source/'
+            'Virtualization:Appliances:SelfContained:suse?view=info'
+        )
+
+    def test_get_checkout_srcmd5(self):
+        with TemporaryDirectory() as checkout_dir:
+            assert OBS.get_checkout_srcmd5(checkout_dir) is None
+            OBS._write_source_listing(
+                checkout_dir, etree.ElementTree(
+                    etree.fromstring('<directory srcmd5="abc"/>')
+                )
+            )
+            assert OBS.get_checkout_srcmd5(checkout_dir) == 'abc'
+
+    def test_get_completed_srcmd5(self):
+        with TemporaryDirectory() as checkout_dir:
+            assert OBS.get_completed_srcmd5(checkout_dir, 'x86_64') is None
+            OBS._write_source_listing(
+                checkout_dir, etree.ElementTree(
+                    etree.fromstring('<directory srcmd5="abc"/>')
+                )
+            )
+            OBS.set_completed_arch(checkout_dir, 'x86_64')
+            assert OBS.get_completed_srcmd5(checkout_dir, 'x86_64') == 'abc'
+            assert OBS.get_completed_srcmd5(checkout_dir, 'aarch64') is None
+
+    def test_for_image(self):
+        obs = self.obs.for_image('OBS:Other/image')
+        assert (obs.project, obs.package) == ('OBS:Other', 'image')
+        assert (self.obs.project, self.obs.package) == (
+            'Virtualization:Appliances:SelfContained:suse', 'box'
+        )
+        assert obs.session is self.obs.session
+        assert obs.repository_probes is self.obs.repository_probes
+        assert obs.repository_lookups is not self.obs.repository_lookups
+        assert obs.repository_lookup_pool is self.obs.repository_lookup_pool
+        with raises(KiwiOBSPluginProjectError):
+            self.obs.for_image('OBS:Other')
+
+    def test_get_image_description_file(self):
+        with TemporaryDirectory() as checkout_dir:
+            assert OBS.get_image_description_file(checkout_dir) == ''
+            for (names, description_file) in [
+                (['config.sh', 'config.xml', 'box.kiwi'], 'config.xml'),
+                (['config.sh', 'box.kiwi', 'a.kiwi'], 'a.kiwi'),
+                (['config.sh'], '')
+            ]:
+                OBS._write_source_listing(
+                    checkout_dir, etree.ElementTree(
+                        etree.fromstring(
+                            '<directory>{0}</directory>'.format(
+                                ''.join(
+                                    f'<entry name="{name}"/>'
+                                    for name in names
+                                )
+                            )
+                        )
+                    )
+                )
+                assert OBS.get_image_description_file(checkout_dir) == \
+                    description_file
+
+            # the description is not part of the OBS sources
+            OBS.set_image_description_file(checkout_dir, 'appliance.kiwi')
+            assert OBS.get_image_description_file(checkout_dir) == ''
+            with open(os.sep.join([checkout_dir, 'appliance.kiwi']), 'w'):
+                pass
+            assert OBS.get_image_description_file(checkout_dir) == \
+                'appliance.kiwi'
+
+    def test_get_multibuild_profiles(self):
+        assert OBS.get_multibuild_profiles('../data') == ['Kernel', 'System']
+        assert OBS.get_multibuild_profiles('../data/no_such_dir') == []
 
     def test_get_primary_multibuild_profile(self):
         assert self.obs._get_primary_multibuild_profile(
@@ -227,16 +1328,13 @@ class TestOBS:
         with self._caplog.at_level(logging.DEBUG):
             self.obs.print_repository_status(repo_status)
 
-    @patch('requests.get')
     @patch('kiwi_obs_plugin.obs.HTTPBasicAuth')
-    @patch('kiwi_obs_plugin.obs.NamedTemporaryFile')
-    @patch('kiwi_obs_plugin.obs.etree')
-    @patch('kiwi_obs_plugin.obs.SolverRepositoryBase')
+    @patch.object(OBS, '_import_buildinfo_paths')
+    @patch.object(OBS, '_probe_repository_type')
     @patch('kiwi_obs_plugin.obs.Uri')
     def test_add_obs_repositories(
-        self, mock_Uri, mock_SolverRepositoryBase,
-        mock_etree, mock_NamedTemporaryFile, mock_HTTPBasicAuth,
-        mock_requests_get
+        self, mock_Uri, mock_probe_repository_type,
+        mock_import_buildinfo_paths, mock_HTTPBasicAuth
     ):
         xml_state = MagicMock()
         repository_section_std = MagicMock()
@@ -250,81 +1348,306 @@ class TestOBS:
             [repository_section_std, repository_section_obs]
 
         # check Exception on request
-        mock_requests_get.side_effect = Exception
+        self.obs.session.request.side_effect = Exception
         with raises(KiwiUriOpenError):
             self.obs.add_obs_repositories(xml_state)
 
         # check Exception on valid request but unexpected content
-        mock_requests_get.side_effect = None
-        xml_root = MagicMock()
-        xml_root.xpath.return_value = []
-        buildinfo_xml_tree = MagicMock()
-        buildinfo_xml_tree.getroot.return_value = xml_root
-        mock_etree.parse.return_value = buildinfo_xml_tree
-        with patch('builtins.open', create=True):
-            with raises(KiwiOBSPluginBuildInfoError):
-                self.obs.add_obs_repositories(xml_state)
+        self.obs.session.request.side_effect = None
+        mock_import_buildinfo_paths.return_value = []
+        with raises(KiwiOBSPluginBuildInfoError):
+            self.obs.add_obs_repositories(xml_state)
 
         # check on unreachable repo
         repo_uri = Mock()
+        repo_uri.translate.return_value = 'http://example.com/repo'
         mock_Uri.return_value = repo_uri
         repo_path = Mock()
         repo_path.get.return_value = 'some-repo-url'
-        xml_root.xpath.return_value = [
+        mock_import_buildinfo_paths.return_value = [
             repo_path
         ]
-        mock_requests_get.side_effect = [Mock(), Exception]
-        with patch('builtins.open', create=True):
-            self.obs.add_obs_repositories(xml_state)
-            mock_Uri.assert_called_once_with('some-repo-url')
-            assert not xml_state.add_repository.called
+        mock_probe_repository_type.side_effect = \
+            requests.exceptions.ConnectionError
+        repo_status = self.obs.add_obs_repositories(xml_state)
+        assert repo_status['http://example.com/repo'].flag == 'unreachable'
+        mock_Uri.assert_called_once_with('some-repo-url')
+        assert not xml_state.add_repository.called
 
         # check on reachable repo with unknown repo type
         repo_path.get.side_effect = [
             None, 'project', 'repository'
         ]
-        repo_check = Mock()
-        repo_check.get_repo_type.return_value = None
-        mock_SolverRepositoryBase.return_value = repo_check
-        mock_requests_get.side_effect = None
+        mock_probe_repository_type.side_effect = None
+        mock_probe_repository_type.return_value = None
         mock_Uri.reset_mock()
-        with patch('builtins.open', create=True):
-            self.obs.add_obs_repositories(xml_state)
-            mock_Uri.assert_called_once_with('obs://project/repository')
-            assert not xml_state.add_repository.called
+        self.obs.repository_probes.clear()
+        repo_status = self.obs.add_obs_repositories(xml_state)
+        assert repo_status['http://example.com/repo'].flag == \
+            'repo_type_unknown'
+        mock_Uri.assert_called_once_with('obs://project/repository')
+        assert not xml_state.add_repository.called
 
         # check on valid processing of one repo
         repo_path.get.side_effect = None
-        repo_check.get_repo_type.return_value = 'rpm-md'
-        mock_requests_get.reset_mock()
+        mock_probe_repository_type.return_value = 'rpm-md'
+        mock_probe_repository_type.reset_mock()
+        self.obs.session.request.reset_mock()
         mock_HTTPBasicAuth.reset_mock()
         mock_Uri.reset_mock()
-        with patch('builtins.open', create=True):
-            self.obs.add_obs_repositories(xml_state)
-            mock_HTTPBasicAuth.assert_called_once_with('bob', 'secret')
+        self.obs.repository_probes.clear()
+        self.obs.add_obs_repositories(xml_state)
+        mock_HTTPBasicAuth.assert_called_once_with('bob', 'secret')
 
-            assert mock_requests_get.call_args_list == [
-                call(
-                    'https://api.opensuse.org/build/Virtualization:'
-                    'Appliances:SelfContained:suse/images/x86_64/'
-                    'box/_buildinfo',
-                    auth=mock_HTTPBasicAuth.return_value,
-                    verify=True
-                ),
-                call(
-                    repo_uri.translate.return_value
-                )
-            ]
+        self.obs.session.request.assert_called_once_with(
+            'GET', 'https://api.opensuse.org/build/Virtualization:'
+            'Appliances:SelfContained:suse/images/x86_64/'
+            'box/_buildinfo', timeout=(10, 60),
+            auth=mock_HTTPBasicAuth.return_value,
+            verify=True, stream=True, headers=None
+        )
+        mock_probe_repository_type.assert_called_once_with(
+            'http://example.com/repo'
+        )
+
+        # ascending priority starting at 1
+        xml_state.add_repository.assert_called_once_with(
+            'http://example.com/repo', 'rpm-md', None, '1'
+        )
+
+        # descending priority starting at 500
+        xml_state.add_repository.reset_mock()
+        mock_probe_repository_type.return_value = 'deb'
+        self.obs.repository_probes.clear()
+        self.obs.add_obs_repositories(xml_state)
+        xml_state.add_repository.assert_called_once_with(
+            'http://example.com/repo', 'deb', None, '500'
+        )
+
+    @patch('kiwi_obs_plugin.obs.SolverRepositoryBase')
+    @patch('kiwi_obs_plugin.obs.Uri')
+    def test_probe_repository_local(self, mock_Uri, mock_SolverRepositoryBase):
+        mock_Uri.return_value.translate.return_value = '/srv/repo'
+        mock_SolverRepositoryBase.return_value.get_repo_type.return_value = \
+            'rpm-md'
+        repo_probe = self.obs._probe_repository('dir:///srv/repo')
+        assert repo_probe == obs_repo_probe_type(
+            url='/srv/repo', repo_type='rpm-md',
+            status=obs_repo_status_type(flag='ok', message='imported')
+        )
+        mock_SolverRepositoryBase.assert_called_once_with(
+            mock_Uri.return_value
+        )
+        assert not self.obs.session.request.called
+
+    @patch.object(OBS, '_probe_repository_type')
+    @patch('kiwi_obs_plugin.obs.Uri')
+    def test_probe_repository_cache(
+        self, mock_Uri, mock_probe_repository_type
+    ):
+        mock_Uri.return_value.translate.return_value = \
+            'http://example.com/repo'
+        self.obs.repository_cache = Mock()
+        self.obs.repository_cache.get.return_value = {
+            'repo_type': 'rpm-md', 'flag': 'ok', 'message': 'imported'
+        }
+        assert self.obs._probe_repository('obs://p/r').repo_type == 'rpm-md'
+        assert not mock_probe_repository_type.called
+
+        self.obs.repository_cache.get.return_value = None
+        mock_probe_repository_type.return_value = 'apt-deb'
+        assert self.obs._probe_repository('obs://p/r').repo_type == 'apt-deb'
+        self.obs.repository_cache.set.assert_called_once_with(
+            'http://example.com/repo', 'apt-deb', 'ok', 'imported'
+        )
+
+        # unreachable repositories are not cached
+        self.obs.repository_cache.set.reset_mock()
+        mock_probe_repository_type.side_effect = \
+            requests.exceptions.ConnectionError
+        assert self.obs._probe_repository('obs://p/r').status.flag == \
+            'unreachable'
+        assert not self.obs.repository_cache.set.called
+
+    @patch.object(OBS, '_create_request')
+    @patch.object(OBS, '_import_buildinfo_paths')
+    @patch.object(OBS, '_probe_repository')
+    def test_add_obs_repositories_repository_cache(
+        self, mock_probe_repository, mock_import_buildinfo_paths,
+        mock_create_request
+    ):
+        mock_import_buildinfo_paths.return_value = [{'url': 'http://r'}]
+        mock_probe_repository.return_value = obs_repo_probe_type(
+            url='http://r', repo_type='rpm-md',
+            status=obs_repo_status_type(flag='ok', message='imported')
+        )
+        xml_state = MagicMock()
+        repository_section_obs = MagicMock()
+        repository_section_obs.get_source().get_path.return_value = \
+            'obsrepositories'
+        xml_state.get_repository_sections.return_value = \
+            [repository_section_obs]
+        self.obs.repository_cache = Mock()
+        self.obs.add_obs_repositories(xml_state)
+        self.obs.repository_cache.load.assert_called_once_with()
+        self.obs.repository_cache.save.assert_called_once_with()
+
+    def test_probe_repository_type(self):
+        def request(method, url, timeout, **kwargs):
+            response = Mock()
+            response.status_code = 404
+            response.ok = url in existing_urls
+            if method == 'GET':
+                response.ok = True
+                response.text = listing
+            return response
 
-            # ascending priority starting at 1
-            xml_state.add_repository.assert_called_once_with(
-                repo_uri.translate.return_value, 'rpm-md', None, '1'
+        existing_urls = ['http://example.com/repo/Packages.gz']
+        self.obs.session.request.side_effect = request
+        assert self.obs._probe_repository_type(
+            'http://example.com/repo/'
+        ) == 'apt-deb'
+        assert self.obs.session.request.call_args_list == [
+            call(
+                'HEAD', 'http://example.com/repo/repodata/repomd.xml',
+                timeout=(10, 60), allow_redirects=True
+            ),
+            call(
+                'HEAD', 'http://example.com/repo/Packages.gz',
+                timeout=(10, 60), allow_redirects=True
             )
+        ]
 
-            # descending priority starting at 500
-            xml_state.add_repository.reset_mock()
-            repo_check.get_repo_type.return_value = 'deb'
-            self.obs.add_obs_repositories(xml_state)
-            xml_state.add_repository.assert_called_once_with(
-                repo_uri.translate.return_value, 'deb', None, '500'
+        existing_urls = ['http://example.com/repo/repodata/repomd.xml']
+        assert self.obs._probe_repository_type(
+            'http://example.com/repo'
+        ) == 'rpm-md'
+
+        existing_urls = []
+        listing = '<a href="repo.db.sig">repo.db.sig</a>'
+        self.obs.session.request.reset_mock()
+        assert self.obs._probe_repository_type(
+            'http://example.com/repo'
+        ) == 'pacman'
+        assert self.obs.session.request.call_args_list[-1] == call(
+            'GET', 'http://example.com/repo/x86_64/', timeout=(10, 60)
+        )
+
+        listing = 'index'
+        assert self.obs._probe_repository_type(
+            'http://example.com/repo'
+        ) is None
+
+    def test_probe_url_without_head_support(self):
+        head_response = Mock()
+        head_response.status_code = 405
+        response = Mock()
+        response.status_code = 206
+        response.ok = True
+        self.obs.session.request.side_effect = [head_response, response]
+        assert self.obs._probe_url('http://example.com/file') is True
+        assert self.obs.session.request.call_args_list[-1] == call(
+            'GET', 'http://example.com/file', timeout=(10, 60),
+            headers={'Range': 'bytes=0-0'}, stream=True
+        )
+        response.close.assert_called_once_with()
+
+    @patch('kiwi_obs_plugin.obs.time.sleep')
+    @patch('kiwi_obs_plugin.obs.random.uniform')
+    def test_send_retries(self, mock_uniform, mock_sleep):
+        self.obs.retries = 3
+        mock_uniform.side_effect = lambda low, high: high
+        server_error = Mock()
+        server_error.status_code = 502
+        throttled = Mock()
+        throttled.status_code = 429
+        response = Mock()
+        response.status_code = 200
+        self.obs.session.request.side_effect = [
+            requests.exceptions.ConnectTimeout, server_error,
+            throttled, response
+        ]
+        assert self.obs._send('GET', 'https://example.com/a') == response
+        assert mock_sleep.call_args_list == [call(0.5), call(1), call(2)]
+        server_error.close.assert_called_once_with()
+        assert self.obs.circuit_breaker.failures == {}
+
+        # retries exhausted
+        self.obs.retries = 1
+        self.obs.session.request.side_effect = [server_error, server_error]
+        assert self.obs._send('GET', 'https://example.com/a') == \
+            server_error
+        self.obs.session.request.side_effect = \
+            requests.exceptions.ReadTimeout
+        with raises(requests.exceptions.ReadTimeout):
+            self.obs._send('GET', 'https://example.org/a')
+
+    def test_send_host_limiter(self):
+        self.obs.host_limiter = Mock()
+        response = Mock()
+        close = response.close
+        response.status_code = 200
+        self.obs.session.request.side_effect = None
+        self.obs.session.request.return_value = response
+        self.obs._send('GET', 'https://example.com/a')
+        self.obs.host_limiter.acquire.assert_called_once_with('example.com')
+        self.obs.host_limiter.release.assert_called_once_with('example.com')
+
+        # streamed responses are in flight until they are closed
+        self.obs.host_limiter.release.reset_mock()
+        self.obs._send('GET', 'https://example.com/a', stream=True)
+        assert not self.obs.host_limiter.release.called
+        response.close()
+        response.close()
+        self.obs.host_limiter.release.assert_called_once_with('example.com')
+        assert close.call_count == 2
+
+        # the slot is released if the request fails
+        self.obs.host_limiter.release.reset_mock()
+        self.obs.session.request.side_effect = ValueError
+        with raises(ValueError):
+            self.obs._send('GET', 'https://example.com/a')
+        self.obs.host_limiter.release.assert_called_once_with('example.com')
+
+    @patch('kiwi_obs_plugin.obs.time.sleep')
+    def test_send_circuit_breaker(self, mock_sleep):
+        # more retries than the circuit breaker threshold
+        self.obs.retries = 5
+        self.obs.session.request.side_effect = \
+            requests.exceptions.ConnectionError
+        for request in range(3):
+            self.obs.session.request.reset_mock()
+            mock_sleep.reset_mock()
+            with raises(requests.exceptions.ConnectionError):
+                self.obs._send('HEAD', f'http://dead.example.com/r{request}')
+            # all retries of a request are sent
+            assert self.obs.session.request.call_count == 6
+            assert mock_sleep.call_count == 5
+        # the host is skipped after CIRCUIT_BREAKER_THRESHOLD
+        # failed requests
+        self.obs.session.request.reset_mock()
+        mock_sleep.reset_mock()
+        with raises(requests.exceptions.ConnectionError):
+            self.obs._send('HEAD', 'http://dead.example.com/r3')
+        assert not self.obs.session.request.called
+        assert not mock_sleep.called
+
+        # requests which still fail with a server error count too
+        server_error = Mock()
+        server_error.status_code = 502
+        self.obs.retries = 0
+        self.obs.session.request.side_effect = None
+        self.obs.session.request.return_value = server_error
+        for request in range(3):
+            self.obs._send('GET', 'http://broken.example.com/a')
+        with raises(requests.exceptions.ConnectionError):
+            self.obs._send('GET', 'http://broken.example.com/a')
+
+        # the OBS API server is never skipped
+        self.obs.session.request.reset_mock()
+        for request in range(4):
+            self.obs._send(
+                'GET', 'https://api.opensuse.org/source/project/package'
             )
+        assert self.obs.session.request.call_count == 4
+        assert 'api.opensuse.org' not in self.obs.circuit_breaker.failures
@@ -0,0 +1,64 @@
+import os
+import json
+from tempfile import TemporaryDirectory
+from mock import patch
+
+from kiwi_obs_plugin.repository_cache import RepositoryCache
+
+
+class TestRepositoryCache:
+    def setup(self):
+        self.tmpdir = TemporaryDirectory()
+        self.cache_file = os.sep.join(
+            [self.tmpdir.name, 'cache', 'repositories.json']
+        )
+        self.repository_cache = RepositoryCache(self.cache_file, 60)
+
+    def teardown(self):
+        self.tmpdir.cleanup()
+
+    def test_load_without_cache_file(self):
+        self.repository_cache.load()
+        assert self.repository_cache.get('http://r') is None
+
+    def test_load_invalid_cache_file(self):
+        os.makedirs(os.path.dirname(self.cache_file))
+        with open(self.cache_file, 'w') as cache:
+            cache.write('[]')
+        self.repository_cache.load()
+        assert self.repository_cache.entries == {}
+        with open(self.cache_file, 'w') as cache:
+            cache.write('{')
+        self.repository_cache.load()
+        assert self.repository_cache.entries == {}
+
+    @patch('kiwi_obs_plugin.repository_cache.time.time')
+    def test_set_get_save(self, mock_time):
+        mock_time.return_value = 1000
+        # nothing to save
+        self.repository_cache.save()
+        assert not os.path.exists(self.cache_file)
+
+        self.repository_cache.set('http://r1', 'rpm-md', 'ok', 'imported')
+        assert self.repository_cache.get('http://r1')['repo_type'] == \
+            'rpm-md'
+        os.makedirs(os.path.dirname(self.cache_file))
+        with open(self.cache_file, 'w') as cache:
+            json.dump(
+                {
+                    'http://r2': {'repo_type': 'apt-deb', 'time': 990},
+                    'http://stale': {'repo_type': 'apt-deb', 'time': 0}
+                }, cache
+            )
+        self.repository_cache.save()
+        with open(self.cache_file) as cache:
+            assert sorted(json.load(cache)) == ['http://r1', 'http://r2']
+
+        other_repository_cache = RepositoryCache(self.cache_file, 60)
+        other_repository_cache.load()
+        assert other_repository_cache.get('http://r2')['repo_type'] == \
+            'apt-deb'
+
+        # entries expire after ttl
+        mock_time.return_value = 1100
+        assert other_repository_cache.get('http://r1') is None
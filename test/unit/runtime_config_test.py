@@ -0,0 +1,91 @@
+from mock import patch
+
+from kiwi_obs_plugin.runtime_config import RuntimeConfig
+
+
+class TestRuntimeConfig:
+    def setup(self):
+        self.runtime_config = RuntimeConfig()
+
+    @patch.dict('os.environ', {'XDG_CACHE_HOME': '/var/cache/user'})
+    def test_get_obs_cache_dir_default(self):
+        with patch('kiwi.runtime_config.RUNTIME_CONFIG', {}):
+            assert self.runtime_config.get_obs_cache_dir() == \
+                '/var/cache/user/kiwi-obs-plugin'
+
+    def test_get_obs_cache_dir(self):
+        with patch(
+            'kiwi.runtime_config.RUNTIME_CONFIG',
+            {'obs': [{'cache_dir': '/var/cache/obs'}]}
+        ):
+            assert self.runtime_config.get_obs_cache_dir() == \
+                '/var/cache/obs'
+
+    def test_get_obs_source_cache_size(self):
+        with patch('kiwi.runtime_config.RUNTIME_CONFIG', {}):
+            assert self.runtime_config.get_obs_source_cache_size() == 1024
+        with patch(
+            'kiwi.runtime_config.RUNTIME_CONFIG',
+            {'obs': [{'source_cache_size': 0}]}
+        ):
+            assert self.runtime_config.get_obs_source_cache_size() == 0
+
+    def test_get_obs_repository_cache_ttl(self):
+        with patch('kiwi.runtime_config.RUNTIME_CONFIG', {}):
+            assert self.runtime_config.get_obs_repository_cache_ttl() == 3600
+        with patch(
+            'kiwi.runtime_config.RUNTIME_CONFIG',
+            {'obs': [{'repository_cache_ttl': 0}]}
+        ):
+            assert self.runtime_config.get_obs_repository_cache_ttl() == 0
+
+    def test_get_obs_http_cache_size(self):
+        with patch('kiwi.runtime_config.RUNTIME_CONFIG', {}):
+            assert self.runtime_config.get_obs_http_cache_size() == 64
+        with patch(
+            'kiwi.runtime_config.RUNTIME_CONFIG',
+            {'obs': [{'http_cache_size': 0}]}
+        ):
+            assert self.runtime_config.get_obs_http_cache_size() == 0
+
+    def test_get_obs_timeouts_and_retries(self):
+        with patch('kiwi.runtime_config.RUNTIME_CONFIG', {}):
+            assert self.runtime_config.get_obs_connect_timeout() == 10
+            assert self.runtime_config.get_obs_read_timeout() == 60
+            assert self.runtime_config.get_obs_retries() == 3
+        with patch(
+            'kiwi.runtime_config.RUNTIME_CONFIG', {
+                'obs': [
+                    {'connect_timeout': 2.5},
+                    {'read_timeout': 30},
+                    {'retries': 0}
+                ]
+            }
+        ):
+            assert self.runtime_config.get_obs_connect_timeout() == 2.5
+            assert self.runtime_config.get_obs_read_timeout() == 30
+            assert self.runtime_config.get_obs_retries() == 0
+
+    def test_get_obs_host_limits(self):
+        with patch('kiwi.runtime_config.RUNTIME_CONFIG', {}):
+            assert self.runtime_config.get_obs_host_request_rate() == 0
+            assert self.runtime_config.get_obs_host_max_requests() == 8
+        with patch(
+            'kiwi.runtime_config.RUNTIME_CONFIG', {
+                'obs': [
+                    {'host_request_rate': 2.5},
+                    {'host_max_requests': 0}
+                ]
+            }
+        ):
+            assert self.runtime_config.get_obs_host_request_rate() == 2.5
+            assert self.runtime_config.get_obs_host_max_requests() == 0
+
+    def test_get_obs_git_cache_size(self):
+        with patch('kiwi.runtime_config.RUNTIME_CONFIG', {}):
+            assert self.runtime_config.get_obs_git_cache_size() == 2048
+        with patch(
+            'kiwi.runtime_config.RUNTIME_CONFIG',
+            {'obs': [{'git_cache_size': 0}]}
+        ):
+            assert self.runtime_config.get_obs_git_cache_size() == 0
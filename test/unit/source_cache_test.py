@@ -0,0 +1,80 @@
+import os
+from tempfile import TemporaryDirectory
+from mock import patch
+
+from kiwi_obs_plugin.source_cache import SourceCache
+
+MD5_A = '0cc175b9c0f1b6a831c399e269772661'
+MD5_B = '92eb5ffee6ae2fec3ad71c777531578f'
+
+
+class TestSourceCache:
+    def setup(self):
+        self.tmpdir = TemporaryDirectory()
+        self.cache_dir = os.sep.join([self.tmpdir.name, 'cache'])
+        self.source_cache = SourceCache(self.cache_dir, 1)
+        for name in ('a', 'b'):
+            with open(os.sep.join([self.tmpdir.name, name]), 'w') as source:
+                source.write(name)
+
+    def teardown(self):
+        self.tmpdir.cleanup()
+
+    def _path(self, name):
+        return os.sep.join([self.tmpdir.name, name])
+
+    def test_add_and_get(self):
+        assert self.source_cache.get(MD5_A, self._path('target')) is False
+        self.source_cache.add(MD5_A, self._path('a'))
+        # adding an existing entry is a noop
+        self.source_cache.add(MD5_A, self._path('a'))
+        assert os.path.isfile(
+            os.sep.join([self.cache_dir, '0c', MD5_A])
+        )
+        assert self.source_cache.get(MD5_A, self._path('target')) is True
+        with open(self._path('target')) as target:
+            assert target.read() == 'a'
+
+    def test_add_ignores_md5_mismatch(self):
+        self.source_cache.add(MD5_B, self._path('a'))
+        assert not os.path.exists(self.cache_dir)
+
+    def test_add_ignores_invalid_md5(self):
+        self.source_cache.add('../../etc', self._path('a'))
+        self.source_cache.add(None, self._path('a'))
+        assert not os.path.exists(self.cache_dir)
+
+    def test_get_drops_modified_entry(self):
+        self.source_cache.add(MD5_A, self._path('a'))
+        entry = os.sep.join([self.cache_dir, '0c', MD5_A])
+        os.remove(entry)
+        with open(entry, 'w') as modified:
+            modified.write('modified')
+        assert self.source_cache.get(MD5_A, self._path('target')) is False
+        assert not os.path.exists(entry)
+
+    def test_evict(self):
+        self.source_cache.add(MD5_A, self._path('a'))
+        self.source_cache.add(MD5_B, self._path('b'))
+        entry_a = os.sep.join([self.cache_dir, '0c', MD5_A])
+        entry_b = os.sep.join([self.cache_dir, '92', MD5_B])
+        os.utime(entry_a, (0, 0))
+        self.source_cache.evict()
+        assert not os.path.exists(entry_a)
+        assert os.path.exists(entry_b)
+
+    @patch('os.remove')
+    @patch('os.stat')
+    @patch('os.walk')
+    def test_evict_ignores_vanished_entries(
+        self, mock_os_walk, mock_os_stat, mock_remove
+    ):
+        mock_os_walk.return_value = [
+            (self.cache_dir, [], [MD5_A, MD5_B])
+        ]
+        mock_os_stat.side_effect = [
+            OSError, os.stat_result((0, 0, 0, 0, 0, 0, 10, 0, 0, 0))
+        ]
+        mock_remove.side_effect = OSError
+        self.source_cache.evict()
+        assert mock_remove.call_count == 1
@@ -1,10 +1,21 @@
+import os
 import sys
+import shutil
+from tempfile import (
+    NamedTemporaryFile, TemporaryDirectory
+)
 
 from mock import (
-    Mock, patch
+    Mock, patch, call
 )
+from pytest import raises
 from kiwi_obs_plugin.tasks.image_obs import ImageObsTask
-from kiwi_obs_plugin.obs import obs_checkout_type
+from kiwi_obs_plugin.obs import (
+    OBS, obs_checkout_type, obs_package_type
+)
+from kiwi_obs_plugin.exceptions import (
+    KiwiOBSPluginJobsError, KiwiOBSPluginSourceError
+)
 
 
 class TestImageObsTask:
@@ -25,8 +36,16 @@ class TestImageObsTask:
         self.task.command_args['--user'] = 'obs_user'
         self.task.command_args['--arch'] = None
         self.task.command_args['--repo'] = False
+        self.task.command_args['--jobs'] = None
+        self.task.command_args['--no-cache'] = False
         self.task.command_args['--ssl-no-verify'] = None
         self.task.command_args['--force'] = False
+        self.task.command_args['--sync'] = False
+        self.task.command_args['--bulk'] = False
+        self.task.command_args['--pipeline'] = False
+        self.task.command_args['--all-flavors'] = False
+        self.task.command_args['--flavors'] = None
+        self.task.command_args['--manifest'] = None
         self.task.command_args['--target-dir'] = '../data/target_dir'
 
     @patch('kiwi_obs_plugin.tasks.image_obs.Help')
@@ -50,14 +69,16 @@ class TestImageObsTask:
             profile='Kernel'
         )
         mock_OBS.return_value = obs
+        mock_OBS.get_image_description_file.return_value = 'appliance.kiwi'
         self._init_command_args()
         self.task.command_args['--image'] = 'project/image'
         self.task.process()
         mock_OBS.assert_called_once_with(
-            'project/image', False, 'obs_user'
+            'project/image', False, 'obs_user', None, 4, True
         )
         obs.fetch_obs_image.assert_called_once_with(
-            '../data/target_dir', False, []
+            '../data/target_dir', False, [], False, False, False,
+            'x86_64', 'images'
         )
         obs.add_obs_repositories.assert_called_once_with(
             self.task.xml_state, 'Kernel', 'x86_64', 'images'
@@ -68,3 +89,378 @@ class TestImageObsTask:
         obs.write_kiwi_config_from_state.assert_called_once_with(
             self.task.xml_state, '../data/appliance.kiwi'
         )
+
+    @patch('kiwi_obs_plugin.tasks.image_obs.OBS')
+    def test_process_image_obs_image_invalid_jobs(self, mock_OBS):
+        self._init_command_args()
+        self.task.command_args['--image'] = 'project/image'
+        for jobs in ['0', '-1', 'many']:
+            self.task.command_args['--jobs'] = jobs
+            with raises(KiwiOBSPluginJobsError):
+                self.task.process()
+        assert not mock_OBS.called
+
+    @patch('kiwi_obs_plugin.tasks.image_obs.OBS')
+    def test_process_image_obs_image_flavors(self, mock_OBS):
+        obs = Mock()
+        obs.fetch_obs_image.return_value = obs_checkout_type(
+            checkout_dir='../data',
+            profile='Kernel'
+        )
+        mock_OBS.return_value = obs
+        mock_OBS.get_image_description_file.return_value = 'appliance.kiwi'
+        mock_OBS.get_multibuild_profiles.return_value = ['Kernel', 'System']
+        self._init_command_args()
+        self.task.command_args['--image'] = 'project/image'
+        self.task.command_args['--all-flavors'] = True
+        self.task.process()
+        mock_OBS.get_multibuild_profiles.assert_called_once_with('../data')
+        assert obs.prefetch_obs_repositories.call_args_list == [
+            call('Kernel', 'x86_64', 'images'),
+            call('System', 'x86_64', 'images')
+        ]
+        assert [
+            add_call[0][1:] for add_call in
+            obs.add_obs_repositories.call_args_list
+        ] == [
+            ('Kernel', 'x86_64', 'images'),
+            ('System', 'x86_64', 'images')
+        ]
+        assert [
+            write_call[0][1] for write_call in
+            obs.write_kiwi_config_from_state.call_args_list
+        ] == [
+            '../data/appliance.Kernel.kiwi', '../data/appliance.System.kiwi'
+        ]
+        assert self.task.global_args['--profile'] == ['System']
+
+        # chosen flavors
+        obs.add_obs_repositories.reset_mock()
+        self.task.command_args['--all-flavors'] = False
+        self.task.command_args['--flavors'] = 'System'
+        self.task.process()
+        obs.add_obs_repositories.assert_called_once_with(
+            self.task.xml_state, 'System', 'x86_64', 'images'
+        )
+
+        # unknown flavor
+        self.task.command_args['--flavors'] = 'System,Foo'
+        with raises(KiwiOBSPluginSourceError):
+            self.task.process()
+
+    @patch('kiwi_obs_plugin.tasks.image_obs.OBS')
+    def test_process_image_obs_image_flavors_rerun(self, mock_OBS):
+        with TemporaryDirectory() as checkout_dir:
+            # the description is extracted by a source service and
+            # not part of the OBS sources
+            shutil.copy('../data/appliance.kiwi', checkout_dir)
+            obs = Mock()
+            obs.fetch_obs_image.return_value = obs_checkout_type(
+                checkout_dir=checkout_dir,
+                profile='Kernel'
+            )
+            obs.write_kiwi_config_from_state.side_effect = \
+                lambda xml_state, config_file: shutil.copy(
+                    os.sep.join([checkout_dir, 'appliance.kiwi']),
+                    config_file
+                )
+            mock_OBS.return_value = obs
+            mock_OBS.get_image_description_file.side_effect = \
+                OBS.get_image_description_file
+            mock_OBS.set_image_description_file.side_effect = \
+                OBS.set_image_description_file
+            mock_OBS.get_multibuild_profiles.return_value = [
+                'Kernel', 'System'
+            ]
+            self._init_command_args()
+            self.task.command_args['--image'] = 'project/image'
+            self.task.command_args['--all-flavors'] = True
+            for run in range(2):
+                obs.write_kiwi_config_from_state.reset_mock()
+                self.task.process()
+                # the written config files are never taken as
+                # the image description
+                assert [
+                    write_call[0][1] for write_call in
+                    obs.write_kiwi_config_from_state.call_args_list
+                ] == [
+                    os.sep.join([checkout_dir, 'appliance.Kernel.kiwi']),
+                    os.sep.join([checkout_dir, 'appliance.System.kiwi'])
+                ]
+
+    @patch('kiwi_obs_plugin.tasks.image_obs.OBS')
+    def test_process_image_obs_image_arches(self, mock_OBS):
+        obs = Mock()
+        obs.fetch_obs_image.return_value = obs_checkout_type(
+            checkout_dir='../data',
+            profile='Kernel'
+        )
+        mock_OBS.return_value = obs
+        mock_OBS.get_image_description_file.return_value = 'appliance.kiwi'
+        mock_OBS.get_multibuild_profiles.return_value = ['Kernel', 'System']
+        self._init_command_args()
+        self.task.command_args['--image'] = 'project/image'
+        self.task.command_args['--arch'] = 'x86_64,aarch64'
+        self.task.process()
+        obs.fetch_obs_image.assert_called_once_with(
+            '../data/target_dir', False, [], False, False, False,
+            'x86_64', 'images'
+        )
+        assert obs.prefetch_obs_repositories.call_args_list == [
+            call('Kernel', 'x86_64', 'images'),
+            call('Kernel', 'aarch64', 'images')
+        ]
+        assert [
+            write_call[0][1] for write_call in
+            obs.write_kiwi_config_from_state.call_args_list
+        ] == [
+            '../data/appliance.x86_64.kiwi', '../data/appliance.aarch64.kiwi'
+        ]
+
+        # flavors and arches
+        obs.write_kiwi_config_from_state.reset_mock()
+        self.task.command_args['--all-flavors'] = True
+        self.task.process()
+        assert [
+            write_call[0][1] for write_call in
+            obs.write_kiwi_config_from_state.call_args_list
+        ] == [
+            '../data/appliance.Kernel.x86_64.kiwi',
+            '../data/appliance.Kernel.aarch64.kiwi',
+            '../data/appliance.System.x86_64.kiwi',
+            '../data/appliance.System.aarch64.kiwi'
+        ]
+
+        # no multibuild profile
+        obs.write_kiwi_config_from_state.reset_mock()
+        self.task.command_args['--all-flavors'] = False
+        obs.fetch_obs_image.return_value = obs_checkout_type(
+            checkout_dir='../data',
+            profile=None
+        )
+        with patch.object(self.task, 'load_xml_description'):
+            self.task.process()
+        assert self.task.global_args['--profile'] == []
+        obs.add_obs_repositories.assert_called_with(
+            self.task.xml_state, None, 'aarch64', 'images'
+        )
+        assert [
+            write_call[0][1] for write_call in
+            obs.write_kiwi_config_from_state.call_args_list
+        ] == [
+            '../data/appliance.x86_64.kiwi', '../data/appliance.aarch64.kiwi'
+        ]
+
+    def test_manifest_command_line(self):
+        sys.argv = [
+            sys.argv[0],
+            'image', 'obs',
+            '--manifest', 'nightly.txt',
+            '--target-dir', '../data/target_dir'
+        ]
+        task = ImageObsTask()
+        assert task.command_args['--manifest'] == 'nightly.txt'
+
+    @patch('kiwi_obs_plugin.tasks.image_obs.OBS')
+    def test_process_image_obs_manifest(self, mock_OBS):
+        def for_image(image):
+            image_obs = Mock()
+            (image_obs.project, image_obs.package) = image.split('/')
+            image_obs.fetch_obs_image.return_value = obs_checkout_type(
+                checkout_dir='../data',
+                profile='Kernel'
+            )
+            if image == 'p/c':
+                image_obs.fetch_obs_image.side_effect = Exception('gone')
+            if image == 'p/b':
+                image_obs.add_obs_repositories.side_effect = \
+                    Exception('no buildinfo')
+            image_obses[image] = image_obs
+            return image_obs
+
+        image_obses = {}
+        mock_OBS.return_value.for_image.side_effect = for_image
+        mock_OBS.get_image_description_file.return_value = 'appliance.kiwi'
+        self._init_command_args()
+        with NamedTemporaryFile('w') as manifest:
+            manifest.write('p/a\np/a:System@aarch64\np/b\np/c\n')
+            manifest.flush()
+            self.task.command_args['--manifest'] = manifest.name
+            with patch('kiwi_obs_plugin.tasks.image_obs.log') as mock_log:
+                with raises(KiwiOBSPluginSourceError):
+                    self.task.process()
+        mock_OBS.assert_called_once_with(
+            'p/a', False, 'obs_user', None, 4, True
+        )
+        image_obses['p/a'].fetch_obs_image.assert_called_once_with(
+            '../data/target_dir/p/a', False, None, False, False
+        )
+        assert image_obses['p/a'].prefetch_obs_repositories.call_args_list[
+            :2
+        ] == [
+            call('Kernel', 'x86_64', 'images'),
+            call('System', 'aarch64', 'images')
+        ]
+        assert [
+            write_call[0][1] for write_call in
+            image_obses['p/a'].write_kiwi_config_from_state.call_args_list
+        ] == [
+            '../data/appliance.Kernel.x86_64.kiwi',
+            '../data/appliance.System.aarch64.kiwi'
+        ]
+        assert [
+            write_call[0][1] for write_call in
+            image_obses['p/b'].write_kiwi_config_from_state.call_args_list
+        ] == []
+        summary = [
+            log_call[0][0] for log_call in mock_log.info.call_args_list
+            if log_call[0][0].startswith('--> p/')
+        ]
+        assert [line.rsplit(' (', 1)[0] for line in summary] == [
+            '--> p/a: ok',
+            '--> p/a:System@aarch64: ok',
+            '--> p/b: failed: no buildinfo',
+            '--> p/c: failed: gone'
+        ]
+
+    @patch('kiwi_obs_plugin.tasks.image_obs.OBS')
+    def test_process_image_obs_manifest_arches(self, mock_OBS):
+        image_obs = mock_OBS.return_value.for_image.return_value
+        image_obs.project = 'p'
+        image_obs.package = 'a'
+        image_obs.fetch_obs_image.return_value = obs_checkout_type(
+            checkout_dir='../data',
+            profile='Kernel'
+        )
+        mock_OBS.get_image_description_file.return_value = 'appliance.kiwi'
+        self._init_command_args()
+        self.task.command_args['--arch'] = 'x86_64,aarch64'
+        with NamedTemporaryFile('w') as manifest:
+            manifest.write('p/a\n')
+            manifest.flush()
+            self.task.command_args['--manifest'] = manifest.name
+            self.task.process()
+        assert [
+            add_call[0][1:] for add_call in
+            image_obs.add_obs_repositories.call_args_list
+        ] == [
+            ('Kernel', 'x86_64', 'images'),
+            ('Kernel', 'aarch64', 'images')
+        ]
+        assert [
+            write_call[0][1] for write_call in
+            image_obs.write_kiwi_config_from_state.call_args_list
+        ] == [
+            '../data/appliance.x86_64.kiwi', '../data/appliance.aarch64.kiwi'
+        ]
+
+    @staticmethod
+    def _fail_for_arch(targets, arch):
+        if targets[0][1] == arch:
+            raise Exception(f'{arch} failed')
+        return []
+
+    @patch('kiwi_obs_plugin.tasks.image_obs.OBS')
+    def test_process_image_obs_project(self, mock_OBS):
+        def for_image(image):
+            image_obs = Mock()
+            (image_obs.project, image_obs.package) = image.split('/')
+            image_obs.fetch_obs_image.return_value = obs_checkout_type(
+                checkout_dir='../data',
+                profile='Kernel'
+            )
+            image_obses[image] = image_obs
+            return image_obs
+
+        image_obses = {}
+        obs = mock_OBS.return_value
+        obs.project = 'p'
+        obs.for_image.side_effect = for_image
+        obs.get_image_packages.return_value = [
+            obs_package_type(name='a', srcmd5='x'),
+            obs_package_type(name='b', srcmd5='y')
+        ]
+        mock_OBS.get_completed_srcmd5.side_effect = \
+            lambda checkout_dir, arch: \
+            'x' if checkout_dir.endswith('/a') else None
+        mock_OBS.get_image_description_file.return_value = 'appliance.kiwi'
+        self._init_command_args()
+        self.task.command_args['--image'] = 'p/'
+        self.task.command_args['--arch'] = 'x86_64,aarch64'
+        self.task.process()
+        mock_OBS.assert_called_once_with('p/', False, 'obs_user', None, 4, True)
+        assert mock_OBS.get_completed_srcmd5.call_args_list == [
+            call('../data/target_dir/p/a', 'x86_64'),
+            call('../data/target_dir/p/a', 'aarch64'),
+            call('../data/target_dir/p/b', 'x86_64'),
+            call('../data/target_dir/p/b', 'aarch64')
+        ]
+        # unchanged package a is skipped
+        assert list(image_obses) == ['p/b']
+        # existing package dirs are updated
+        image_obses['p/b'].fetch_obs_image.assert_called_once_with(
+            '../data/target_dir/p/b', False, None, True, False
+        )
+        assert [
+            write_call[0][1] for write_call in
+            image_obses['p/b'].write_kiwi_config_from_state.call_args_list
+        ] == [
+            '../data/appliance.x86_64.kiwi', '../data/appliance.aarch64.kiwi'
+        ]
+        # the config files of both arches got written
+        assert mock_OBS.set_completed_arch.call_args_list == [
+            call('../data', 'aarch64'), call('../data', 'x86_64')
+        ]
+
+        # a package completed for some arches only, e.g. after a
+        # failed run or with a new --arch, is checked out again
+        image_obses.clear()
+        mock_OBS.set_completed_arch.reset_mock()
+        mock_OBS.get_completed_srcmd5.side_effect = \
+            lambda checkout_dir, arch: 'y' if checkout_dir.endswith('/b') \
+            else 'x' if arch == 'x86_64' else None
+        self.task.process()
+        assert list(image_obses) == ['p/a']
+
+        # a failed arch is not recorded as completed
+        image_obses.clear()
+        mock_OBS.set_completed_arch.reset_mock()
+        with patch.object(
+            self.task, '_process_targets',
+            side_effect=lambda checkout_dir, targets, *args:
+            self._fail_for_arch(targets, 'aarch64')
+        ):
+            with raises(KiwiOBSPluginSourceError):
+                self.task.process()
+        mock_OBS.set_completed_arch.assert_called_once_with(
+            '../data', 'x86_64'
+        )
+
+        # all packages are checked out with --force
+        image_obses.clear()
+        self.task.command_args['--force'] = True
+        self.task.process()
+        assert sorted(image_obses) == ['p/a', 'p/b']
+        image_obses['p/a'].fetch_obs_image.assert_called_once_with(
+            '../data/target_dir/p/a', True, None, False, False
+        )
+
+        # the config file of a single arch does not replace the
+        # description from OBS
+        image_obses.clear()
+        self.task.command_args['--arch'] = 'aarch64'
+        self.task.process()
+        assert [
+            write_call[0][1] for write_call in
+            image_obses['p/a'].write_kiwi_config_from_state.call_args_list
+        ] == ['../data/appliance.aarch64.kiwi']
+        self.task.command_args['--arch'] = 'x86_64,aarch64'
+
+        # nothing changed
+        image_obses.clear()
+        self.task.command_args['--force'] = False
+        mock_OBS.get_completed_srcmd5.side_effect = \
+            lambda checkout_dir, arch: \
+            'x' if checkout_dir.endswith('/a') else 'y'
+        self.task.process()
+        assert not image_obses